@@ -0,0 +1,241 @@
+"""
+Measures how the text and voice analysis entry points scale, on synthetic datasets served from memory.
+
+Every entry point runs against the real db_stuff with the MongoDB connection disabled: the message store is
+loaded with the synthetic messages and the voice session cache with the synthetic sessions, so the analysis
+takes its local paths without a database. Analysis jobs run on threads so their memory shows in this process,
+and the result cache is disabled so every run computes.
+
+Reported per entry point: best wall time of the runs, peak RSS growth over the process while it ran, and the
+peak of the memory it allocated (tracemalloc, in a separate run since tracing slows everything down).
+
+Run from the repository root:
+    python -m benchmarks.bench_analysis [--scales 10k 100k 1m 10m] [--save-baseline | --compare]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Final, TypedDict
+
+import cachetools
+import psutil
+
+# Loaded before the analysis modules like when the bot starts, they import each other through it
+from utils import db_stuff
+
+# isort: split
+from benchmarks.corpus import SCALES, CorpusShape, channel_ids, synthetic_messages, synthetic_voice_sessions, user_ids, voice_channel_ids
+from command_utils.analysis import text_analysis, voice_analysis
+from command_utils.analysis.executor import analysis_executor
+from command_utils.analysis.result_cache import result_cache
+from config.bot_config import BotConfig
+
+BASELINE_PATH: Final[Path] = Path(__file__).parent / "analysis_baseline.json"
+GUILD_ID: Final[int] = 1
+
+
+class Measurement(TypedDict):
+    seconds: float
+    peak_rss_mb: float
+    alloc_peak_mb: float
+
+
+# The smallest changes counted as regressions, below these differences are noise
+MIN_REGRESSION: Final[Measurement] = Measurement(seconds=0.005, peak_rss_mb=2.0, alloc_peak_mb=1.0)
+
+
+class RSSSampler:
+    """Samples the resident set size of this process in a background thread, to find its peak during a run"""
+    
+    def __init__(self, interval: float = 0.002):
+        self.interval: float = interval
+        self._process: psutil.Process = psutil.Process(os.getpid())
+        self._stop: threading.Event = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.start_rss: int = 0
+        self.peak_rss: int = 0
+    
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, self._process.memory_info().rss)
+    
+    def __enter__(self) -> RSSSampler:
+        self.start_rss = self.peak_rss = self._process.memory_info().rss
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *_: object) -> None:
+        self._stop.set()
+        assert self._thread is not None
+        self._thread.join()
+        self.peak_rss = max(self.peak_rss, self._process.memory_info().rss)
+    
+    @property
+    def growth_mb(self) -> float:
+        return (self.peak_rss - self.start_rss) / 2 ** 20
+
+
+class InMemoryDB:
+    """Stands in for MongoDB by filling db_stuff's in-memory caches, with the connection disabled"""
+    
+    def __init__(self, messages: list[dict[str, Any]], sessions: list[dict[str, Any]]):
+        self.messages: list[dict[str, Any]] = messages
+        self.sessions: list[dict[str, Any]] = sessions
+    
+    def install(self) -> None:
+        db_stuff.disable_connection()
+        store = db_stuff.message_store
+        store.refresh_interval = store.full_resync_interval = float("inf")
+        store.load_all(self.messages)
+        # A benchmark at a large scale runs longer than the usual five minute time to live
+        db_stuff.voice_download_cache = cachetools.TTLCache(maxsize=1, ttl=float("inf"))
+        db_stuff.voice_download_cache[None] = self.sessions
+        text_analysis._message_frame = None
+        db_stuff.voice_index = None
+
+
+def stand_in_context(shape: CorpusShape) -> Any:
+    """The parts of a command context the analysis uses: the config, and a guild where every synthetic user is a member"""
+    config = BotConfig(guild_id=GUILD_ID)
+    config.analysis.backend = "local"
+    members = {int(user_id): SimpleNamespace(id=int(user_id)) for user_id in user_ids(shape)}
+    guild = SimpleNamespace(
+            id=GUILD_ID,
+            members=list(members.values()),
+            channels=[SimpleNamespace(id=int(channel_id)) for channel_id in channel_ids(shape) + voice_channel_ids(shape)],
+            get_member=members.get,
+    )
+    bot = SimpleNamespace(config=config, get_guild=lambda guild_id: guild if guild_id == GUILD_ID else None)
+    return SimpleNamespace(bot=bot, guild=guild)
+
+
+def entry_points(ctx: Any, shape: CorpusShape) -> dict[str, Callable[[], Awaitable[Any]]]:
+    """Every public analysis function that works without MongoDB, the busiest user analysed for the per user ones"""
+    top_user = SimpleNamespace(id=int(user_ids(shape)[0]), display_name="Top user")
+    top_user_id = user_ids(shape)[0]
+    
+    async def build_frame() -> Any:
+        text_analysis._message_frame = None
+        return await text_analysis.get_message_frame()
+    
+    async def build_voice_index() -> Any:
+        db_stuff.voice_index = None
+        return await voice_analysis.get_voice_index()
+    
+    return {
+        "get_message_frame (build)":         build_frame,
+        "analyse_messages":                  lambda: text_analysis.analyse_messages(ctx),
+        "analyse_messages -w":               lambda: text_analysis.analyse_messages(ctx, "w"),
+        "analyse_messages -il":              lambda: text_analysis.analyse_messages(ctx, "il"),
+        "analyse_user_messages":             lambda: text_analysis.analyse_user_messages(top_user, None, "local"),
+        "analyse_user_messages -w":          lambda: text_analysis.analyse_user_messages(top_user, "w", "local"),
+        "get_valid_voice_sessions":          lambda: voice_analysis.get_valid_voice_sessions(),
+        "get_voice_statistics":              lambda: voice_analysis.get_voice_statistics(False, ctx.guild),
+        "get_voice_statistics -il":          lambda: voice_analysis.get_voice_statistics(True, ctx.guild),
+        "get_user_voice_statistics":         lambda: voice_analysis.get_user_voice_statistics(top_user_id),
+        "get_voice_index (build)":           build_voice_index,
+        "voice_activity_this_week":          lambda: voice_analysis.voice_activity_this_week(),
+    }
+
+
+def measure(run: Callable[[], Awaitable[Any]], repeats: int, allocations: bool) -> Measurement:
+    best: float = float("inf")
+    with RSSSampler() as rss:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            asyncio.run(run())
+            best = min(best, time.perf_counter() - start)
+    
+    alloc_peak: float = 0.0
+    if allocations:
+        tracemalloc.start()
+        asyncio.run(run())
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        alloc_peak = peak / 2 ** 20
+    return Measurement(seconds=best, peak_rss_mb=rss.growth_mb, alloc_peak_mb=alloc_peak)
+
+
+def regressions(name: str, current: Measurement, baseline: Measurement, tolerance: float) -> list[str]:
+    found: list[str] = []
+    for key in ("seconds", "peak_rss_mb", "alloc_peak_mb"):
+        was, now = baseline[key], current[key]
+        if now > was * (1 + tolerance) and now - was > MIN_REGRESSION[key]:
+            found.append(f"{name}: {key} {was:.3f} -> {now:.3f} ({(now / was - 1) if was else float("inf"):+.0%})")
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scales", nargs="+", choices=SCALES, default=["10k", "100k"], help="Message counts to run at")
+    parser.add_argument("--sessions-per-message", type=float, default=0.05, help="Voice sessions generated per message")
+    parser.add_argument("--users", type=int, default=CorpusShape.users)
+    parser.add_argument("--channels", type=int, default=CorpusShape.channels)
+    parser.add_argument("--zipf", type=float, default=CorpusShape.zipf_exponent, help="Zipf exponent of the word distribution")
+    parser.add_argument("--overlap", type=float, default=CorpusShape.overlap, help="Chance a voice session joins a running one")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per entry point, the fastest is reported")
+    parser.add_argument("--no-allocations", action="store_true", help="Skip the traced run measuring allocations")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="Exit with status 1 if a result regressed past the tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown or memory growth over the baseline")
+    args = parser.parse_args()
+    
+    shape = CorpusShape(users=args.users, channels=args.channels, zipf_exponent=args.zipf, overlap=args.overlap)
+    ctx = stand_in_context(shape)
+    analysis_executor.configure(workers=1, max_jobs=1, timeout=0, use_processes=False)
+    result_cache.configure(maxsize=0, ttl=0)
+    baseline: dict[str, dict[str, Measurement]] = json.loads(args.baseline.read_text()) if args.baseline.is_file() else {}
+    results: dict[str, dict[str, Measurement]] = {}
+    regressed: list[str] = []
+    
+    for scale in args.scales:
+        size = SCALES[scale]
+        start = time.perf_counter()
+        # Ending now, so the time filters and this week's voice activity have data to select
+        now = time.time()
+        messages = synthetic_messages(size, shape, text_analysis.EXCLUDED_USER_IDS, end=now)
+        sessions = synthetic_voice_sessions(max(1, int(size * args.sessions_per_message)), shape, end=now)
+        InMemoryDB(messages, sessions).install()
+        print(f"\n{scale}: {len(messages)} messages, {len(sessions)} voice sessions, "
+              f"generated and loaded in {time.perf_counter() - start:.1f}s")
+        print(f"{"entry point":<28} {"time":>10} {"peak RSS":>11} {"allocated":>11}")
+        
+        results[scale] = {}
+        for name, run in entry_points(ctx, shape).items():
+            measurement = measure(run, args.repeats, not args.no_allocations)
+            results[scale][name] = measurement
+            line = (f"{name:<28} {measurement["seconds"] * 1000:8.1f}ms {measurement["peak_rss_mb"]:8.1f}MiB "
+                    f"{measurement["alloc_peak_mb"]:8.1f}MiB")
+            if name in baseline.get(scale, {}):
+                found = regressions(name, measurement, baseline[scale][name], args.tolerance)
+                regressed += [f"{scale} {regression}" for regression in found]
+                line += "  REGRESSED" if found else f"  {measurement["seconds"] / baseline[scale][name]["seconds"] - 1:+.0%} time"
+            print(line)
+        
+        del messages, sessions
+    
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(baseline | results, indent=4) + "\n")
+        print(f"\nSaved baseline to {args.baseline}")
+    
+    if regressed:
+        print(f"\n{len(regressed)} regressions over {args.tolerance:.0%}:")
+        for regression in regressed:
+            print(f"  {regression}")
+        if args.compare:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
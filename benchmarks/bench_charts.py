@@ -0,0 +1,85 @@
+"""
+Compares chart rendering through pyplot and a temporary file with the ChartRenderer.
+
+Run from the repository root:
+    python -m benchmarks.bench_charts [number of charts]
+"""
+import asyncio
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from matplotlib import pyplot as plt
+
+from command_utils.analysis.charts import BarChart, ChartRenderer, render_bar_chart
+
+
+def synthetic_charts(count: int) -> list[BarChart]:
+    return [
+        BarChart(
+                labels=tuple(f"user {i}-{rank}" for rank in range(15)),
+                values=tuple(float(1000 - 50 * rank + i) for rank in range(15)),
+                title="Top 15 Active Users",
+                xlabel="Number of Messages",
+        )
+        for i in range(count)
+    ]
+
+
+def pyplot_render(chart: BarChart) -> bytes:
+    """The rendering done by the graph commands before ChartRenderer"""
+    plt.figure(figsize=chart.figsize, facecolor="#1f1f1f")
+    ax = plt.gca()
+    ax.set_facecolor("#2d2d2d")
+    plt.barh(chart.labels[::-1], chart.values[::-1], color="#8a2be2")
+    plt.xlabel(chart.xlabel, color="white")
+    plt.title(chart.title, color="white")
+    plt.tick_params(axis="both", colors="white")
+    for spine in ax.spines.values():
+        spine.set_color("#555555")
+    plt.tight_layout()
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        graph_file = Path(temp_dir) / "chart.png"
+        plt.savefig(graph_file)
+        plt.close()
+        return graph_file.read_bytes()
+
+
+def timed(func: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+async def render_all(renderer: ChartRenderer, charts: list[BarChart]) -> list[bytes]:
+    return await asyncio.gather(*(renderer.render(chart) for chart in charts))
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    charts = synthetic_charts(count)
+    render_bar_chart(charts[0])  # Loads the fonts, which every path would otherwise pay for on its first chart
+    
+    pyplot_time = timed(lambda: [pyplot_render(chart) for chart in charts])
+    print(f"pyplot and temporary file: {count / pyplot_time:7.1f} renders/s")
+    
+    template_time = timed(lambda: [render_bar_chart(chart) for chart in charts])
+    print(f"Agg figure templates:      {count / template_time:7.1f} renders/s, {pyplot_time / template_time:.1f}x faster")
+    
+    for workers in (1, 2, 4):
+        renderer = ChartRenderer(workers=workers, cache_size=count)
+        pool_time = timed(lambda renderer=renderer: asyncio.run(render_all(renderer, charts)))
+        print(f"ChartRenderer, {workers} threads:  {count / pool_time:7.1f} renders/s")
+        if workers == 1:
+            cached_time = timed(lambda renderer=renderer: asyncio.run(render_all(renderer, charts)))
+            print(f"ChartRenderer, cached:     {count / cached_time:7.1f} renders/s")
+        renderer.shutdown()
+    
+    assert pyplot_render(charts[0]) == render_bar_chart(charts[0]), "ChartRenderer output differs from pyplot"
+
+
+if __name__ == "__main__":
+    main()
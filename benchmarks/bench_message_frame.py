@@ -0,0 +1,143 @@
+"""
+Compares the list-of-dicts analysis path with the columnar MessageFrame on a synthetic corpus.
+
+Run from the repository root:
+    python -m benchmarks.bench_message_frame [number of messages]
+"""
+import collections
+import math
+import random
+import statistics
+import sys
+import time
+from collections.abc import Callable
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+
+# Loaded before the analysis modules like when the bot starts, they import each other through it
+from utils import db_stuff  # noqa: F401
+
+# isort: split
+from command_utils.analysis.aggregation import REQUIRED_MESSAGE_KEYS
+from command_utils.analysis.message_frame import MessageFrame
+from command_utils.analysis.text_analysis import EXCLUDED_USER_IDS
+from command_utils.analysis.word_stats import analyse_weighted_word_stats, analyse_word_stats
+
+WORDS: list[str] = ["the", "cat", "dog", "gaming", "tonight", "lol", "pizza", "server", "voice", "meme", "python", "bot", "fox", "hello"]
+REPEATED: list[str] = ["lol", "gm", "gn", "ok", "lmao", "real", "W"]
+
+
+def synthetic_corpus(size: int, seed: int = 0) -> list[dict[str, Any]]:
+    rng = random.Random(seed)
+    authors = [str(10 ** 17 + i) for i in range(300)] + EXCLUDED_USER_IDS
+    channels = [str(10 ** 18 + i) for i in range(40)]
+    timestamp: float = 1_600_000_000.0
+    corpus: list[dict[str, Any]] = []
+    for i in range(size):
+        timestamp += rng.expovariate(1 / 30)
+        content = rng.choice(REPEATED) if rng.random() < 0.3 else " ".join(rng.choices(WORDS, k=rng.randint(1, 20)))
+        author_id = rng.choice(authors)
+        corpus.append({
+            "author":             f"user{author_id}",
+            "author_id":          author_id,
+            "author_global_name": f"User {author_id}",
+            "content":            content,
+            "reply_to":           None,
+            "HasAttachments":     False,
+            "timestamp":          timestamp,
+            "id":                 str(10 ** 18 + i),
+            "channel":            "general",
+            "channel_id":         rng.choice(channels),
+            "edits":              [],
+        })
+    return corpus
+
+
+def list_select(messages: list[dict[str, Any]], since: float | None, members: set[int]) -> list[dict[str, Any]]:
+    valid = [msg for msg in messages if msg["author_id"] not in EXCLUDED_USER_IDS]
+    if since is not None:
+        valid = [msg for msg in valid if msg["timestamp"] >= since]
+    return [msg for msg in valid if int(msg["author_id"]) in members]
+
+
+def list_analysis(messages: list[dict[str, Any]], since: float | None, members: set[int]) -> tuple[Any, ...]:
+    """The filters and numeric statistics of analyse_messages, computed the way the local backend did before MessageFrame"""
+    valid = list_select(messages, since, members)
+    content_list = [msg["content"] for msg in valid]
+    users = collections.Counter(msg["author_id"] for msg in valid)
+    channels = collections.Counter(msg["channel_id"] for msg in valid)
+    median_length = statistics.median(len(c) for c in content_list)
+    avg_words = sum(len(c.split()) for c in content_list) / len(content_list)
+    timestamps = sorted(msg["timestamp"] for msg in valid)
+    gaps = [(timestamps[i + 1] - timestamps[i], timestamps[i], timestamps[i + 1]) for i in range(len(timestamps) - 1)]
+    longest = max(gaps, key=lambda x: x[0])
+    per_day = len(valid) / ((timestamps[-1] - timestamps[0]) / 86400)
+    return dict(users), dict(channels), float(median_length), avg_words, longest, per_day
+
+
+def frame_select(frame: MessageFrame, since: float | None, members: set[int]) -> npt.NDArray[np.bool_]:
+    return frame.mask(since=since, excluded_author_ids=EXCLUDED_USER_IDS) & frame.mask(author_ids=members)
+
+
+def frame_analysis(frame: MessageFrame, since: float | None, members: set[int]) -> tuple[Any, ...]:
+    selected = frame_select(frame, since, members)
+    timing = frame.timing(selected)
+    assert timing is not None
+    return (
+        frame.author_counts(selected),
+        frame.channel_counts(selected),
+        frame.median_length(selected),
+        frame.average_words(selected),
+        (timing["longest_gap"], timing["gap_start"], timing["gap_end"]),
+        timing["messages_per_day"],
+    )
+
+
+def _same(actual: Any, expected: Any) -> bool:
+    if isinstance(expected, float):
+        return math.isclose(actual, expected, rel_tol=1e-9)
+    if isinstance(expected, tuple):
+        return len(actual) == len(expected) and all(_same(a, e) for a, e in zip(actual, expected, strict=True))
+    return actual == expected
+
+
+def timed(func: Callable[[], Any], repeats: int = 3) -> tuple[float, Any]:
+    best: float = float("inf")
+    result: Any = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main() -> None:
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"Generating {size} synthetic messages...")
+    corpus = synthetic_corpus(size)
+    members = {10 ** 17 + i for i in range(250)}
+    week_ago = corpus[-1]["timestamp"] - 7 * 86400
+    
+    build_time, (frame, _) = timed(lambda: MessageFrame.from_messages(corpus, REQUIRED_MESSAGE_KEYS), repeats=1)
+    print(f"Frame build (once per store refresh): {build_time:.3f}s")
+    
+    for name, since in (("all messages", None), ("last week", week_ago)):
+        list_time, expected = timed(lambda since=since: list_analysis(corpus, since, members))
+        frame_time, actual = timed(lambda since=since: frame_analysis(frame, since, members))
+        assert _same(actual, expected), "frame statistics differ from the list implementation"
+        print(f"{name:>12} filters and statistics: list {list_time:.3f}s, frame {frame_time:.3f}s, {list_time / frame_time:.1f}x faster")
+        
+        selected = frame_select(frame, since, members)
+        list_words_time, expected_words = timed(
+                lambda since=since: analyse_word_stats([msg["content"] for msg in list_select(corpus, since, members)]),
+        )
+        frame_words_time, actual_words = timed(lambda selected=selected: analyse_weighted_word_stats(*frame.content_counts(selected)))
+        assert actual_words == expected_words, "interned word statistics differ from the list implementation"
+        print(f"{name:>12} word statistics:        list {list_words_time:.3f}s, frame {frame_words_time:.3f}s, "
+              f"{list_words_time / frame_words_time:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Compares the voice session sweep line with the pairwise comparisons it replaced, and checks they agree.
+
+Run from the repository root:
+    python -m benchmarks.bench_voice_sweep [number of sessions]
+"""
+import sys
+import time
+from collections.abc import Callable
+from typing import Any
+
+from benchmarks.corpus import CorpusShape, synthetic_voice_sessions
+from command_utils.analysis.voice_sweep import SessionSweep, companion_seconds, user_pair_seconds
+
+
+def pairwise_duo_seconds(sessions: list[dict[str, Any]]) -> dict[tuple[str, str], int]:
+    """The best duo calculation before SessionSweep, comparing every timed session with every later one"""
+    timed_sessions = [s for s in sessions if "timestamp" in s]
+    duo_seconds: dict[tuple[str, str], int] = {}
+    for i, s1 in enumerate(timed_sessions):
+        s1_start = s1["timestamp"] - s1["duration_seconds"]
+        s1_end = s1["timestamp"]
+        for s2 in timed_sessions[i + 1:]:
+            if s1["user_id"] == s2["user_id"]:
+                continue
+            if s1["channel_id"] != s2["channel_id"]:
+                continue
+            s2_start = s2["timestamp"] - s2["duration_seconds"]
+            s2_end = s2["timestamp"]
+            overlap = min(s1_end, s2_end) - max(s1_start, s2_start)
+            if overlap > 0:
+                uid1, uid2 = sorted([s1["user_id"], s2["user_id"]])
+                pair: tuple[str, str] = (uid1, uid2)
+                duo_seconds[pair] = duo_seconds.get(pair, 0) + overlap
+    return duo_seconds
+
+
+def pairwise_concurrency(sessions: list[dict[str, Any]]) -> list[int]:
+    """The average users per session calculation before SessionSweep, comparing every timed session with every other"""
+    timed_sessions = [s for s in sessions if "timestamp" in s]
+    concurrent_counts: list[int] = []
+    for s in timed_sessions:
+        s_start = s["timestamp"] - s["duration_seconds"]
+        count: int = 0
+        for other in timed_sessions:
+            if other is s:
+                continue
+            if other["channel_id"] != s["channel_id"]:
+                continue
+            o_start = other["timestamp"] - other["duration_seconds"]
+            o_end = other["timestamp"]
+            if o_start <= s_start < o_end:
+                count += 1
+        concurrent_counts.append(count + 1)
+    return concurrent_counts
+
+
+def pairwise_companion_seconds(sessions: list[dict[str, Any]], user_id: str) -> dict[str, int]:
+    """The top companions calculation before SessionSweep, comparing each of the user's sessions with every other"""
+    timed_user_sessions = [s for s in sessions if s["user_id"] == user_id and "timestamp" in s]
+    other_sessions = [s for s in sessions if s["user_id"] != user_id and "timestamp" in s]
+    companions: dict[str, int] = {}
+    for us in timed_user_sessions:
+        us_end = us["timestamp"]
+        us_start = us_end - us["duration_seconds"]
+        for other in other_sessions:
+            if other["channel_id"] != us["channel_id"]:
+                continue
+            overlap = min(us_end, other["timestamp"]) - max(us_start, other["timestamp"] - other["duration_seconds"])
+            if overlap > 0:
+                companions[other["user_id"]] = companions.get(other["user_id"], 0) + overlap
+    return companions
+
+
+def timed[R](func: Callable[[], R]) -> tuple[R, float]:
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    sessions = synthetic_voice_sessions(count, CorpusShape())
+    user_id = sessions[0]["user_id"]
+    
+    def sweep_everything() -> tuple[dict[tuple[str, str], int], list[int], dict[str, int]]:
+        sweep = SessionSweep(sessions)
+        return user_pair_seconds(sweep), list(sweep.concurrency().values()), companion_seconds(sweep, user_id)
+    
+    (pairs, concurrency, companions), sweep_time = timed(sweep_everything)
+    old_pairs, pairs_time = timed(lambda: pairwise_duo_seconds(sessions))
+    old_concurrency, concurrency_time = timed(lambda: pairwise_concurrency(sessions))
+    old_companions, companions_time = timed(lambda: pairwise_companion_seconds(sessions, user_id))
+    pairwise_time = pairs_time + concurrency_time + companions_time
+    print(f"{count} sessions, {len(pairs)} user pairs that met")
+    print(f"pairwise comparisons: {pairwise_time * 1000:9.1f}ms")
+    print(f"sweep line:           {sweep_time * 1000:9.1f}ms, {pairwise_time / sweep_time:.0f}x faster")
+    
+    # Same totals, and the same order so ties between pairs or companions resolve the same way
+    assert list(pairs.items()) == list(old_pairs.items()), "Pair overlaps differ"
+    assert sorted(concurrency) == sorted(old_concurrency), "Concurrent users differ"
+    assert list(companions.items()) == list(old_companions.items()), "Companion overlaps differ"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Synthetic message and voice session datasets for the benchmarks, shaped like the documents the bot stores.
+Generation is seeded, so the same shape and size always give the same dataset.
+"""
+import itertools
+import random
+import string
+from collections.abc import Collection
+from dataclasses import dataclass
+from typing import Any, Final
+
+from command_utils.analysis.word_stats import EXCLUDED_WORDS
+
+SCALES: Final[dict[str, int]] = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+START_TIMESTAMP: Final[float] = 1_600_000_000.0
+REPEATED: Final[list[str]] = ["lol", "gm", "gn", "ok", "lmao", "real", "W"]
+
+
+@dataclass(frozen=True)
+class CorpusShape:
+    users: int = 300
+    channels: int = 40
+    vocabulary: int = 20_000
+    zipf_exponent: float = 1.1  # Word frequencies fall off as 1 / rank^exponent
+    repeated_share: float = 0.3  # Share of one word messages like "lol"
+    message_gap: float = 30.0  # Mean seconds between messages
+    voice_channels: int = 10
+    session_gap: float = 600.0  # Mean seconds between voice sessions that don't join a running one
+    overlap: float = 0.6  # Chance a voice session joins one still running, so users share the channel
+    seed: int = 0
+
+
+DEFAULT_SHAPE: Final[CorpusShape] = CorpusShape()
+
+
+def user_ids(shape: CorpusShape) -> list[str]:
+    return [str(10 ** 17 + i) for i in range(shape.users)]
+
+
+def channel_ids(shape: CorpusShape) -> list[str]:
+    return [str(10 ** 18 + i) for i in range(shape.channels)]
+
+
+def voice_channel_ids(shape: CorpusShape) -> list[str]:
+    return [str(10 ** 18 + shape.channels + i) for i in range(shape.voice_channels)]
+
+
+def _zipf_cum_weights(count: int, exponent: float) -> list[float]:
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def zipf_vocabulary(size: int, rng: random.Random) -> list[str]:
+    """Words from most to least common: the excluded function words, then made up words that get longer with rank"""
+    words: list[str] = sorted(EXCLUDED_WORDS, key=lambda word: (len(word), word))[:size]
+    seen: set[str] = set(words)
+    while len(words) < size:
+        word = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 4 + 8 * len(words) // size)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def _end_at(documents: list[dict[str, Any]], end: float | None) -> None:
+    """Shift timestamps in order so the last one is at ``end``, keeping the gaps between them"""
+    if end is None or not documents:
+        return
+    offset = end - documents[-1]["timestamp"]
+    for document in documents:
+        document["timestamp"] += type(document["timestamp"])(offset)
+
+
+def synthetic_messages(size: int,
+                       shape: CorpusShape = DEFAULT_SHAPE,
+                       excluded_author_ids: Collection[str] = (),
+                       end: float | None = None,
+                       ) -> list[dict[str, Any]]:
+    """
+    Message documents in timestamp order.
+    Words follow a Zipf distribution, and so do authors, a few users send most of the messages.
+    
+    Args:
+        size: The number of messages
+        shape: The users, channels and distributions
+        excluded_author_ids: Extra authors, e.g. bots the analysis leaves out, sending as much as an average user
+        end: The timestamp of the last message, e.g. now so the time filters select messages, or ``START_TIMESTAMP`` onwards if None
+    
+    Returns:
+        The messages
+    """
+    rng = random.Random(shape.seed)
+    vocabulary = zipf_vocabulary(shape.vocabulary, rng)
+    word_weights = _zipf_cum_weights(len(vocabulary), shape.zipf_exponent)
+    authors = user_ids(shape)
+    author_weights = _zipf_cum_weights(len(authors), 1.0)
+    channels = channel_ids(shape)
+    excluded = list(excluded_author_ids)
+    excluded_share = len(excluded) / (len(authors) + len(excluded))
+    
+    timestamp: float = START_TIMESTAMP
+    messages: list[dict[str, Any]] = []
+    for i in range(size):
+        timestamp += rng.expovariate(1 / shape.message_gap)
+        if rng.random() < shape.repeated_share:
+            content = rng.choice(REPEATED)
+        else:
+            content = " ".join(rng.choices(vocabulary, cum_weights=word_weights, k=rng.randint(1, 20)))
+        if excluded and rng.random() < excluded_share:
+            author_id = rng.choice(excluded)
+        else:
+            author_id = rng.choices(authors, cum_weights=author_weights)[0]
+        messages.append({
+            "_id":                i,
+            "author":             f"user{author_id}",
+            "author_id":          author_id,
+            "author_global_name": f"User {author_id}",
+            "content":            content,
+            "reply_to":           None,
+            "HasAttachments":     False,
+            "timestamp":          timestamp,
+            "id":                 str(10 ** 18 + i),
+            "channel":            "general",
+            "channel_id":         rng.choice(channels),
+            "edits":              [],
+        })
+    _end_at(messages, end)
+    return messages
+
+
+def synthetic_voice_sessions(size: int, shape: CorpusShape = DEFAULT_SHAPE, end: float | None = None) -> list[dict[str, Any]]:
+    """
+    Voice session documents in the order they ended, timestamped at the end of the session like the voice tracker does.
+    With probability ``shape.overlap`` a session starts while an earlier one in the same channel is still running,
+    which is what the duo and companion statistics measure.
+    
+    Args:
+        size: The number of sessions
+        shape: The users, channels and overlap density
+        end: The timestamp of the last session to end, or ``START_TIMESTAMP`` onwards if None
+    
+    Returns:
+        The sessions
+    """
+    rng = random.Random(shape.seed)
+    users = user_ids(shape)
+    user_weights = _zipf_cum_weights(len(users), 1.0)
+    channels = voice_channel_ids(shape)
+    
+    start: float = START_TIMESTAMP
+    running: list[tuple[float, float, str]] = []  # (start, end, channel) of recent sessions
+    sessions: list[dict[str, Any]] = []
+    for i in range(size):
+        duration = max(1, int(rng.lognormvariate(7, 1)))  # Median around 18 minutes
+        joined = [session for session in running if session[1] > start]
+        if joined and rng.random() < shape.overlap:
+            other_start, other_end, channel = rng.choice(joined)
+            session_start = rng.uniform(max(other_start, start), other_end)
+        else:
+            start += rng.expovariate(1 / shape.session_gap)
+            session_start = start
+            channel = rng.choice(channels)
+        
+        session_end = session_start + duration
+        running = [*joined[-50:], (session_start, session_end, channel)]
+        sessions.append({
+            "_id":              i,
+            "user_id":          rng.choices(users, cum_weights=user_weights)[0],
+            "channel_id":       channel,
+            "duration_seconds": duration,
+            "timestamp":        int(session_end),
+        })
+    
+    sessions.sort(key=lambda session: session["timestamp"])
+    _end_at(sessions, end)
+    return sessions
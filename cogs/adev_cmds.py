@@ -10,8 +10,11 @@ from discord.ext import commands
 
 import utils.utils
 from cogs import adev_cmds_utils, voice_events_utils
+from command_utils.analysis import aggregation
+from command_utils.analysis.result_cache import result_cache
 from command_utils.CContext import CContext, CoolBot
 from command_utils.checks import is_dev
+from utils import db_stuff, doc_validation
 
 # added the "a" to the start of the file so it loads first
 
@@ -168,6 +171,93 @@ class DevCommands(commands.Cog, name="Dev", command_attrs={"hidden": True, "add_
         except KeyError:
             await ctx.send("User was not an admin.")
     
+    @commands.command(name="rebuild_rollups",
+                      brief="Rebuild the message rollups",
+                      help="Dev only: Recompute the daily message rollups from the whole message history",
+                      usage="f!rebuild_rollups")
+    async def rebuild_rollups(self, ctx: CContext):
+        await ctx.send("Rebuilding message rollups, this may take a while...")
+        async with ctx.typing():
+            rebuilt: bool = await aggregation.rebuild_rollups()
+        
+        if not rebuilt:
+            await ctx.send("Failed to rebuild the message rollups, check the logs.")
+            return
+        
+        ctx.bot.config.analysis.rollups = True
+        ctx.bot.config.save()
+        await ctx.send("Message rollups rebuilt, analysis will now count messages from them.")
+    
+    @commands.command(name="rebuild_word_sketch",
+                      brief="Rebuild the word statistics sketch",
+                      help="Dev only: Rebuild the all time word statistics sketch from every stored message and enable sketched statistics",
+                      usage="f!rebuild_word_sketch")
+    async def rebuild_word_sketch(self, ctx: CContext):
+        await ctx.send("Rebuilding the word sketch, this may take a while...")
+        async with ctx.typing():
+            counted: int | None = await db_stuff.rebuild_word_sketch()
+        
+        if counted is None:
+            await ctx.send("Failed to rebuild the word sketch, check the logs.")
+            return
+        
+        ctx.bot.config.analysis.word_sketches = True
+        ctx.bot.config.save()
+        await ctx.send(f"Word sketch rebuilt from {counted} messages, all time analysis will now estimate word statistics from it.")
+    
+    @commands.command(name="rebuild_voice_totals",
+                      brief="Rebuild the voice totals",
+                      help="Dev only: Recompute the weekly and per channel voice totals of every user from the whole voice history",
+                      usage="f!rebuild_voice_totals")
+    async def rebuild_voice_totals(self, ctx: CContext):
+        await ctx.send("Rebuilding voice totals, this may take a while...")
+        async with ctx.typing():
+            rows: int | None = await db_stuff.rebuild_voice_totals()
+        
+        if rows is None:
+            await ctx.send("Failed to rebuild the voice totals, check the logs.")
+            return
+        
+        ctx.bot.config.analysis.voice_totals = True
+        ctx.bot.config.save()
+        await ctx.send(f"Voice totals rebuilt into {rows} rows, the voice leaderboard and time in channel will now read from them.")
+    
+    @commands.command(name="analysis_cache",
+                      brief="Show analysis cache stats",
+                      help="Dev only: Show the hit rates of the analysis result cache, or clear it",
+                      usage="f!analysis_cache [clear]")
+    async def analysis_cache(self, ctx: CContext, action: str | None = None):
+        if action == "clear":
+            result_cache.clear()
+            await ctx.send("Analysis result cache cleared.")
+            return
+        
+        msg = (f"**Analysis result cache**: {len(result_cache)}/{result_cache.maxsize} results, {result_cache.ttl:.0f}s TTL"
+               f"{"" if result_cache.enabled else " (disabled)"}\n"
+               f"Data version {result_cache.data_version}, membership version {result_cache.membership_version}\n")
+        stats = result_cache.stats()
+        if not stats:
+            msg += "No lookups yet."
+        for name, counts in stats.items():
+            msg += f"`{name}`: {counts["hits"]} hits, {counts["misses"]} misses, {counts["hit_rate"]:.1%} hit rate\n"
+        await ctx.send(msg)
+    
+    @commands.command(name="schema_validation",
+                      brief="Set DB schema validation",
+                      help="Dev only: Make MongoDB reject (error), log (warn) or accept (off) malformed messages and voice sessions",
+                      usage="f!schema_validation <error/warn/off> [collection]")
+    async def schema_validation(self, ctx: CContext, action: doc_validation.ValidationAction, collection: str | None = None):
+        if collection is not None and collection not in doc_validation.SCHEMAS:
+            await ctx.send(f"No schema for {collection}, choose from {", ".join(doc_validation.SCHEMAS)}.", delete_after=ctx.bot.del_after)
+            return
+        
+        collections = [collection] if collection is not None else list(doc_validation.SCHEMAS)
+        failed = [name for name in collections if not await db_stuff.set_schema_validation(name, action)]
+        if failed:
+            await ctx.send(f"Failed to set schema validation on {", ".join(failed)}, check the logs.")
+            return
+        await ctx.send(f"Schema validation set to {action} on {", ".join(collections)}.")
+    
     @commands.command(name="queue_update", aliases=["qupdate", "qu"])
     async def queue_update(self, ctx: CContext):
         ctx.bot.update_queued = True
@@ -6,6 +6,8 @@ from typing import Any
 import discord
 
 from cogs import voice_events_utils
+from command_utils.analysis.charts import chart_renderer
+from command_utils.analysis.executor import analysis_executor
 from command_utils.CContext import CContext, CoolBot
 from utils import db_stuff
 
@@ -53,6 +55,10 @@ async def shutdown(bot: CoolBot, update=False, restart=False, time: int = 0) ->
     
     logger.info("Shutting down")
     await voice_events_utils.leave_all(bot)
+    analysis_executor.shutdown()
+    chart_renderer.shutdown()
+    await db_stuff.flush_message_queue()
+    await db_stuff.save_word_sketch()
     db_stuff.disable_connection()
     await db_stuff.disconnect()
     success = bot.config.save()
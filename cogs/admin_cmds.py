@@ -1,6 +1,5 @@
 import datetime
 import logging
-from collections.abc import Mapping
 from pathlib import Path
 from typing import Any
 
@@ -10,15 +9,19 @@ from discord.ext import commands
 from discord.ext.commands import guild_only
 
 import utils.utils
-from cogs.admin_cmds_utils import last_log, rek_random_in_channel, sort_by_timestamp
+from cogs import voice_events_utils
+from cogs.admin_cmds_utils import last_log, parse_moment, rek_random_in_channel, sort_by_timestamp
 from command_utils.analysis import text_analysis, voice_analysis
-from command_utils.analysis.text_analysis import DatetimeDBMessage, DBMessage, remove_invalid_messages
+from command_utils.analysis.text_analysis import MESSAGE_PROJECTION, DatetimeDBMessage, DBMessage, stream_valid_messages
 from command_utils.CContext import CContext, CoolBot
 from command_utils.checks import is_admin, is_staff
-from utils import db_stuff, discord_utils
+from utils import db_indexes, db_stuff, discord_utils
 
 logger = logging.getLogger("discord")
 
+db_indexes.register_index("warns", [("user_id", 1)])
+db_indexes.register_query("Warns of user", "warns", {"user_id": 0})
+
 
 class AdminCmds(commands.Cog, name="Admin", command_attrs={"hidden": True}):
     """Admin commands for managing the server and users."""
@@ -168,6 +171,26 @@ class AdminCmds(commands.Cog, name="Admin", command_attrs={"hidden": True}):
     async def time_in_vc(self, ctx: CContext, user: discord.User, channel: discord.VoiceChannel):
         await voice_analysis.user_time_in_channel(ctx, user, channel)
     
+    @commands.command(name="voice_at", aliases=["vcat"],
+                      brief="See who was in a voice channel at a time",
+                      help="Admin only: List who was in a voice channel at a moment, or during a range with how long each user was there. "
+                           "Times are UNIX or Discord timestamps, how long ago like 2h or 1d12h, or now",
+                      usage="f!vcat <channel> <time> [end time]")
+    @commands.check(is_staff)
+    @commands.cooldown(1, 2, commands.BucketType.user)
+    async def voice_at(self, ctx: CContext, channel: discord.VoiceChannel, when: str, until: str | None = None):
+        now = datetime.datetime.now(datetime.UTC).timestamp()
+        start = parse_moment(when, now)
+        end = parse_moment(until, now) if until is not None else None
+        if start is None or (until is not None and end is None):
+            await ctx.send("Times must be timestamps, how long ago like 2h or 1d12h, or now.", delete_after=ctx.bot.del_after)
+            return
+        if end is not None and end <= start:
+            await ctx.send("The end time must be after the start time.", delete_after=ctx.bot.del_after)
+            return
+        
+        await voice_analysis.channel_occupancy(ctx, channel, voice_events_utils.get_voice_sessions(), start, end)
+    
     @commands.command(name="blacklist",
                       brief="Blacklist a user",
                       help="Admin only: Prevent a user from using bot commands",
@@ -328,8 +351,10 @@ class AdminCmds(commands.Cog, name="Admin", command_attrs={"hidden": True}):
             await ctx.send(f"{member.display_name} has no warns.", delete_after=ctx.bot.del_after)
             return
         
+        issuers = await discord_utils.resolve_users([int(warn["issuer_id"]) for warn in warns], ctx.bot)
+        issuer_names = {uid: user.display_name if user is not None else str(uid) for uid, user in issuers.items()}
         warn_list = "\n".join([f"**{i + 1}.** {warn["reason"]} (Issued by "
-                               f"{(await ctx.bot.fetch_user(warn["issuer_id"])).display_name} at "
+                               f"{issuer_names[int(warn["issuer_id"])]} at "
                                f"<t:{warn["timestamp"]}>)"
                                for i, warn in enumerate(warns)])
         
@@ -337,6 +362,23 @@ class AdminCmds(commands.Cog, name="Admin", command_attrs={"hidden": True}):
                               color=discord.Color.red())
         await ctx.send(embed=embed)
     
+    @commands.command(name="db_indexes", aliases=["dbi", "indexes"],
+                      brief="Show which index serves each query",
+                      help="Admin only: Run explain() on every registered query and show the index it uses",
+                      usage="f!db_indexes")
+    @commands.check(is_admin)
+    async def db_indexes_cmd(self, ctx: CContext) -> None:
+        async with ctx.typing():
+            embed = discord.Embed(title="Database query plans",
+                                  description=f"{len(db_indexes.all_indexes)} indexes registered",
+                                  color=discord.Color.blue())
+            for pattern in db_indexes.all_query_patterns[:25]:  # Embeds are limited to 25 fields
+                explain = await db_stuff.explain_query(pattern.collection, pattern.query, list(pattern.sort))
+                plan = "Could not explain query" if explain is None else db_indexes.describe_plan(explain)
+                embed.add_field(name=f"{pattern.name} ({pattern.collection})", value=plan, inline=False)
+        
+        await ctx.send(embed=embed)
+    
     @commands.command(name="verify", aliases=["ver", "v"],
                       brief="Verify a user",
                       help="Admin only: Assign the verified role to a user",
@@ -393,10 +435,10 @@ class AdminCmds(commands.Cog, name="Admin", command_attrs={"hidden": True}):
             await ctx.send("Please specify a number between above 0 for the number of messages.")
             return
         
-        all_messages: list[Mapping[str, Any]] | None = await db_stuff.cached_download_all()
-        t_messages: list[DBMessage] = await remove_invalid_messages(all_messages)
-        t_messages = [msg for msg in t_messages if msg["author_id"] == str(member.id)]
-        messages: list[DatetimeDBMessage] = sort_by_timestamp(t_messages)[:number_of_messages]
+        stream = db_stuff.stream_from_db("messages", {"author_id": str(member.id)}, projection=MESSAGE_PROJECTION,
+                                         sort_by="timestamp", direction="desc", limit=number_of_messages)
+        t_messages: list[DBMessage] = [msg async for msg in stream_valid_messages(stream)]
+        messages: list[DatetimeDBMessage] = sort_by_timestamp(t_messages)
         if not messages:
             await ctx.send(f"No messages found for {member.display_name}.", delete_after=ctx.bot.del_after)
             return
@@ -10,6 +10,9 @@ from command_utils.CContext import CContext
 from utils import discord_utils
 from utils.discord_utils import get_member_by_id
 
+discord_timestamp_pattern = re.compile(r"<t:(-?\d+)(?::[tTdDfFR])?>")
+time_ago_pattern = re.compile(r"(?:(\d+)d)?(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?", re.IGNORECASE)
+
 
 async def rek_random_in_channel(ctx: CContext, channel: discord.VoiceChannel | discord.StageChannel):
     users: list[int] = list(channel.voice_states)
@@ -43,6 +46,25 @@ def dt_from_timestamp(timestamp: float) -> datetime.datetime:
     return datetime.datetime.fromtimestamp(timestamp, tz=datetime.UTC)
 
 
+def parse_moment(text: str, now: float) -> float | None:
+    """
+    Parse a moment given as a UNIX timestamp, a Discord timestamp like <t:1700000000:f>,
+    how long ago like 1d2h30m, or "now".
+    :return: The UNIX timestamp of the moment, None if it couldn't be parsed.
+    """
+    text = text.strip()
+    if text.lower() == "now":
+        return now
+    if text.isdecimal():
+        return float(text)
+    if match := discord_timestamp_pattern.fullmatch(text):
+        return float(match.group(1))
+    if (match := time_ago_pattern.fullmatch(text)) and any(match.groups()):
+        days, hours, minutes, seconds = (int(group or 0) for group in match.groups())
+        return now - datetime.timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds).total_seconds()
+    return None
+
+
 def sort_by_timestamp(messages: list[DBMessage]) -> list[DatetimeDBMessage]:
     new_msgs: list[DatetimeDBMessage]
     
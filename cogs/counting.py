@@ -30,12 +30,11 @@ class Counting(commands.Cog, name="Counting"):
             return
         
         sorted_lb = sort_dict_by_value_h2l(lb)
+        entries = list(sorted_lb.items())[:number_of_entries]
+        users = await discord_utils.resolve_users([int(user_id) for user_id, _ in entries], ctx.bot)
         description = ""
-        for i in range(number_of_entries):
-            if i >= len(sorted_lb):
-                break
-            user_id, count = list(sorted_lb.items())[i]
-            user = await discord_utils.get_user_by_id(int(user_id), ctx.bot)
+        for i, (user_id, count) in enumerate(entries):
+            user = users[int(user_id)]
             display = user.display_name if user is not None else user_id
             description += f"{i + 1}. {display} - {count}\n"
         
@@ -66,24 +65,20 @@ class Counting(commands.Cog, name="Counting"):
             await ctx.send("No users have counted yet.")
             return
         
-        lb_success: dict[str, int] = sort_dict_by_value_h2l(ctx.bot.config.counting.successes)
-        lb_user_number: dict[str, int] = sort_dict_by_value_h2l(ctx.bot.config.counting.highest_user_count)
+        lb_success = list(sort_dict_by_value_h2l(ctx.bot.config.counting.successes).items())[:5]
+        lb_user_number = list(sort_dict_by_value_h2l(ctx.bot.config.counting.highest_user_count).items())[:5]
+        # Both leaderboards are resolved in one batch, most users are on both
+        users = await discord_utils.resolve_users([int(user_id) for user_id, _ in lb_success + lb_user_number], ctx.bot)
         
         num_successes_embed = discord.Embed(title="Most Successful Counting Attempts Leaderboard", color=discord.Color.blue())
-        for i in range(5):
-            if i >= len(lb_success):
-                break
-            user_id, count = list(lb_success.items())[i]
-            user = await discord_utils.get_user_by_id(int(user_id), ctx.bot)
+        for i, (user_id, count) in enumerate(lb_success):
+            user = users[int(user_id)]
             display = user.display_name if user is not None else user_id
             num_successes_embed.add_field(name=f"{i + 1}. {display}", value=count, inline=False)
         
         num_user_embed = discord.Embed(title="Highest Number Counted Leaderboard", color=discord.Color.blue())
-        for i in range(5):
-            if i >= len(lb_user_number):
-                break
-            user_id, count = list(lb_user_number.items())[i]
-            user = await discord_utils.get_user_by_id(int(user_id), ctx.bot)
+        for i, (user_id, count) in enumerate(lb_user_number):
+            user = users[int(user_id)]
             display = user.display_name if user is not None else user_id
             num_user_embed.add_field(name=f"{i + 1}. {display}", value=count, inline=False)
         
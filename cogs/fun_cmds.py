@@ -320,7 +320,7 @@ class FunCommands(commands.Cog, name="Fun"):
             logger.error("VC leaderboard channel not found.")
             return
         
-        lb = await voice_analysis.voice_activity_this_week()
+        lb = await voice_analysis.voice_activity_this_week(use_totals=ctx.bot.config.analysis.voice_totals)
         
         leaderboard_text = ""
         
@@ -384,7 +384,7 @@ class FunCommands(commands.Cog, name="Fun"):
             logger.error("VC leaderboard channel not found.")
             return
         
-        lb = await voice_analysis.voice_activity_this_week(skip_cache=True)
+        lb = await voice_analysis.voice_activity_this_week(skip_cache=True, use_totals=self.bot.config.analysis.voice_totals)
         
         leaderboard_text = ""
         
@@ -15,6 +15,7 @@ from cogs.member_events_utils import (
     time_ago,
     timeout_embed,
 )
+from command_utils.analysis.result_cache import result_cache
 from command_utils.CContext import CoolBot
 from command_utils.embed_util import create_log_embed
 
@@ -56,6 +57,7 @@ class MemberEvents(commands.Cog, name="Member Events"):
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member) -> None:
         logger.debug(f"{member.name} with ID {member.id} joined the server.")
+        result_cache.membership_changed()
         if not self.ensure_jl_logs_channel():
             return
         
@@ -93,6 +95,7 @@ class MemberEvents(commands.Cog, name="Member Events"):
     @commands.Cog.listener()
     async def on_member_remove(self, member: discord.Member) -> None:
         logger.debug(f"{member.name} with ID {member.id} left the server.")
+        result_cache.membership_changed()
         if not self.ensure_jl_logs_channel():
             return
         
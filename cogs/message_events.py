@@ -11,10 +11,14 @@ from cogs import counting_utils, message_events_utils
 from command_utils.analysis.text_analysis import DBMessage, remove_invalid_messages
 from command_utils.CContext import CContext, CoolBot
 from command_utils.embed_util import create_log_embed
-from utils import db_stuff, discord_utils, utils
+from utils import db_indexes, db_stuff, discord_utils, utils
 
 logger = logging.getLogger("discord")
 
+db_indexes.register_index("messages", [("author_id", 1), ("timestamp", -1)])
+db_indexes.register_query("Recent messages by author", "messages", {"author_id": "0", "timestamp": {"$gte": 0}},
+                          sort=[("timestamp", -1)])
+
 async def timeout_delete(message: discord.Message, bot: CoolBot) -> None:
     if not isinstance(message.author, discord.Member):
         return
@@ -30,6 +34,7 @@ async def timeout_delete(message: discord.Message, bot: CoolBot) -> None:
         logger.error(f"Failed to delete message: {message.id}, {e}")
     
     filter_time: float = discord.utils.utcnow().timestamp() - 5*60
+    await db_stuff.write_queued_messages()  # The spam just sent may still be waiting to be saved
     author_messages: list[dict[str, Any]] | None = await db_stuff.get_many_from_db(
       "messages",
       {"author_id": str(message.author.id), "timestamp": {"$gte": filter_time}},
@@ -196,7 +201,7 @@ class MessageLogging(commands.Cog, name="Message Logging"):
         if self.bot.config.staging:
             return
         
-        db_msg = await db_stuff.get_from_db("messages", {"id": str(payload.message_id)})
+        db_msg = await db_stuff.get_message(str(payload.message_id))
         if db_msg is None:
             logger.warning(f"Message {payload.message_id} not found in database.")
             if payload.cached_message is not None:
@@ -326,8 +331,9 @@ class MessageLogging(commands.Cog, name="Message Logging"):
         before_content: str
         after_content: str
         
-        db_msg = await db_stuff.get_from_db("messages", {"id": str(payload.message_id)})
-        await db_stuff.edit_db_message(str(payload.message_id), payload.message.content)
+        db_msg = await db_stuff.record_message_edit(
+                str(payload.message_id), payload.message.content, self.bot.config.max_message_edits
+        )
         
         if db_msg is None:
             logger.error(f"Edited message {payload.message_id} not found in database.")
@@ -116,8 +116,8 @@ async def log_msg(message: discord.Message) -> bool:
             saved = await utils.save_attachments(message)
             logger.debug(f"Saved {saved} attachments for message {message.id}")
         else:
-            for attachment in message.attachments:
-                await db_stuff.send_attachment(message, attachment)
+            saved = await db_stuff.send_attachments(message)
+            logger.debug(f"Saved {saved} attachments for message {message.id} to the database")
     
     return await db_stuff.send_message(json_data)
 
@@ -1,11 +1,11 @@
 import logging
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 from cogs.voice_events_utils import handle_join, handle_leave, handle_move
 from command_utils.CContext import CoolBot
-from utils import discord_utils
+from utils import db_stuff, discord_utils
 
 logger = logging.getLogger("discord")
 
@@ -13,6 +13,19 @@ logger = logging.getLogger("discord")
 class VoiceLogging(commands.Cog, name="Voice Logging"):
     def __init__(self, bot: CoolBot):
         self.bot: CoolBot = bot
+        self.compact_sessions.start()
+    
+    @tasks.loop(hours=1)
+    async def compact_sessions(self) -> None:
+        """Merge the voice sessions split by restarts, the first run after startup catches the restart itself"""
+        if self.bot.config.staging:
+            return
+        
+        await db_stuff.compact_voice_sessions()
+    
+    @compact_sessions.before_loop
+    async def before_compact_sessions(self) -> None:
+        await self.bot.wait_until_ready()
     
     @commands.Cog.listener()
     async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
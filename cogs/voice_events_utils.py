@@ -1,6 +1,7 @@
 import asyncio
 import datetime
 import logging
+import weakref
 from typing import TypedDict
 
 import discord
@@ -18,61 +19,70 @@ class VoiceSession(TypedDict):
 
 
 active_voice_sessions: dict[int, VoiceSession] = {}
-voice_sessions_lock: asyncio.Lock = asyncio.Lock()
+# Orders the saving of each member's sessions, a lock goes away once no event holds or waits on it
+member_save_locks: weakref.WeakValueDictionary[int, asyncio.Lock] = weakref.WeakValueDictionary()
+
+
+def _transition(member_id: int, channel: discord.abc.GuildChannel | None, now: datetime.datetime) -> VoiceSession | None:
+    """
+    Moves a member into a channel, or out of voice with None, and returns the session this ended, if any.
+    Never awaits, so the events of a member can't interleave and each one sees the state the one before left.
+    """
+    current = active_voice_sessions.get(member_id)
+    if current is not None and channel is not None and current["channel_id"] == str(channel.id):
+        return None
+    
+    if channel is None:
+        active_voice_sessions.pop(member_id, None)
+    else:
+        active_voice_sessions[member_id] = {
+            "channel_id":   str(channel.id),
+            "channel_name": channel.name,
+            "joined_at":    now,
+        }
+    return current
+
+
+async def _save_session(member_id: int, join_data: VoiceSession, leave_time: datetime.datetime) -> None:
+    """Upload an ended session, after the earlier sessions of the same member"""
+    voice_session = {
+        "user_id":          str(member_id),
+        "channel_id":       join_data["channel_id"],
+        "duration_seconds": int((leave_time - join_data["joined_at"]).total_seconds()),
+        "timestamp":        int(leave_time.timestamp()),
+    }
+    
+    # Only this member's saves wait on each other, so a slow write doesn't hold up anyone else's events
+    lock = member_save_locks.setdefault(member_id, asyncio.Lock())
+    async with lock:
+        await db_stuff.send_voice_session(voice_session)
 
 
 async def handle_join(member: discord.Member, after: discord.VoiceState | discord.VoiceChannel) -> None:
     """Track when a user joins a voice channel"""
-    async with voice_sessions_lock:
-        if isinstance(after, discord.VoiceState):
-            if after.channel is None:
-                logger.error(f"{member.name} joined a voice state with no channel")
-                return
-            logger.info(f"{member.name} joined {after.channel.name}")
-            
-            active_voice_sessions[member.id] = {
-                "channel_id":   str(after.channel.id),
-                "channel_name": after.channel.name,
-                "joined_at":    discord.utils.utcnow(),
-            }
-        else:
-            logger.info(f"{member.name} joined {after.name}")
-            
-            active_voice_sessions[member.id] = {
-                "channel_id":   str(after.id),
-                "channel_name": after.name,
-                "joined_at":    discord.utils.utcnow(),
-            }
+    channel = after.channel if isinstance(after, discord.VoiceState) else after
+    if channel is None:
+        logger.error(f"{member.name} joined a voice state with no channel")
+        return
+    logger.info(f"{member.name} joined {channel.name}")
+    
+    now = discord.utils.utcnow()
+    ended = _transition(member.id, channel, now)
+    if ended is not None:
+        logger.warning(f"{member.name} joined {channel.name} while still tracked in {ended["channel_name"]}")
+        await _save_session(member.id, ended, now)
 
 
 async def handle_leave(member: discord.Member) -> None:
     """Track when a user leaves a voice channel and upload session data"""
-    logger.info(f"{member.name} left {active_voice_sessions[member.id]["channel_name"]}")
-    async with voice_sessions_lock:
-        # Get join data
-        if member.id not in active_voice_sessions:
-            logger.error(f"No join record found for {member.name}")
-            return
-        
-        join_data = active_voice_sessions[member.id]
-        leave_time = discord.utils.utcnow()
-        join_time = join_data["joined_at"]
-        
-        # Calculate duration
-        duration_seconds = int((leave_time - join_time).total_seconds())
-        
-        # Create voice session document
-        voice_session = {
-            "user_id":          str(member.id),
-            "channel_id":       join_data["channel_id"],
-            "duration_seconds": duration_seconds,
-            "timestamp":        int(leave_time.timestamp()),
-        }
-        
-        await db_stuff.send_voice_session(voice_session)
-
-        # Clear session data
-        del active_voice_sessions[member.id]
+    now = discord.utils.utcnow()
+    ended = _transition(member.id, None, now)
+    if ended is None:
+        logger.error(f"No join record found for {member.name}")
+        return
+    logger.info(f"{member.name} left {ended["channel_name"]}")
+    
+    await _save_session(member.id, ended, now)
 
 
 async def handle_move(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState) -> None:
@@ -81,24 +91,30 @@ async def handle_move(member: discord.Member, before: discord.VoiceState, after:
         logger.error(f"{member.name} moved but one of the channels is None")
         return
     logger.info(f"{member.name} moved from {before.channel.name} to {after.channel.name}")
-
-    async with voice_sessions_lock:
-        # First record the "leave" from the previous channel
-        await handle_leave(member)
-        
-        # Then record the "join" to the new channel
-        await handle_join(member, after)
+    
+    # Leaving the previous channel and joining the new one is a single transition
+    now = discord.utils.utcnow()
+    ended = _transition(member.id, after.channel, now)
+    if ended is None:
+        logger.error(f"No session to end for {member.name}, tracking them from {after.channel.name}")
+        return
+    
+    await _save_session(member.id, ended, now)
 
 
 async def leave_all(bot: CoolBot) -> None:
-    """Force leave all active voice sessions"""
+    """Force leave all active voice sessions, uploading them in parallel"""
+    now = discord.utils.utcnow()
+    saves = []
     for member_id in list(active_voice_sessions.keys()):
-        member = discord.utils.get(bot.get_all_members(), id=member_id)
-        if member:
-            await handle_leave(member)
-        else:
-            logger.warning(f"Member with ID {member_id} not found, clearing session data")
-            del active_voice_sessions[member_id]
+        ended = _transition(member_id, None, now)
+        if ended is None:
+            continue
+        user = bot.get_user(member_id)
+        logger.info(f"{user.name if user else member_id} left {ended["channel_name"]}")
+        saves.append(_save_session(member_id, ended, now))
+    
+    await asyncio.gather(*saves)
 
 
 async def reconnect_all(bot: CoolBot) -> None:
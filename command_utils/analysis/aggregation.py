@@ -0,0 +1,417 @@
+"""
+MongoDB aggregation backend for the message analysis commands.
+
+The statistics are computed inside MongoDB with $group/$facet pipelines, so only the
+aggregated numbers travel over the wire instead of the whole message corpus.
+Requires MongoDB 7.0+ for $median, $setWindowFields and $shift; callers fall back to the
+Python implementation when a pipeline fails.
+"""
+import logging
+import re
+import string
+from collections.abc import Collection, Mapping
+from typing import Any, Final, TypedDict
+
+from utils import db_indexes, db_stuff, message_rollups
+
+logger = logging.getLogger("discord")
+
+db_indexes.register_index("messages", [("timestamp", 1)])
+db_indexes.register_query("Messages since time", "messages", {"timestamp": {"$gte": 0}})
+
+REQUIRED_MESSAGE_KEYS: Final[tuple[str, ...]] = (
+    "author", "author_id", "author_global_name",
+    "content", "reply_to", "HasAttachments",
+    "timestamp", "channel", "channel_id", "id",
+)
+# Equivalent of str.split() with no arguments
+WORD_REGEX: Final[str] = r"\S+"
+PUNCT_ONLY_REGEX: Final[re.Pattern[str]] = re.compile(f"^[{re.escape(string.punctuation)}]+$")
+
+
+class AggregatedTotals(TypedDict):
+    count: int
+    length_sum: int
+    word_sum: int
+    median_length: float
+    first: float
+    last: float
+
+
+class AggregatedGap(TypedDict):
+    start: float
+    end: float
+    gap: float
+
+
+class AggregatedMessageStats(TypedDict):
+    totals: AggregatedTotals
+    users: dict[str, int]
+    channels: dict[str, int]
+    longest_gap: AggregatedGap | None
+
+
+class AggregatedWordStats(TypedDict):
+    unique: int
+    total: int
+    unique_length_sum: int
+    top: list[tuple[str, int]]
+
+
+def _author_filter(excluded_user_ids: Collection[str], author_ids: Collection[str] | None, author_id: str | None) -> dict[str, Any]:
+    author_filter: dict[str, Any] = {"$nin": list(excluded_user_ids)}
+    if author_ids is not None:
+        author_filter["$in"] = list(author_ids)
+    if author_id is not None:
+        author_filter["$eq"] = author_id
+    return author_filter
+
+
+def build_message_match(
+        excluded_user_ids: Collection[str],
+        since: float | None = None,
+        author_ids: Collection[str] | None = None,
+        author_id: str | None = None,
+        until: float | None = None,
+    ) -> dict[str, Any]:
+    """
+    Build the $match stage selecting valid messages.
+    
+    Args:
+        excluded_user_ids: Authors whose messages are never analysed
+        since: Only match messages sent at or after this UNIX timestamp
+        author_ids: Only match messages from these authors, e.g. current guild members
+        author_id: Only match messages from this author
+        until: Only match messages sent before this UNIX timestamp
+    
+    Returns:
+        The $match filter
+    """
+    match: dict[str, Any] = {key: {"$exists": True} for key in REQUIRED_MESSAGE_KEYS}
+    match["content"] = {"$type": "string"}
+    match["author_id"] = _author_filter(excluded_user_ids, author_ids, author_id)
+    
+    timestamp_filter: dict[str, Any] = {}
+    if since is not None:
+        timestamp_filter["$gte"] = since
+    if until is not None:
+        timestamp_filter["$lt"] = until
+    if timestamp_filter:
+        match["timestamp"] = timestamp_filter
+    
+    return match
+
+
+def build_rollup_match(
+        excluded_user_ids: Collection[str],
+        since_day: int | None = None,
+        author_ids: Collection[str] | None = None,
+        author_id: str | None = None,
+    ) -> dict[str, Any]:
+    """
+    Build the $match stage selecting message rollup rows, the rollup equivalent of build_message_match.
+    
+    Args:
+        excluded_user_ids: Authors whose messages are never analysed
+        since_day: Only match rows for this UTC day (as a UNIX timestamp at midnight) and later
+        author_ids: Only match rows of these authors
+        author_id: Only match rows of this author
+    
+    Returns:
+        The $match filter
+    """
+    match: dict[str, Any] = {"author_id": _author_filter(excluded_user_ids, author_ids, author_id)}
+    if since_day is not None:
+        match["day"] = {"$gte": since_day}
+    return match
+
+
+def _interesting_word_filter(excluded_words: Collection[str]) -> dict[str, Any]:
+    """$match equivalent of word_stats.is_valid_word, applied to grouped words in _id"""
+    return {
+        "$and": [
+            {"_id": {"$nin": list(excluded_words)}},
+            {"_id": {"$not": re.compile(r"^https://")}},
+            {"_id": {"$not": re.compile(r"^<@.*>$", re.DOTALL)}},
+            {"_id": {"$not": PUNCT_ONLY_REGEX}},
+            {"$expr": {"$gt": [{"$strLenCP": "$_id"}, 2]}},
+        ],
+    }
+
+
+def message_stats_pipeline(match: Mapping[str, Any]) -> list[dict[str, Any]]:
+    return [
+        {"$match": match},
+        {"$project": {
+            "_id":        0,
+            "author_id":  1,
+            "channel_id": 1,
+            "timestamp":  1,
+            "length":     {"$strLenCP": "$content"},
+            "words":      {"$size": {"$regexFindAll": {"input": "$content", "regex": WORD_REGEX}}},
+        }},
+        {"$facet": {
+            "totals":      [{"$group": {
+                "_id":           None,
+                "count":         {"$sum": 1},
+                "length_sum":    {"$sum": "$length"},
+                "word_sum":      {"$sum": "$words"},
+                "median_length": {"$median": {"input": "$length", "method": "approximate"}},
+                "first":         {"$min": "$timestamp"},
+                "last":          {"$max": "$timestamp"},
+            }}],
+            "users":       [{"$group": {"_id": "$author_id", "count": {"$sum": 1}}}],
+            "channels":    [{"$group": {"_id": "$channel_id", "count": {"$sum": 1}}}],
+            "longest_gap": _longest_gap_stages(),
+        }},
+    ]
+
+
+def _longest_gap_stages() -> list[dict[str, Any]]:
+    return [
+        {"$setWindowFields": {
+            "sortBy": {"timestamp": 1},
+            "output": {"previous": {"$shift": {"output": "$timestamp", "by": -1}}},
+        }},
+        {"$match": {"previous": {"$ne": None}}},
+        {"$project": {"start": "$previous", "end": "$timestamp", "gap": {"$subtract": ["$timestamp", "$previous"]}}},
+        {"$sort": {"gap": -1}},
+        {"$limit": 1},
+    ]
+
+
+def length_and_gap_pipeline(match: Mapping[str, Any]) -> list[dict[str, Any]]:
+    """The part of message_stats_pipeline the rollups can't replace: the median length and the longest gap"""
+    return [
+        {"$match": match},
+        {"$project": {"_id": 0, "timestamp": 1, "length": {"$strLenCP": "$content"}}},
+        {"$facet": {
+            "median_length": [{"$group": {"_id": None, "median_length": {"$median": {"input": "$length", "method": "approximate"}}}}],
+            "longest_gap":   _longest_gap_stages(),
+        }},
+    ]
+
+
+def rollup_stats_pipeline(match: Mapping[str, Any]) -> list[dict[str, Any]]:
+    return [
+        {"$match": match},
+        {"$facet": {
+            "totals":   [{"$group": {
+                "_id":        None,
+                "count":      {"$sum": "$count"},
+                "length_sum": {"$sum": "$chars"},
+                "word_sum":   {"$sum": "$words"},
+                "first":      {"$min": "$first"},
+                "last":       {"$max": "$last"},
+            }}],
+            "users":    [{"$group": {"_id": "$author_id", "count": {"$sum": "$count"}}}],
+            "channels": [{"$group": {"_id": "$channel_id", "count": {"$sum": "$count"}}}],
+        }},
+    ]
+
+
+def word_stats_pipeline(match: Mapping[str, Any], excluded_words: Collection[str]) -> list[dict[str, Any]]:
+    # $toLower only lowercases ASCII, unlike str.lower(), so non-latin words may be counted separately
+    return [
+        {"$match": match},
+        {"$project": {"_id": 0, "words": {"$regexFindAll": {"input": {"$toLower": "$content"}, "regex": WORD_REGEX}}}},
+        {"$unwind": "$words"},
+        {"$group": {"_id": "$words.match", "count": {"$sum": 1}}},
+        {"$facet": {
+            "vocabulary": [{"$group": {
+                "_id":               None,
+                "unique":            {"$sum": 1},
+                "total":             {"$sum": "$count"},
+                "unique_length_sum": {"$sum": {"$strLenCP": "$_id"}},
+            }}],
+            "top":        [
+                {"$match": _interesting_word_filter(excluded_words)},
+                {"$sort": {"count": -1, "_id": 1}},
+                {"$limit": 3},
+            ],
+        }},
+    ]
+
+
+def user_counts_pipeline(match: Mapping[str, Any], count_field: str | None = None) -> list[dict[str, Any]]:
+    return [
+        {"$match": match},
+        {"$group": {"_id": "$author_id", "count": {"$sum": 1 if count_field is None else f"${count_field}"}}},
+    ]
+
+
+def _empty_message_stats() -> AggregatedMessageStats:
+    return AggregatedMessageStats(
+            totals=AggregatedTotals(count=0, length_sum=0, word_sum=0, median_length=0.0, first=0.0, last=0.0),
+            users={},
+            channels={},
+            longest_gap=None,
+    )
+
+
+def _gap_from_facets(facets: Mapping[str, Any]) -> AggregatedGap | None:
+    if not facets.get("longest_gap"):
+        return None
+    raw_gap = facets["longest_gap"][0]
+    return AggregatedGap(start=raw_gap["start"], end=raw_gap["end"], gap=raw_gap["gap"])
+
+
+def _message_stats_from_facets(facets: Mapping[str, Any]) -> AggregatedMessageStats:
+    if not facets["totals"]:
+        return _empty_message_stats()
+    
+    totals = facets["totals"][0]
+    gap = _gap_from_facets(facets)
+    return AggregatedMessageStats(
+            totals=AggregatedTotals(
+                    count=totals["count"],
+                    length_sum=totals["length_sum"],
+                    word_sum=totals["word_sum"],
+                    median_length=totals.get("median_length") or 0.0,
+                    first=totals["first"],
+                    last=totals["last"],
+            ),
+            users={doc["_id"]: doc["count"] for doc in facets.get("users", [])},
+            channels={doc["_id"]: doc["count"] for doc in facets.get("channels", [])},
+            longest_gap=gap,
+    )
+
+
+def merge_counts(first: Mapping[str, int], second: Mapping[str, int]) -> dict[str, int]:
+    merged: dict[str, int] = dict(first)
+    for key, count in second.items():
+        merged[key] = merged.get(key, 0) + count
+    return merged
+
+
+def merge_message_stats(first: AggregatedMessageStats, second: AggregatedMessageStats) -> AggregatedMessageStats:
+    """
+    Combine the counts of two disjoint sets of messages.
+    The median length and longest gap can't be combined, so they are taken from whichever set is larger.
+    """
+    if second["totals"]["count"] == 0:
+        return first
+    if first["totals"]["count"] == 0:
+        return second
+    
+    larger = first if first["totals"]["count"] >= second["totals"]["count"] else second
+    a, b = first["totals"], second["totals"]
+    return AggregatedMessageStats(
+            totals=AggregatedTotals(
+                    count=a["count"] + b["count"],
+                    length_sum=a["length_sum"] + b["length_sum"],
+                    word_sum=a["word_sum"] + b["word_sum"],
+                    median_length=larger["totals"]["median_length"],
+                    first=min(a["first"], b["first"]),
+                    last=max(a["last"], b["last"]),
+            ),
+            users=merge_counts(first["users"], second["users"]),
+            channels=merge_counts(first["channels"], second["channels"]),
+            longest_gap=larger["longest_gap"],
+    )
+
+
+async def aggregate_message_stats(match: Mapping[str, Any]) -> AggregatedMessageStats | None:
+    """
+    Count messages per user and channel, and compute length, word count, timestamp and gap statistics.
+    
+    Returns:
+        The aggregated statistics, or None if the aggregation could not be run
+    """
+    results = await db_stuff.aggregate_db("messages", message_stats_pipeline(match))
+    if not results:
+        return None
+    return _message_stats_from_facets(results[0])
+
+
+async def aggregate_length_and_gap(match: Mapping[str, Any]) -> tuple[float, AggregatedGap | None] | None:
+    """
+    Compute the median message length and the longest gap between messages, for statistics otherwise read from the rollups.
+    
+    Returns:
+        The median length and longest gap, or None if the aggregation could not be run
+    """
+    results = await db_stuff.aggregate_db("messages", length_and_gap_pipeline(match))
+    if not results:
+        return None
+    
+    facets = results[0]
+    median_length: float = 0.0
+    if facets["median_length"]:
+        median_length = facets["median_length"][0]["median_length"] or 0.0
+    return median_length, _gap_from_facets(facets)
+
+
+async def aggregate_rollup_stats(match: Mapping[str, Any]) -> AggregatedMessageStats | None:
+    """
+    Count messages per user and channel, with their total length, word count and first and last timestamps,
+    from the daily rollups. The median length and longest gap are not available from the rollups.
+    
+    Returns:
+        The aggregated statistics, or None if the aggregation could not be run
+    """
+    results = await db_stuff.aggregate_db(message_rollups.ROLLUP_COLLECTION, rollup_stats_pipeline(match))
+    if not results:
+        return None
+    return _message_stats_from_facets(results[0])
+
+
+async def aggregate_word_stats(match: Mapping[str, Any], excluded_words: Collection[str]) -> AggregatedWordStats | None:
+    """
+    Compute vocabulary size, total words and the top 3 interesting words.
+    
+    Returns:
+        The aggregated word statistics, or None if the aggregation could not be run
+    """
+    results = await db_stuff.aggregate_db("messages", word_stats_pipeline(match, excluded_words))
+    if not results:
+        return None
+    
+    facets = results[0]
+    if not facets["vocabulary"]:
+        return AggregatedWordStats(unique=0, total=0, unique_length_sum=0, top=[])
+    
+    vocabulary = facets["vocabulary"][0]
+    return AggregatedWordStats(
+            unique=vocabulary["unique"],
+            total=vocabulary["total"],
+            unique_length_sum=vocabulary["unique_length_sum"],
+            top=[(doc["_id"], doc["count"]) for doc in facets["top"]],
+    )
+
+
+async def aggregate_user_counts(match: Mapping[str, Any]) -> dict[str, int] | None:
+    """
+    Count the matched messages of every author.
+    
+    Returns:
+        A mapping of author ID to message count, or None if the aggregation could not be run
+    """
+    results = await db_stuff.aggregate_db("messages", user_counts_pipeline(match))
+    if results is None:
+        return None
+    return {doc["_id"]: doc["count"] for doc in results}
+
+
+async def aggregate_rollup_user_counts(match: Mapping[str, Any]) -> dict[str, int] | None:
+    """
+    Count the messages of every author from the daily rollups.
+    
+    Returns:
+        A mapping of author ID to message count, or None if the aggregation could not be run
+    """
+    results = await db_stuff.aggregate_db(message_rollups.ROLLUP_COLLECTION, user_counts_pipeline(match, "count"))
+    if results is None:
+        return None
+    return {doc["_id"]: doc["count"] for doc in results}
+
+
+async def rebuild_rollups() -> bool:
+    """
+    Recompute the daily rollups from the whole message history, replacing the current ones.
+    Messages are only held back while the last part of it runs, see db_stuff.rebuild_message_rollups.
+    
+    Returns:
+        If the rollups were rebuilt
+    """
+    return await db_stuff.rebuild_message_rollups(build_message_match([]))
@@ -1,7 +1,13 @@
+import asyncio
+from collections.abc import Iterable
+
 import discord
 
 from command_utils.CContext import CoolBot
-from utils import db_stuff, discord_utils
+from utils import db_indexes, db_stuff, discord_utils
+
+db_indexes.register_index("messages", [("author_id", 1), ("timestamp", -1)])
+db_indexes.register_query("Latest message by author", "messages", {"author_id": "0"}, sort=[("timestamp", -1)])
 
 
 async def _resolve_deleted_uid(uid: int) -> str:
@@ -37,6 +43,18 @@ async def user_id_to_display_name(uid: int, bot: CoolBot) -> str:
     return user.display_name if user else await _resolve_deleted_uid(uid)
 
 
+async def user_ids_to_display_names(uids: Iterable[int], bot: CoolBot) -> dict[int, str]:
+    """
+    Resolve many user IDs to display names at once, like user_id_to_display_name.
+    Users missing from the gateway cache are fetched concurrently instead of one after another.
+    """
+    users = await discord_utils.resolve_users(uids, bot)
+    deleted = [uid for uid, user in users.items() if user is None]
+    names = {uid: user.display_name for uid, user in users.items() if user is not None}
+    names.update(zip(deleted, await asyncio.gather(*(_resolve_deleted_uid(uid) for uid in deleted)), strict=True))
+    return names
+
+
 async def try_resolve_channel_id(channel_id: str, guild: discord.Guild | None = None) -> str:
     if guild is None:
         return channel_id
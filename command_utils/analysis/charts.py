@@ -0,0 +1,119 @@
+"""
+Renders the analysis charts off the event loop, with matplotlib's object oriented Agg API.
+Nothing here touches pyplot's global state, so charts can be drawn in several threads at once.
+"""
+import asyncio
+import concurrent.futures
+import io
+import threading
+from dataclasses import dataclass
+from typing import Final
+
+import cachetools
+from matplotlib.axes import Axes
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+FIGURE_COLOUR: Final[str] = "#1f1f1f"
+AXES_COLOUR: Final[str] = "#2d2d2d"
+BAR_COLOUR: Final[str] = "#8a2be2"
+SPINE_COLOUR: Final[str] = "#555555"
+TEXT_COLOUR: Final[str] = "white"
+
+
+@dataclass(frozen=True)
+class BarChart:
+    """A horizontal bar chart, with the bars from top to bottom in the order of ``labels``"""
+    labels: tuple[str, ...]
+    values: tuple[float, ...]
+    title: str
+    xlabel: str
+    figsize: tuple[float, float] = (10, 6)
+
+
+# Figures are expensive to create, so each rendering thread keeps one styled figure per size and redraws it
+_templates = threading.local()
+
+
+def _template(figsize: tuple[float, float]) -> tuple[Figure, Axes]:
+    templates: dict[tuple[float, float], tuple[Figure, Axes]] = _templates.__dict__.setdefault("figures", {})
+    if figsize not in templates:
+        figure = Figure(figsize=figsize, facecolor=FIGURE_COLOUR)
+        FigureCanvasAgg(figure)
+        axes = figure.add_subplot()
+        axes.set_facecolor(AXES_COLOUR)  # Kept when the axes are cleared
+        templates[figsize] = (figure, axes)
+    return templates[figsize]
+
+
+def render_bar_chart(chart: BarChart) -> bytes:
+    """
+    Draw a bar chart in the dark theme.
+    
+    Args:
+        chart: The chart to draw
+    
+    Returns:
+        The chart as a PNG image
+    """
+    figure, axes = _template(chart.figsize)
+    axes.clear()
+    # barh draws the first bar at the bottom
+    axes.barh(chart.labels[::-1], chart.values[::-1], color=BAR_COLOUR)
+    axes.set_xlabel(chart.xlabel, color=TEXT_COLOUR)
+    axes.set_title(chart.title, color=TEXT_COLOUR)
+    axes.tick_params(axis="both", colors=TEXT_COLOUR)
+    for spine in axes.spines.values():
+        spine.set_color(SPINE_COLOUR)
+    figure.tight_layout()
+    
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+class ChartRenderer:
+    """
+    Renders charts on a small thread pool and keeps the most recently rendered images,
+    so the same chart requested again, e.g. for an unchanged cached analysis, isn't drawn twice.
+    """
+    
+    def __init__(self, workers: int = 2, cache_size: int = 32):
+        self.workers: int = max(1, workers)
+        self.hits: int = 0
+        self.renders: int = 0
+        self._pool: concurrent.futures.ThreadPoolExecutor | None = None
+        self._images: cachetools.LRUCache[BarChart, bytes] = cachetools.LRUCache(maxsize=cache_size)
+    
+    async def render(self, chart: BarChart) -> bytes:
+        """
+        Get a chart as a PNG image, rendering it if it isn't cached.
+        
+        Args:
+            chart: The chart to draw
+        
+        Returns:
+            The chart as a PNG image
+        """
+        image = self._images.get(chart)
+        if image is not None:
+            self.hits += 1
+            return image
+        
+        if self._pool is None:
+            self._pool = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix="charts")
+        image = await asyncio.get_running_loop().run_in_executor(self._pool, render_bar_chart, chart)
+        self.renders += 1
+        self._images[chart] = image
+        return image
+    
+    def shutdown(self) -> None:
+        """Stop the rendering threads without waiting for running renders"""
+        if self._pool is None:
+            return
+        
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+
+chart_renderer: ChartRenderer = ChartRenderer()
@@ -0,0 +1,126 @@
+"""
+Runs CPU heavy analysis jobs off the event loop, in worker processes or threads
+"""
+import asyncio
+import concurrent.futures
+import logging
+import multiprocessing
+from collections.abc import Callable
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any
+
+logger = logging.getLogger("discord")
+
+
+class AnalysisTimeoutError(TimeoutError):
+    """An analysis job ran longer than the configured timeout and was cancelled"""
+
+
+class AnalysisExecutor:
+    """
+    A capped pool for analysis jobs.
+    
+    At most ``max_jobs`` jobs are submitted at once, further callers wait for a slot, so a burst of
+    analysis commands queues up instead of flooding the workers.
+    A job that exceeds ``timeout`` seconds, or whose command is cancelled, is cancelled: a queued job is
+    dropped, a running job in a worker process is stopped by terminating the workers. Threads can't be
+    stopped, so in thread mode a running job finishes in the background and its result is discarded.
+    
+    Jobs must be module level functions of modules without Discord or database imports, with picklable
+    arguments and results, so they can run in a worker process.
+    """
+    
+    def __init__(self, workers: int = 2, max_jobs: int = 2, timeout: float = 60.0, use_processes: bool = True):
+        self.workers: int = max(1, workers)
+        self.max_jobs: int = max(1, max_jobs)
+        self.timeout: float = timeout
+        self.use_processes: bool = use_processes
+        self._slots: asyncio.Semaphore = asyncio.Semaphore(self.max_jobs)
+        self._pool: concurrent.futures.Executor | None = None
+    
+    def configure(self, workers: int, max_jobs: int, timeout: float, use_processes: bool) -> None:
+        """Apply new settings. Running jobs finish on the old pool, new jobs use a new one."""
+        self.shutdown()
+        self.workers = max(1, workers)
+        self.max_jobs = max(1, max_jobs)
+        self.timeout = timeout
+        self.use_processes = use_processes
+        self._slots = asyncio.Semaphore(self.max_jobs)
+    
+    def _get_pool(self) -> concurrent.futures.Executor:
+        if self._pool is None:
+            if self.use_processes:
+                # Not fork: the bot process runs threads, and a forked child can inherit a lock one of them held.
+                # The fork server imports main.py once, which only runs the bot as __main__
+                self._pool = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("forkserver"))
+            else:
+                self._pool = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix="analysis")
+        return self._pool
+    
+    def _cancel(self, pool: concurrent.futures.Executor, future: concurrent.futures.Future[Any]) -> None:
+        """Stop a job that is no longer wanted"""
+        if future.cancel():
+            return
+        
+        if isinstance(pool, concurrent.futures.ProcessPoolExecutor):
+            # A running job can only be stopped by killing its worker. The pool can't replace a killed worker,
+            # so the whole pool is terminated; jobs of other commands running on it are resubmitted by run()
+            logger.warning("Terminating analysis workers to stop a cancelled job")
+            if self._pool is pool:
+                self._pool = None
+            pool.terminate_workers()
+        else:
+            logger.warning("Cancelled analysis job keeps running in its thread, its result will be discarded")
+    
+    async def run[R](self, func: Callable[..., R], *args: Any) -> R:
+        """
+        Run ``func(*args)`` on the pool.
+        
+        Args:
+            func: The job, a module level function
+            args: Its arguments, copied to the worker
+        
+        Returns:
+            The result of the job
+        
+        Raises:
+            AnalysisTimeoutError: If the job didn't finish within the timeout
+        """
+        async with self._slots:
+            retried: bool = False
+            while True:
+                pool = self._get_pool()
+                future = pool.submit(func, *args)
+                try:
+                    return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout if self.timeout > 0 else None)
+                
+                except TimeoutError:
+                    self._cancel(pool, future)
+                    raise AnalysisTimeoutError(f"Analysis job {func.__name__} did not finish within {self.timeout} seconds") from None
+                
+                except asyncio.CancelledError:
+                    # A job lost to another job's termination is cancelled too, without this task being cancelled
+                    current = asyncio.current_task()
+                    if retried or self._pool is pool or (current is not None and current.cancelling()):
+                        self._cancel(pool, future)
+                        raise
+                
+                except BrokenProcessPool:
+                    if retried:
+                        raise
+                    if self._pool is pool:
+                        self._pool = None
+                
+                logger.info(f"Resubmitting analysis job {func.__name__} to a new worker pool")
+                retried = True
+    
+    def shutdown(self) -> None:
+        """Stop the workers without waiting for running jobs"""
+        if self._pool is None:
+            return
+        
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+
+analysis_executor: AnalysisExecutor = AnalysisExecutor()
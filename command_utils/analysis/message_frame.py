@@ -0,0 +1,276 @@
+"""
+Columnar in-memory copy of the messages collection, for vectorised filtering and statistics.
+Free of Discord and database imports, so frames can be shipped to analysis worker processes.
+"""
+import logging
+import time
+from collections.abc import Collection, Iterable, Mapping
+from typing import Any, Final, Self, TypedDict
+
+import numpy as np
+import numpy.typing as npt
+
+from command_utils.analysis.word_stats import WordStats, analyse_weighted_word_stats
+
+logger = logging.getLogger("discord")
+
+DAY_SECONDS: Final[int] = 86400
+
+BoolArray = npt.NDArray[np.bool_]
+
+
+class FrameTiming(TypedDict):
+    longest_gap: float
+    gap_start: float
+    gap_end: float
+    average_gap: float
+    messages_per_day: float
+
+
+class FrameSummary(TypedDict):
+    total: int
+    word_stats: WordStats | None
+    author_counts: dict[str, int]
+    channel_counts: dict[str, int]
+    median_length: float
+    average_words: float
+    timing: FrameTiming | None
+    latest: float | None
+
+
+def _ids_array(ids: Iterable[int | str]) -> npt.NDArray[np.int64]:
+    return np.fromiter((int(i) for i in ids), dtype=np.int64)
+
+
+class MessageFrame:
+    """
+    The valid messages as parallel NumPy columns, so filters and statistics run as array operations
+    instead of passes over a list of dicts.
+    
+    Row i of every column belongs to the same message, in the order the messages were given.
+    Message text is interned: ``content_ids`` indexes into ``contents``, which holds each distinct
+    text once, so repeated messages ("lol", "gm", ...) are stored and analysed only once.
+    Author and channel IDs are also kept as dense codes, so counting them is a bincount instead of a sort.
+    ``version`` is the message store version the frame was built from.
+    """
+    
+    def __init__(
+            self,
+            author_ids: npt.NDArray[np.int64],
+            channel_ids: npt.NDArray[np.int64],
+            timestamps: npt.NDArray[np.float64],
+            content_ids: npt.NDArray[np.int32],
+            contents: list[str],
+            total_documents: int,
+            version: int = -1,
+            lengths: npt.NDArray[np.int32] | None = None,
+            word_counts: npt.NDArray[np.int32] | None = None,
+        ):
+        self.author_ids: npt.NDArray[np.int64] = author_ids
+        self.channel_ids: npt.NDArray[np.int64] = channel_ids
+        self.timestamps: npt.NDArray[np.float64] = timestamps
+        self.content_ids: npt.NDArray[np.int32] = content_ids
+        self.contents: list[str] = contents
+        self.total_documents: int = total_documents
+        self.version: int = version
+        self.built_at: float = time.monotonic()
+        
+        self.author_keys, self.author_codes = self._factorize(author_ids)
+        self.channel_keys, self.channel_codes = self._factorize(channel_ids)
+        if lengths is None or word_counts is None:
+            content_lengths = np.fromiter((len(c) for c in contents), dtype=np.int32, count=len(contents))
+            content_words = np.fromiter((len(c.split()) for c in contents), dtype=np.int32, count=len(contents))
+            lengths, word_counts = content_lengths[content_ids], content_words[content_ids]
+        self.lengths: npt.NDArray[np.int32] = lengths
+        self.word_counts: npt.NDArray[np.int32] = word_counts
+    
+    @classmethod
+    def from_messages(cls,
+                      messages: Iterable[Mapping[str, Any]],
+                      required_keys: Collection[str],
+                      version: int = -1,
+                      ) -> tuple[Self, list[Any]]:
+        """
+        Build a frame from message documents in a single pass.
+        
+        Args:
+            messages: The message documents, e.g. a message store snapshot
+            required_keys: Keys a document must have to be included
+            version: The message store version of the documents
+        
+        Returns:
+            The frame, and the database IDs of documents missing required keys
+        """
+        author_ids: list[int] = []
+        channel_ids: list[int] = []
+        timestamps: list[float] = []
+        content_ids: list[int] = []
+        pool: dict[str, int] = {}
+        invalid_ids: list[Any] = []
+        total: int = 0
+        
+        for message in messages:
+            total += 1
+            if not all(key in message for key in required_keys):
+                if "_id" in message:
+                    invalid_ids.append(message["_id"])
+                continue
+            
+            content = message["content"]
+            try:
+                author_id, channel_id, timestamp = int(message["author_id"]), int(message["channel_id"]), float(message["timestamp"])
+            except (TypeError, ValueError):
+                logger.debug(f"Leaving message with malformed fields out of the message frame: {message.get("_id")}")
+                continue
+            if not isinstance(content, str):
+                continue
+            
+            author_ids.append(author_id)
+            channel_ids.append(channel_id)
+            timestamps.append(timestamp)
+            content_ids.append(pool.setdefault(content, len(pool)))
+        
+        frame = cls(
+                author_ids=np.array(author_ids, dtype=np.int64),
+                channel_ids=np.array(channel_ids, dtype=np.int64),
+                timestamps=np.array(timestamps, dtype=np.float64),
+                content_ids=np.array(content_ids, dtype=np.int32),
+                contents=list(pool),
+                total_documents=total,
+                version=version,
+        )
+        return frame, invalid_ids
+    
+    def __len__(self) -> int:
+        return len(self.timestamps)
+    
+    def select(self, selected: BoolArray, with_contents: bool = True) -> Self:
+        """
+        A new frame holding only the selected rows, with the content pool cut down to the texts they use.
+        Used to ship a compact frame to a worker process instead of the whole store.
+        Without contents the texts are left out entirely, for a summary without word statistics;
+        the lengths and word counts are kept, but content_counts is empty.
+        """
+        if with_contents:
+            used, content_ids = np.unique(self.content_ids[selected], return_inverse=True)
+            contents: list[str] = [self.contents[i] for i in used.tolist()]
+        else:
+            content_ids, contents = np.zeros(int(selected.sum()), dtype=np.int32), []
+        return type(self)(
+                author_ids=self.author_ids[selected],
+                channel_ids=self.channel_ids[selected],
+                timestamps=self.timestamps[selected],
+                content_ids=content_ids.astype(np.int32),
+                contents=contents,
+                total_documents=self.total_documents,
+                version=self.version,
+                lengths=self.lengths[selected],
+                word_counts=self.word_counts[selected],
+        )
+    
+    def mask(
+            self,
+            since: float | None = None,
+            author_ids: Collection[int | str] | None = None,
+            excluded_author_ids: Collection[int | str] | None = None,
+        ) -> BoolArray:
+        """
+        Select messages sent at or after ``since``, by one of ``author_ids`` and by none of ``excluded_author_ids``.
+        """
+        selected: BoolArray = np.ones(len(self), dtype=np.bool_)
+        if since is not None:
+            selected &= self.timestamps >= since
+        if author_ids is not None:
+            selected &= np.isin(self.author_ids, _ids_array(author_ids))
+        if excluded_author_ids:
+            selected &= ~np.isin(self.author_ids, _ids_array(excluded_author_ids))
+        return selected
+    
+    @staticmethod
+    def _factorize(column: npt.NDArray[np.int64]) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int32]]:
+        """The distinct values of a column, and the index of each row's value among them"""
+        keys, codes = np.unique(column, return_inverse=True)
+        return keys, codes.astype(np.int32)
+    
+    @staticmethod
+    def _code_counts(codes: npt.NDArray[np.int32], size: int, selected: BoolArray) -> tuple[list[int], list[int]]:
+        """
+        Count the selected rows per code.
+        Returns the codes that occur, in order of first appearance like collections.Counter, and their counts.
+        """
+        rows = np.flatnonzero(selected)
+        selected_codes = codes[rows]
+        counts = np.bincount(selected_codes, minlength=size)
+        first_row = np.full(size, len(codes), dtype=np.int64)
+        np.minimum.at(first_row, selected_codes, rows)
+        present = np.flatnonzero(counts)
+        order = present[np.argsort(first_row[present], kind="stable")]
+        return order.tolist(), counts[order].tolist()
+    
+    def author_counts(self, selected: BoolArray) -> dict[str, int]:
+        """Messages per author ID, in order of each author's first message"""
+        codes, counts = self._code_counts(self.author_codes, len(self.author_keys), selected)
+        return {str(key): count for key, count in zip(self.author_keys[codes].tolist(), counts, strict=True)}
+    
+    def channel_counts(self, selected: BoolArray) -> dict[str, int]:
+        """Messages per channel ID, in order of each channel's first message"""
+        codes, counts = self._code_counts(self.channel_codes, len(self.channel_keys), selected)
+        return {str(key): count for key, count in zip(self.channel_keys[codes].tolist(), counts, strict=True)}
+    
+    def content_counts(self, selected: BoolArray) -> tuple[list[str], list[int]]:
+        """The distinct texts of the selected messages in order of first appearance, and how often each was sent"""
+        if not self.contents:
+            return [], []
+        content_ids, counts = self._code_counts(self.content_ids, len(self.contents), selected)
+        return [self.contents[i] for i in content_ids], counts
+    
+    def median_length(self, selected: BoolArray) -> float:
+        lengths = self.lengths[selected]
+        return float(np.median(lengths)) if len(lengths) else 0.0
+    
+    def average_words(self, selected: BoolArray) -> float:
+        word_counts = self.word_counts[selected]
+        return float(word_counts.mean()) if len(word_counts) else 0.0
+    
+    def latest(self, selected: BoolArray) -> float | None:
+        timestamps = self.timestamps[selected]
+        return float(timestamps.max()) if len(timestamps) else None
+    
+    def timing(self, selected: BoolArray) -> FrameTiming | None:
+        """
+        The longest gap between consecutive messages, the average gap and the message rate.
+        None if fewer than two messages are selected.
+        """
+        timestamps = np.sort(self.timestamps[selected])
+        if len(timestamps) < 2:
+            return None
+        
+        gaps = np.diff(timestamps)
+        longest = int(np.argmax(gaps))
+        span: float = float(timestamps[-1] - timestamps[0])
+        return FrameTiming(
+                longest_gap=float(gaps[longest]),
+                gap_start=float(timestamps[longest]),
+                gap_end=float(timestamps[longest + 1]),
+                average_gap=span / (len(timestamps) - 1),
+                messages_per_day=len(timestamps) / (span / DAY_SECONDS) if span > 0 else 0.0,
+        )
+
+
+def summarise(frame: MessageFrame, with_word_stats: bool = True) -> FrameSummary:
+    """
+    Every statistic the message analysis commands show, over all rows of a frame.
+    A pure function of the frame, so it can run in an analysis worker process.
+    The word statistics are left out if the caller gets them from the word index.
+    """
+    everything: BoolArray = np.ones(len(frame), dtype=np.bool_)
+    return FrameSummary(
+            total=len(frame),
+            word_stats=analyse_weighted_word_stats(*frame.content_counts(everything)) if with_word_stats else None,
+            author_counts=frame.author_counts(everything),
+            channel_counts=frame.channel_counts(everything),
+            median_length=frame.median_length(everything),
+            average_words=frame.average_words(everything),
+            timing=frame.timing(everything),
+            latest=frame.latest(everything),
+    )
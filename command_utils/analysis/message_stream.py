@@ -0,0 +1,136 @@
+"""
+Message statistics computed in one pass over messages in timestamp order, e.g. a sorted database cursor,
+in memory that grows with the number of users and channels instead of the number of messages.
+Free of Discord and database imports, like message_frame.
+"""
+import collections
+import logging
+from collections.abc import Iterable, Mapping
+from typing import Any
+
+from command_utils.analysis.message_frame import DAY_SECONDS, FrameSummary, FrameTiming
+from command_utils.analysis.sketches import WordSketch
+from command_utils.analysis.word_stats import WordStatsCounter
+
+logger = logging.getLogger("discord")
+
+
+class LengthHistogram:
+    """
+    Exact quantiles of non-negative integers with a small range, like message lengths.
+    Memory grows with the number of distinct values, which Discord's message length limit keeps in the thousands.
+    """
+    
+    def __init__(self):
+        self.counts: collections.Counter[int] = collections.Counter()
+        self.total: int = 0
+    
+    def add(self, value: int) -> None:
+        self.counts[value] += 1
+        self.total += 1
+    
+    def _value_at(self, rank: int) -> int:
+        """The value at a position in sorted order"""
+        seen: int = 0
+        for value in sorted(self.counts):
+            seen += self.counts[value]
+            if seen > rank:
+                return value
+        raise IndexError(rank)
+    
+    def quantile(self, q: float) -> float:
+        """The q quantile, interpolated between the two nearest values like numpy.quantile. 0 if nothing was added"""
+        if not self.total:
+            return 0.0
+        
+        position: float = q * (self.total - 1)
+        rank = int(position)
+        lower = self._value_at(rank)
+        upper = self._value_at(min(rank + 1, self.total - 1))
+        return lower + (upper - lower) * (position - rank)
+
+
+class MessageStream:
+    """
+    The statistics of message_frame.summarise, accumulated one message at a time.
+    
+    Messages should be added in timestamp order, the longest gap is only measured between consecutive messages.
+    Messages arriving out of order still count towards everything else and are counted in ``unordered``.
+    The word statistics are exact with a WordStatsCounter, whose memory grows with the vocabulary,
+    bounded with a WordSketch, or left out with neither.
+    """
+    
+    def __init__(self, words: WordStatsCounter | WordSketch | None = None):
+        self.words: WordStatsCounter | WordSketch | None = words
+        self.total: int = 0
+        self.unordered: int = 0
+        self.author_counts: dict[str, int] = {}
+        self.channel_counts: dict[str, int] = {}
+        self.lengths: LengthHistogram = LengthHistogram()
+        self.word_sum: int = 0
+        self.first: float | None = None
+        self.last: float | None = None
+        self.longest_gap: float = -1.0
+        self.gap_start: float = 0.0
+        self.gap_end: float = 0.0
+    
+    def add(self, message: Mapping[str, Any]) -> None:
+        """Count a message document, leaving out those with malformed fields like MessageFrame.from_messages does"""
+        content = message["content"]
+        try:
+            author_id, channel_id, timestamp = int(message["author_id"]), int(message["channel_id"]), float(message["timestamp"])
+        except (TypeError, ValueError):
+            logger.debug(f"Leaving message with malformed fields out of the message stream: {message.get("_id")}")
+            return
+        if not isinstance(content, str):
+            return
+        
+        self.total += 1
+        self.author_counts[str(author_id)] = self.author_counts.get(str(author_id), 0) + 1
+        self.channel_counts[str(channel_id)] = self.channel_counts.get(str(channel_id), 0) + 1
+        self.lengths.add(len(content))
+        self.word_sum += len(content.split())
+        if self.words is not None:
+            self.words.add_text(content)
+        
+        if self.first is None or self.last is None:
+            self.first = self.last = timestamp
+        elif timestamp < self.last:
+            self.unordered += 1
+            self.first = min(self.first, timestamp)
+        else:
+            # Strictly longer, so the first of equally long gaps is kept like numpy.argmax
+            if timestamp - self.last > self.longest_gap:
+                self.longest_gap, self.gap_start, self.gap_end = timestamp - self.last, self.last, timestamp
+            self.last = timestamp
+    
+    def add_all(self, messages: Iterable[Mapping[str, Any]]) -> None:
+        for message in messages:
+            self.add(message)
+    
+    def timing(self) -> FrameTiming | None:
+        """The same timing as MessageFrame.timing, None if fewer than two messages were added"""
+        if self.total < 2 or self.first is None or self.last is None:
+            return None
+        
+        span: float = self.last - self.first
+        return FrameTiming(
+                longest_gap=max(self.longest_gap, 0.0),
+                gap_start=self.gap_start,
+                gap_end=self.gap_end,
+                average_gap=span / (self.total - 1),
+                messages_per_day=self.total / (span / DAY_SECONDS) if span > 0 else 0.0,
+        )
+    
+    def summary(self) -> FrameSummary:
+        """Every statistic of the messages added so far, as summarise gives for a frame of them"""
+        return FrameSummary(
+                total=self.total,
+                word_stats=self.words.stats() if self.words is not None else None,
+                author_counts=self.author_counts,
+                channel_counts=self.channel_counts,
+                median_length=self.lengths.quantile(0.5),
+                average_words=self.word_sum / self.total if self.total else 0.0,
+                timing=self.timing(),
+                latest=self.last,
+        )
@@ -0,0 +1,118 @@
+"""
+Caches analysis results until the data they were computed from changes
+"""
+import asyncio
+import collections
+from collections.abc import Awaitable, Callable, Hashable, Mapping
+from typing import Any, TypedDict
+
+import cachetools
+
+
+class CacheStats(TypedDict):
+    hits: int
+    misses: int
+    hit_rate: float  # Between 0 and 1, 0 before the first lookup
+
+
+_MISSING: Any = object()
+
+
+class ResultCache:
+    """
+    An LRU cache with a time to live for the results of the analysis functions.
+    
+    Results are keyed by the function, its arguments, and two version counters: the data version, increased on every
+    message, edit, delete and voice session write, and the membership version, increased when members join or leave.
+    A write therefore makes every earlier key unreachable at once, without tracking which results it affects;
+    those entries age out through the LRU and TTL. The TTL also bounds how stale results relative to the current
+    time, like the last hour filter, can get.
+    
+    Concurrent calls with the same key share one computation. Only mapping results are cached, error messages are
+    cheap to recreate and some, like a timeout, are transient. Cached results are shared between callers and must not
+    be modified.
+    """
+    
+    def __init__(self, maxsize: int = 64, ttl: float = 300.0):
+        self.maxsize: int = maxsize
+        self.ttl: float = ttl
+        self.data_version: int = 0
+        self.membership_version: int = 0
+        self.hits: collections.Counter[str] = collections.Counter()
+        self.misses: collections.Counter[str] = collections.Counter()
+        self._results: cachetools.TTLCache[tuple[Hashable, ...], Any] = cachetools.TTLCache(maxsize=max(1, maxsize), ttl=ttl)
+        self._pending: dict[tuple[Hashable, ...], asyncio.Event] = {}
+    
+    def __len__(self) -> int:
+        return len(self._results)
+    
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl > 0
+    
+    def configure(self, maxsize: int, ttl: float) -> None:
+        """Apply new limits, dropping every cached result"""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._results = cachetools.TTLCache(maxsize=max(1, maxsize), ttl=ttl)
+    
+    def data_changed(self) -> None:
+        self.data_version += 1
+    
+    def membership_changed(self) -> None:
+        self.membership_version += 1
+    
+    def clear(self) -> None:
+        self._results.clear()
+    
+    async def get_or_compute[R](self, name: str, args: tuple[Hashable, ...], compute: Callable[[], Awaitable[R]]) -> R:
+        """
+        Get a cached result, or compute and cache it.
+        
+        Args:
+            name: The analysis function, results are counted per function in the stats
+            args: Everything besides the versions that the result depends on
+            compute: Computes the result on a miss
+        
+        Returns:
+            The cached or newly computed result
+        """
+        if not self.enabled:
+            self.misses[name] += 1
+            return await compute()
+        
+        while True:
+            key = (name, self.data_version, self.membership_version, *args)
+            cached = self._results.get(key, _MISSING)
+            if cached is not _MISSING:
+                self.hits[name] += 1
+                return cached
+            
+            pending = self._pending.get(key)
+            if pending is None:
+                break
+            # Another command is computing the same result. If it isn't cached afterwards, this call computes it itself
+            await pending.wait()
+        
+        self.misses[name] += 1
+        done = asyncio.Event()
+        self._pending[key] = done
+        try:
+            result = await compute()
+            if isinstance(result, Mapping):
+                self._results[key] = result
+            return result
+        finally:
+            del self._pending[key]
+            done.set()
+    
+    def stats(self) -> dict[str, CacheStats]:
+        """Hits and misses per function since the bot started"""
+        stats: dict[str, CacheStats] = {}
+        for name in sorted(self.hits.keys() | self.misses.keys()):
+            hits, misses = self.hits[name], self.misses[name]
+            stats[name] = CacheStats(hits=hits, misses=misses, hit_rate=hits / (hits + misses) if hits + misses else 0.0)
+        return stats
+
+
+result_cache: ResultCache = ResultCache()
@@ -0,0 +1,227 @@
+"""
+Bounded memory sketches of the word statistics of every message, for the all time analysis.
+Kept free of Discord and database imports, like word_stats.
+
+Error bounds, with N the number of valid words counted:
+- Top words, Space-Saving with ``capacity`` counters: every word used more than N / capacity times is tracked.
+  A reported count is never below the true count, and at most its recorded error above it. Errors are at most N / capacity.
+- Unique words, HyperLogLog with 2^precision registers: relative standard error 1.04 / sqrt(2^precision),
+  0.81% at the default precision of 14.
+- Average word length, the mean over a uniform sample of ``sample_size`` distinct words:
+  standard error of the sample standard deviation / sqrt(sample_size).
+- Vocabulary diversity: the unique word estimate over the exact word total, so it has the unique word error.
+"""
+import collections
+import hashlib
+import heapq
+import math
+from collections.abc import Mapping
+from typing import Any, Final, Self, TypedDict
+
+from command_utils.analysis.word_stats import WordStats, is_valid_word, split_words
+
+DEFAULT_CAPACITY: Final[int] = 1024
+DEFAULT_PRECISION: Final[int] = 14
+DEFAULT_SAMPLE_SIZE: Final[int] = 1024
+
+
+class SketchErrorBounds(TypedDict):
+    top_words_error: int  # Largest amount a shown top word count may be too high by
+    unique_words_error: float  # Relative standard error of the unique word count
+    average_length_error: float  # Standard error of the average word length, in characters
+
+
+def word_hash(word: str) -> int:
+    """A 64 bit hash that is stable between processes, unlike hash(), so sketches can be persisted"""
+    return int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "big")
+
+
+class SpaceSaving:
+    """
+    Space-Saving top-k counter.
+    
+    Tracks at most ``capacity`` words. A new word replaces the word with the lowest count and inherits
+    that count as its error, so counts are overestimates by at most their error.
+    """
+    
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity: int = capacity
+        self.total: int = 0
+        self.counts: dict[str, int] = {}
+        self.errors: dict[str, int] = {}
+        # One entry per tracked word, its count may be behind. Refreshed when it reaches the top of the heap
+        self._heap: list[tuple[int, str]] = []
+    
+    def _pop_min(self) -> tuple[str, int]:
+        while True:
+            count, word = heapq.heappop(self._heap)
+            current = self.counts[word]
+            if current == count:
+                return word, count
+            heapq.heappush(self._heap, (current, word))
+    
+    def offer(self, word: str, count: int = 1) -> None:
+        self.total += count
+        if word in self.counts:
+            self.counts[word] += count
+            return
+        
+        error: int = 0
+        if len(self.counts) >= self.capacity:
+            evicted, error = self._pop_min()
+            del self.counts[evicted]
+            del self.errors[evicted]
+        
+        self.counts[word] = error + count
+        self.errors[word] = error
+        heapq.heappush(self._heap, (error + count, word))
+    
+    def restore(self, word: str, count: int, error: int) -> None:
+        """Track a word with a count and error saved earlier"""
+        self.counts[word] = count
+        self.errors[word] = error
+        heapq.heappush(self._heap, (count, word))
+    
+    def top(self, k: int) -> list[tuple[str, int]]:
+        """The k words with the highest counts, ties in the order they were first tracked"""
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+class HyperLogLog:
+    """HyperLogLog distinct counter over 64 bit hashes"""
+    
+    def __init__(self, precision: int = DEFAULT_PRECISION, registers: bytes | None = None):
+        self.precision: int = precision
+        self.registers: bytearray = bytearray(registers) if registers is not None else bytearray(1 << precision)
+    
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(len(self.registers))
+    
+    def add_hash(self, value: int) -> None:
+        width = 64 - self.precision
+        index = value >> width
+        rank = width - (value & ((1 << width) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+    
+    def estimate(self) -> float:
+        m = len(self.registers)
+        harmonic = sum(count * 2.0 ** -rank for rank, count in collections.Counter(self.registers).items())
+        raw = 0.7213 / (1 + 1.079 / m) * m * m / harmonic
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is more accurate while many registers are still empty
+            return m * math.log(m / zeros)
+        return raw
+
+
+class DistinctSample:
+    """
+    The ``size`` distinct words with the lowest hashes. As the hashes are uniform, this is a uniform
+    sample of the distinct words, however often each was used.
+    """
+    
+    def __init__(self, size: int = DEFAULT_SAMPLE_SIZE):
+        self.size: int = size
+        self._heap: list[tuple[int, str]] = []  # Negated hashes, so the largest sampled hash is on top
+        self._hashes: set[int] = set()
+    
+    def add(self, value: int, word: str) -> None:
+        if value in self._hashes:
+            return
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, (-value, word))
+            self._hashes.add(value)
+        elif value < -self._heap[0][0]:
+            removed, _ = heapq.heapreplace(self._heap, (-value, word))
+            self._hashes.discard(-removed)
+            self._hashes.add(value)
+    
+    def words(self) -> list[str]:
+        return [word for _, word in self._heap]
+
+
+class WordSketch:
+    """
+    Word statistics of a stream of messages in bounded memory.
+    Only the message and word totals are exact, see the module docstring for the error bounds of the rest.
+    """
+    
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, precision: int = DEFAULT_PRECISION, sample_size: int = DEFAULT_SAMPLE_SIZE):
+        self.messages: int = 0
+        self.total_words: int = 0
+        self.top_words: SpaceSaving = SpaceSaving(capacity)
+        self.unique_words: HyperLogLog = HyperLogLog(precision)
+        self.word_sample: DistinctSample = DistinctSample(sample_size)
+    
+    def add_text(self, content: str) -> None:
+        words = split_words(content)
+        self.messages += 1
+        self.total_words += len(words)
+        for word in words:
+            value = word_hash(word)
+            self.unique_words.add_hash(value)
+            self.word_sample.add(value, word)
+            if is_valid_word(word):
+                self.top_words.offer(word)
+    
+    def stats(self) -> WordStats | None:
+        """Estimated word statistics, in the same form as analyse_word_stats"""
+        top_3 = self.top_words.top(3)
+        sample = self.word_sample.words()
+        if not self.total_words or not top_3 or not sample:
+            return None
+        
+        # The estimate can't be below the number of distinct words actually sampled
+        unique = max(round(self.unique_words.estimate()), len(sample))
+        most_common_word, most_common_count = top_3[0]
+        return WordStats(
+                most_common_word=most_common_word,
+                most_common_word_count=most_common_count,
+                top_3_words=top_3,
+                total_unique_words=unique,
+                average_length=sum(len(word) for word in sample) / len(sample),
+                vocabulary_diversity=(unique / self.total_words) * 100,
+        )
+    
+    def error_bounds(self) -> SketchErrorBounds:
+        lengths = [len(word) for word in self.word_sample.words()]
+        length_error: float = 0.0
+        if len(lengths) > 1:
+            mean = sum(lengths) / len(lengths)
+            variance = sum((length - mean) ** 2 for length in lengths) / (len(lengths) - 1)
+            length_error = math.sqrt(variance / len(lengths))
+        
+        return SketchErrorBounds(
+                top_words_error=max((self.top_words.errors[word] for word, _ in self.top_words.top(3)), default=0),
+                unique_words_error=self.unique_words.relative_error,
+                average_length_error=length_error,
+        )
+    
+    def to_document(self) -> dict[str, Any]:
+        """The sketch as a MongoDB document. Words are stored as values, they may contain characters not allowed in keys"""
+        return {
+            "messages":    self.messages,
+            "total_words": self.total_words,
+            "capacity":    self.top_words.capacity,
+            "top_total":   self.top_words.total,
+            "top_words":   [[word, count, self.top_words.errors[word]] for word, count in self.top_words.counts.items()],
+            "precision":   self.unique_words.precision,
+            "registers":   bytes(self.unique_words.registers),
+            "sample_size": self.word_sample.size,
+            "sample":      self.word_sample.words(),
+        }
+    
+    @classmethod
+    def from_document(cls, doc: Mapping[str, Any]) -> Self:
+        sketch = cls(doc["capacity"], doc["precision"], doc["sample_size"])
+        sketch.messages = doc["messages"]
+        sketch.total_words = doc["total_words"]
+        sketch.top_words.total = doc["top_total"]
+        for word, count, error in doc["top_words"]:
+            sketch.top_words.restore(word, count, error)
+        sketch.unique_words = HyperLogLog(doc["precision"], doc["registers"])
+        for word in doc["sample"]:
+            sketch.word_sample.add(word_hash(word), word)
+        return sketch
@@ -1,21 +1,28 @@
-import collections
+import asyncio
 import copy
 import datetime
+import io
 import logging
-import statistics
 import string
-import tempfile
-from collections.abc import Mapping
-from pathlib import Path
+import time
+from collections.abc import AsyncIterable, AsyncIterator, Mapping
 from typing import Any, Final, Literal, NotRequired, TypedDict
 
 import discord
 from discord import DMChannel
-from matplotlib import pyplot as plt
 
-from command_utils.analysis.ana_utils import try_resolve_channel_id, user_id_to_display_name
+from command_utils.analysis import aggregation
+from command_utils.analysis.ana_utils import try_resolve_channel_id, user_ids_to_display_names
+from command_utils.analysis.charts import BarChart, chart_renderer
+from command_utils.analysis.executor import AnalysisTimeoutError, analysis_executor
+from command_utils.analysis.message_frame import BoolArray, FrameSummary, FrameTiming, MessageFrame, summarise
+from command_utils.analysis.message_stream import MessageStream
+from command_utils.analysis.result_cache import result_cache
+from command_utils.analysis.sketches import SketchErrorBounds, WordSketch
+from command_utils.analysis.word_stats import EXCLUDED_WORDS, WordStats, WordStatsCounter
 from command_utils.CContext import CContext
-from utils import db_stuff
+from utils import db_stuff, discord_utils, message_rollups
+from utils.word_index import WordCounts
 
 logger = logging.getLogger("discord")
 
@@ -42,15 +49,6 @@ class DatetimeDBMessage(DBMessageBase):
     timestamp: datetime.datetime
 
 
-class WordStats(TypedDict):
-    most_common_word: str
-    most_common_word_count: int
-    top_3_words: list[tuple[str, int]]
-    total_unique_words: int
-    average_length: float
-    vocabulary_diversity: float
-
-
 class ChannelMessageStats(TypedDict):
     channel_id: str
     num_messages: int
@@ -81,6 +79,7 @@ class MessageAnalysisResult(TypedDict):
     messages_per_day: float
     average_words_per_message: float
     average_time_between_messages: str
+    word_stats_error: NotRequired[SketchErrorBounds]  # Set when the word statistics were estimated from the word sketch
 
 
 class UserMessageAnalysisResult(TypedDict):
@@ -109,24 +108,17 @@ TIME_FILTERS: Final[dict[str, tuple[str, datetime.timedelta]]] = {
     "d": ("day", datetime.timedelta(days=1)),
     "h": ("hour", datetime.timedelta(hours=1)),
 }
-ARTICLES: Final[list[str]] = ["the", "a", "an", "this", "that", "these", "those"]
-PRONOUNS: Final[list[str]] = ["i", "you", "we", "they", "he", "she", "it", "me", "my", "your", "our", "their"]
-AUX_VERBS: Final[list[str]] = ["is", "am", "are", "was", "were", "be", "been", "being", "do", "does", "did", "have", "has", "had"]
-PREPOSITIONS: Final[list[str]] = ["to", "of", "in", "on", "at", "for", "from", "with", "by", "about", "as", "into", "over", "under"]
-CONJUNCTIONS: Final[list[str]] = ["and", "or", "but", "so", "if", "because", "while"]
-NOT_MEANINGFUL: Final[list[str]] = ["yeah", "yes", "no", "ok", "okay", "lol", "lmao", "haha", "uh", "um", "hmm"]
-EXCLUDED_WORDS: Final[set[str]] = set(ARTICLES + PRONOUNS + AUX_VERBS + PREPOSITIONS + CONJUNCTIONS + NOT_MEANINGFUL)
-PUNCT_SET: Final[set[str]] = set(string.punctuation)
-
+# Time filters whose window is long enough to be counted from the daily rollups
+ROLLUP_FILTERS: Final[set[str | None]] = {None, "w", "il"}
+# Time filters whose word statistics can be estimated from the all time word sketch. "exact" forces the exact path
+SKETCH_FILTERS: Final[set[str | None]] = {None, "il"}
+# Fields to fetch when streaming messages, the edit history isn't used for analysis
+MESSAGE_PROJECTION: Final[dict[str, int]] = dict.fromkeys(aggregation.REQUIRED_MESSAGE_KEYS, 1)
+# Messages fetched per cursor round trip and counted per thread hand-off by the streaming backend
+STREAM_BATCH_SIZE: Final[int] = 2000
+TIMEOUT_MESSAGE: Final[str] = "The analysis took too long and was cancelled, please try again later."
 
-def is_valid_word(word: str):
-    return (
-            len(word) > 2
-            and not word.startswith("https://")
-            and not (word.startswith("<@") and word.endswith(">"))
-            and not all(c in PUNCT_SET for c in word)
-            and word not in EXCLUDED_WORDS
-    )
+_message_frame: MessageFrame | None = None
 
 
 def check_required_message_keys(message: Mapping[str, Any]) -> bool:
@@ -164,137 +156,473 @@ def to_dbm(message: Mapping[Any, Any] | DBMessage) -> DBMessage:
     )
 
 
+def format_gap(seconds: float) -> str:
+    """
+    Format a gap between messages as e.g. "2d 3h 15m", or "<1m" for gaps shorter than a minute.
+    """
+    gap_td: datetime.timedelta = datetime.timedelta(seconds=seconds)
+    hours, remainder = divmod(gap_td.seconds, 3600)
+    minutes: int = remainder // 60
+    parts: list[str] = []
+    if gap_td.days:
+        parts.append(f"{gap_td.days}d")
+    if hours:
+        parts.append(f"{hours}h")
+    if minutes:
+        parts.append(f"{minutes}m")
+    return " ".join(parts) if parts else "<1m"
+
+
+def time_filter_since(flag: str | None) -> float | None:
+    """
+    Convert a time filter flag into the UNIX timestamp messages must be sent at or after, or None for no filter.
+    """
+    if flag not in TIME_FILTERS:
+        return None
+    _, time_delta = TIME_FILTERS[flag]
+    return (discord.utils.utcnow() - time_delta).timestamp()
+
+
+def _validate_message(message: Mapping[str, Any] | DBMessage, invalid_ids: list[Any]) -> DBMessage | None:
+    if check_required_message_keys(message):
+        return to_dbm(message)
+    
+    logger.warning(f"Removing invalid message with ID {message.get("_id", "unknown")}")
+    if "_id" in message:
+        invalid_ids.append(message["_id"])
+    return None
+
+
 async def remove_invalid_messages(messages: list[Mapping[str, Any] | dict[str, Any] | DBMessage] | None) -> list[DBMessage]:
+    """
+    Filter out messages missing required keys. The invalid ones are quarantined in the background,
+    in a single batch, so analysis doesn't wait on a delete per message.
+    """
     valid_messages: list[DBMessage] = []
     if messages is None:
         return valid_messages
     
+    invalid_ids: list[Any] = []
     for message in messages:
-        if check_required_message_keys(message):
-            valid_messages.append(to_dbm(message))
-        
-        else:
-            logger.warning(f"Removing invalid message with ID {message.get("_id", "unknown")}")
-            await db_stuff.delete_message(message["_id"])
+        valid_message = _validate_message(message, invalid_ids)
+        if valid_message is not None:
+            valid_messages.append(valid_message)
     
+    db_stuff.quarantine_in_background("messages", invalid_ids)
     return valid_messages
 
 
-async def get_valid_messages(flag: str | None = None, ctx: CContext | None = None) -> tuple[list[DBMessage], int]:
+async def stream_valid_messages(messages: AsyncIterable[Mapping[str, Any]]) -> AsyncIterator[DBMessage]:
+    """
+    Streaming version of remove_invalid_messages, for use with db_stuff.stream_from_db.
+    The documents must be fetched with at least MESSAGE_PROJECTION, or they will be treated as invalid.
+    Invalid messages are quarantined together once the stream ends.
     """
-    Download and validate messages from the database.
+    invalid_ids: list[Any] = []
+    try:
+        async for message in messages:
+            valid_message = _validate_message(message, invalid_ids)
+            if valid_message is not None:
+                yield valid_message
+    finally:
+        db_stuff.quarantine_in_background("messages", invalid_ids)
 
-    Args:
-        flag: Optional time filter - "w" for last week, "d" for last day,
-                    "h" for last hour, or None for all messages
-        ctx: Discord command context, used to get the guild for user validation
 
+def _aggregated_timing(totals: aggregation.AggregatedTotals, gap: aggregation.AggregatedGap | None) -> tuple[str, str, str, str, float]:
+    """
+    Format the silence and rate statistics of an aggregation result.
+    
     Returns:
-        Tuple containing a list of valid messages and the total message count
+        Tuple of longest silence, its start and end, average time between messages and messages per day
     """
-    # Download all messages from database
-    messages: list[DBMessage] | None = await db_stuff.cached_download_all()  # type: ignore
-    if messages is None:
-        return [], 0
-    total_messages: int = len(messages)
-    guild: discord.Guild | None = None
-    if ctx is not None:
-        guild = ctx.bot.get_guild(ctx.bot.config.guild_id)
+    if totals["count"] < 2 or gap is None:
+        return "N/A", "N/A", "N/A", "N/A", 0.0
     
-    if not messages:
-        logger.warning("No messages found or failed to connect to the database.")
-        return [], 0
+    span: float = totals["last"] - totals["first"]
+    messages_per_day: float = totals["count"] / (span / 86400) if span > 0 else 0.0
+    return (
+        format_gap(gap["gap"]),
+        f"<t:{int(gap["start"])}>",
+        f"<t:{int(gap["end"])}>",
+        format_gap(span / (totals["count"] - 1)),
+        messages_per_day,
+    )
+
+
+def _frame_timing(timing: FrameTiming | None) -> tuple[str, str, str, str, float]:
+    """
+    Format the silence and rate statistics of a message frame selection.
     
-    all_messages: list[DBMessage] = [msg for msg in messages if msg["author_id"] not in EXCLUDED_USER_IDS]
+    Returns:
+        Tuple of longest silence, its start and end, average time between messages and messages per day
+    """
+    if timing is None:
+        return "N/A", "N/A", "N/A", "N/A", 0.0
     
-    valid_messages: list[DBMessage] = await remove_invalid_messages(all_messages) # type: ignore[arg-type]
+    return (
+        format_gap(timing["longest_gap"]),
+        f"<t:{int(timing["gap_start"])}>",
+        f"<t:{int(timing["gap_end"])}>",
+        format_gap(timing["average_gap"]),
+        timing["messages_per_day"],
+    )
+
+
+def _summary_result(summary: FrameSummary,
+                    total_messages: int,
+                    word_stats: WordStats | None,
+                    word_stats_error: SketchErrorBounds | None = None,
+                    ) -> MessageAnalysisResult | str:
+    """
+    Turn the statistics of the selected messages into the analysis result.
     
-    if flag in TIME_FILTERS:
-        filter_name, time_delta = TIME_FILTERS[flag]
-        time_ago = discord.utils.utcnow() - time_delta
-        
-        # I can"t decide if I hate that you can do this purely with list comprehensions or not
-        valid_messages = [
-            msg for msg in valid_messages
-            if datetime.datetime.fromtimestamp(msg["timestamp"], datetime.UTC) >= time_ago
-        ]
-        logger.info(f"Applied {filter_name} filter: {len(valid_messages)} messages")
+    Args:
+        summary: The statistics, from a message frame or stream
+        total_messages: Number of messages in the database, valid or not
+        word_stats: The word statistics, which may come from the word sketch instead of the summary
+        word_stats_error: The error bounds of estimated word statistics
     
-    if flag != "il" and guild is not None:
-        # don"t include messages from users no longer in the guild
-        valid_messages = [msg for msg in valid_messages if guild.get_member(int(msg["author_id"]))]
+    Returns:
+        Dictionary containing analysis results or error message
+    """
+    if not word_stats:
+        return "No valid content to analyse."
+    
+    user_message_count = summary["author_counts"]
+    longest_silence, silence_start, silence_end, average_between, messages_per_day = _frame_timing(summary["timing"])
     
-    logger.info(f"Total valid messages: {len(valid_messages)}")
-    logger.info(f"Total messages in database: {total_messages}")
-    return valid_messages, total_messages
+    result = MessageAnalysisResult(
+            total_messages=total_messages,
+            total_valid_messages=summary["total"],
+            most_common_word=word_stats["most_common_word"],
+            most_common_word_count=word_stats["most_common_word_count"],
+            top_3_words=word_stats["top_3_words"],
+            total_unique_words=word_stats["total_unique_words"],
+            average_length=word_stats["average_length"],
+            vocabulary_diversity=word_stats["vocabulary_diversity"],
+            active_users_lb=[UserMessageStats(user_id=user_id, num_messages=count) for user_id, count in user_message_count.items()],
+            active_channels_lb=[ChannelMessageStats(channel_id=channel_id, num_messages=count)
+                                for channel_id, count in summary["channel_counts"].items()],
+            total_users=len(user_message_count),
+            median_message_length=summary["median_length"],
+            longest_silence=longest_silence,
+            longest_silence_start=silence_start,
+            longest_silence_end=silence_end,
+            messages_per_day=messages_per_day,
+            average_words_per_message=summary["average_words"],
+            average_time_between_messages=average_between,
+    )
+    if word_stats_error is not None:
+        result["word_stats_error"] = word_stats_error
+    return result
 
 
-def analyse_word_stats(content_list: list[str]) -> WordStats | None:
+def indexed_word_counts(frame: MessageFrame, by_user: BoolArray, author_id: str, since: float | None) -> WordCounts | None:
     """
-    Analyse word statistics from a list of message content.
-
+    The word counts of a user from the message store's word index.
+    If the window starts part way through a day, that day is counted from the frame instead.
+    
     Args:
-        content_list: List of message content strings
-
+        frame: The message frame
+        by_user: The user's messages in the window
+        author_id: The user's ID
+        since: Start of the window as a UNIX timestamp, or None for all messages
+    
     Returns:
-        Dictionary containing word statistics
+        The counts, or None if the message store isn't loaded
     """
-    if not content_list:
+    if not db_stuff.message_store.loaded:
         return None
     
-    # Extract and normalise all words
-    all_words = [word.lower().strip() for msg in content_list for word in msg.split() if word]
-    if not all_words:
+    word_index = db_stuff.message_store.word_index
+    if since is None:
+        return word_index.user_counts(author_id)
+    
+    first_full_day: int = message_rollups.day_start(since) + message_rollups.DAY_SECONDS
+    counts = WordCounts()
+    for content, count in zip(*frame.content_counts(by_user & (frame.timestamps < first_full_day)), strict=True):
+        counts.add_text(content, count)
+    counts.merge(word_index.user_counts(author_id, first_full_day))
+    return counts
+
+
+async def get_message_frame() -> MessageFrame | None:
+    """
+    Get the message store as a MessageFrame. The frame is rebuilt when the store has changed, but at most
+    once per store refresh interval, since every logged message changes the store.
+    
+    Returns:
+        The frame, or None if the messages could not be loaded
+    """
+    global _message_frame
+    messages = await db_stuff.cached_download_all()
+    if messages is None:
+        logger.warning("No messages found or failed to connect to the database.")
         return None
     
-    interesting_words = [word for word in all_words if is_valid_word(word)]
+    version: int = db_stuff.message_store.version
+    if _message_frame is None or (
+            _message_frame.version != version
+            and time.monotonic() - _message_frame.built_at >= db_stuff.message_store.refresh_interval
+    ):
+        # Built in a thread so the event loop keeps running while a large history is converted
+        frame, invalid_ids = await asyncio.to_thread(
+                MessageFrame.from_messages, messages, aggregation.REQUIRED_MESSAGE_KEYS, version,
+        )
+        logger.info(f"Built message frame of {len(frame)} messages")
+        db_stuff.quarantine_in_background("messages", invalid_ids)
+        _message_frame = frame
+    return _message_frame
+
+
+async def rollup_message_stats(since: float | None, author_ids: list[str] | None = None) -> aggregation.AggregatedMessageStats | None:
+    """
+    Count messages per user and channel from the daily rollups.
+    If the window starts part way through a day, that day is counted from the raw messages instead.
     
-    # Calculate statistics
-    word_count = collections.Counter(interesting_words)
-    top_3 = word_count.most_common(3)
-    most_common_word, most_common_count = top_3[0]
-    unique_words = set(all_words)
+    Args:
+        since: Only count messages sent at or after this UNIX timestamp, or None for all messages
+        author_ids: Only count messages from these authors
     
-    # Calculate average word length
-    avg_length = sum(len(word) for word in unique_words) / len(unique_words) if unique_words else 0
+    Returns:
+        The counts, or None if the aggregation could not be run
+    """
+    if since is None:
+        return await aggregation.aggregate_rollup_stats(aggregation.build_rollup_match(EXCLUDED_USER_IDS, author_ids=author_ids))
+    
+    first_full_day: int = message_rollups.day_start(since) + message_rollups.DAY_SECONDS
+    partial_match = aggregation.build_message_match(EXCLUDED_USER_IDS, since, author_ids, until=first_full_day)
+    rollup_stats, partial_stats = await asyncio.gather(
+            aggregation.aggregate_rollup_stats(aggregation.build_rollup_match(EXCLUDED_USER_IDS, first_full_day, author_ids)),
+            aggregation.aggregate_message_stats(partial_match),
+    )
+    if rollup_stats is None or partial_stats is None:
+        return None
+    return aggregation.merge_message_stats(rollup_stats, partial_stats)
+
+
+async def _rollup_analysis_stats(
+        since: float | None, author_ids: list[str] | None, match: dict[str, Any],
+    ) -> aggregation.AggregatedMessageStats | None:
+    """
+    The message statistics with the counts and totals read from the rollups.
+    The median length and longest gap can't be summed up per day, so they still read the raw messages selected by ``match``.
+    """
+    stats, length_and_gap = await asyncio.gather(rollup_message_stats(since, author_ids), aggregation.aggregate_length_and_gap(match))
+    if stats is None or length_and_gap is None:
+        return None
+    stats["totals"]["median_length"], stats["longest_gap"] = length_and_gap
+    return stats
+
+
+async def aggregate_analyse_messages(ctx: CContext, time_filter: str | None = None) -> MessageAnalysisResult | str | None:
+    """
+    analyse all messages using the MongoDB aggregation backend.
     
-    # Calculate vocabulary diversity: unique words / total words * 100
-    vocabulary_diversity = (len(unique_words) / len(all_words)) * 100 if all_words else 0.0
+    Args:
+        ctx: Discord command context, used to get the guild for user validation
+        time_filter: Optional time filter - "w" for last week, "d" for last day,
+                    "h" for last hour, or None for all messages
+    
+    Returns:
+        Dictionary containing analysis results or error message, or None if the aggregation backend is unavailable
+    """
+    author_ids: list[str] | None = None
+    guild: discord.Guild | None = ctx.bot.get_guild(ctx.bot.config.guild_id)
+    if time_filter != "il" and guild is not None:
+        # don't include messages from users no longer in the guild
+        author_ids = [str(member.id) for member in guild.members]
+    
+    since = time_filter_since(time_filter)
+    match = aggregation.build_message_match(EXCLUDED_USER_IDS, since, author_ids)
+    use_rollups: bool = ctx.bot.config.analysis.rollups and time_filter in ROLLUP_FILTERS
+    stats, word_stats, total_messages = await asyncio.gather(
+            _rollup_analysis_stats(since, author_ids, match) if use_rollups else aggregation.aggregate_message_stats(match),
+            aggregation.aggregate_word_stats(match, EXCLUDED_WORDS),
+            db_stuff.estimated_count("messages"),
+    )
+    if stats is None and use_rollups:
+        logger.warning("Could not read message rollups, counting messages from the raw messages")
+        stats = await aggregation.aggregate_message_stats(match)
+    if stats is None or word_stats is None:
+        return None
+    
+    totals = stats["totals"]
+    if totals["count"] == 0:
+        return "No valid messages found to analyse."
+    if not word_stats["top"]:
+        return "No valid content to analyse."
     
-    return WordStats(
+    longest_silence, silence_start, silence_end, average_between, messages_per_day = _aggregated_timing(totals, stats["longest_gap"])
+    most_common_word, most_common_count = word_stats["top"][0]
+    return MessageAnalysisResult(
+            total_messages=total_messages if total_messages is not None else totals["count"],
+            total_valid_messages=totals["count"],
             most_common_word=most_common_word,
             most_common_word_count=most_common_count,
-            top_3_words=top_3,
-            total_unique_words=len(unique_words),
-            average_length=avg_length,
-            vocabulary_diversity=vocabulary_diversity,
+            top_3_words=word_stats["top"],
+            total_unique_words=word_stats["unique"],
+            average_length=word_stats["unique_length_sum"] / word_stats["unique"],
+            vocabulary_diversity=(word_stats["unique"] / word_stats["total"]) * 100,
+            active_users_lb=[UserMessageStats(user_id=user_id, num_messages=count) for user_id, count in stats["users"].items()],
+            active_channels_lb=[ChannelMessageStats(channel_id=channel_id, num_messages=count)
+                                for channel_id, count in stats["channels"].items()],
+            total_users=len(stats["users"]),
+            median_message_length=totals["median_length"],
+            longest_silence=longest_silence,
+            longest_silence_start=silence_start,
+            longest_silence_end=silence_end,
+            messages_per_day=messages_per_day,
+            average_words_per_message=totals["word_sum"] / totals["count"],
+            average_time_between_messages=average_between,
     )
 
 
-def get_channel_stats(messages: list[DBMessage]) -> list[ChannelMessageStats]:
+async def stream_analyse_messages(ctx: CContext, time_filter: str | None = None) -> MessageAnalysisResult | str | None:
     """
-    Get statistics about channel activity.
-
+    analyse all messages in a single pass over a database cursor, with the streaming backend.
+    Only counters per user and channel are kept, never the messages, so memory doesn't grow with the history.
+    The word statistics are exact, with memory growing with the vocabulary, unless word sketches are enabled.
+    
     Args:
-        messages: List of message dictionaries
+        ctx: Discord command context, used to get the guild for user validation
+        time_filter: Optional time filter - "w" for last week, "d" for last day,
+                    "h" for last hour, or None for all messages
+    
+    Returns:
+        Dictionary containing analysis results or error message, or None if the database can't be reached
+    """
+    total_messages = await db_stuff.estimated_count("messages")
+    if total_messages is None:
+        return None
+    
+    author_ids: list[str] | None = None
+    guild: discord.Guild | None = ctx.bot.get_guild(ctx.bot.config.guild_id)
+    if time_filter != "il" and guild is not None:
+        # don't include messages from users no longer in the guild
+        author_ids = [str(member.id) for member in guild.members]
+    
+    # Like the local backend, the persisted sketch is used for the filters it covers, a new one is built for the rest
+    word_sketches: bool = ctx.bot.config.analysis.word_sketches
+    sketch = db_stuff.word_sketch if word_sketches and time_filter in SKETCH_FILTERS else None
+    words: WordStatsCounter | WordSketch | None = None
+    if sketch is None:
+        words = WordSketch() if word_sketches else WordStatsCounter()
+    stream = MessageStream(words)
+    
+    match = aggregation.build_message_match(EXCLUDED_USER_IDS, time_filter_since(time_filter), author_ids)
+    cursor = db_stuff.stream_from_db("messages", match, MESSAGE_PROJECTION, sort_by="timestamp", batch_size=STREAM_BATCH_SIZE)
+    batch: list[DBMessage] = []
+    async for message in stream_valid_messages(cursor):
+        batch.append(message)
+        if len(batch) >= STREAM_BATCH_SIZE:
+            # Counted in a thread, splitting the words of a batch would hold up the event loop
+            await asyncio.to_thread(stream.add_all, batch)
+            batch = []
+    await asyncio.to_thread(stream.add_all, batch)
+    
+    if stream.unordered:
+        logger.warning(f"{stream.unordered} streamed messages were out of timestamp order, the longest silence may be off")
+    if stream.total == 0:
+        return "No valid messages found to analyse."
+    
+    summary = stream.summary()
+    if sketch is not None:
+        return _summary_result(summary, total_messages, sketch.stats(), sketch.error_bounds())
+    if isinstance(words, WordSketch):
+        return _summary_result(summary, total_messages, summary["word_stats"], words.error_bounds())
+    return _summary_result(summary, total_messages, summary["word_stats"])
+
 
+async def rollup_user_counts(since: float | None) -> dict[str, int] | None:
+    """
+    Count the messages of every author from the daily rollups.
+    If the window starts part way through a day, that day is counted from the raw messages instead.
+    
     Returns:
-        List of dictionaries containing channel statistics
+        A mapping of author ID to message count, or None if the aggregation could not be run
+    """
+    if since is None:
+        return await aggregation.aggregate_rollup_user_counts(aggregation.build_rollup_match(EXCLUDED_USER_IDS))
+    
+    first_full_day: int = message_rollups.day_start(since) + message_rollups.DAY_SECONDS
+    rollup_counts, partial_counts = await asyncio.gather(
+            aggregation.aggregate_rollup_user_counts(aggregation.build_rollup_match(EXCLUDED_USER_IDS, first_full_day)),
+            aggregation.aggregate_user_counts(aggregation.build_message_match(EXCLUDED_USER_IDS, since, until=first_full_day)),
+    )
+    if rollup_counts is None or partial_counts is None:
+        return None
+    return aggregation.merge_counts(rollup_counts, partial_counts)
+
+
+async def aggregate_analyse_user_messages(member: discord.User | discord.Member,
+                                          time_filter: str | None = None,
+                                          use_rollups: bool = False,
+                                          ) -> UserMessageAnalysisResult | str | None:
     """
-    if not messages:
-        return []
+    analyse messages from a specific user using the MongoDB aggregation backend.
+    
+    Args:
+        member: Discord user to analyse
+        time_filter: Optional time filter - "w" for last week, "d" for last day,
+                    "h" for last hour, or None for all messages
+        use_rollups: Rank the user against everyone else from the daily rollups instead of the raw messages
+    
+    Returns:
+        Dictionary containing analysis results or error message, or None if the aggregation backend is unavailable
+    """
+    user_id_str = str(member.id)
+    since = time_filter_since(time_filter)
+    user_match = aggregation.build_message_match(EXCLUDED_USER_IDS, since, author_id=user_id_str)
+    if use_rollups and time_filter in ROLLUP_FILTERS:
+        all_user_counts = rollup_user_counts(since)
+    else:
+        all_user_counts = aggregation.aggregate_user_counts(aggregation.build_message_match(EXCLUDED_USER_IDS, since))
+    stats, word_stats, user_counts = await asyncio.gather(
+            aggregation.aggregate_message_stats(user_match),
+            aggregation.aggregate_word_stats(user_match, EXCLUDED_WORDS),
+            all_user_counts,
+    )
+    if stats is None or word_stats is None or user_counts is None:
+        return None
     
-    channel_counts = collections.Counter(msg["channel_id"] for msg in messages)
-    return [
-        {"channel_id": channel_id, "num_messages": count}
-        for channel_id, count in channel_counts.items()
-        if count > 0
-    ]
+    totals = stats["totals"]
+    if totals["count"] == 0:
+        return f"No messages found for user {member.display_name}."
+    if not word_stats["top"]:
+        return f"No analysable content found for user {member.display_name}."
+    
+    # Leaderboard position is one more than the number of users with more messages
+    lb_position: int = 1 + sum(1 for count in user_counts.values() if count > totals["count"])
+    
+    longest_silence, silence_start, silence_end, average_between, messages_per_day = _aggregated_timing(totals, stats["longest_gap"])
+    most_common_word, most_common_count = word_stats["top"][0]
+    return UserMessageAnalysisResult(
+            total_messages=totals["count"],
+            most_common_word=most_common_word,
+            most_common_word_count=most_common_count,
+            top_3_words=word_stats["top"],
+            total_unique_words=word_stats["unique"],
+            average_length=word_stats["unique_length_sum"] / word_stats["unique"],
+            vocabulary_diversity=(word_stats["unique"] / word_stats["total"]) * 100,
+            active_channels_lb=[ChannelMessageStats(channel_id=channel_id, num_messages=count)
+                                for channel_id, count in stats["channels"].items()],
+            active_users_lb_position=lb_position,
+            most_recent_message=int(totals["last"]),
+            median_message_length=totals["median_length"],
+            longest_silence=longest_silence,
+            longest_silence_start=silence_start,
+            longest_silence_end=silence_end,
+            messages_per_day=messages_per_day,
+            average_words_per_message=totals["word_sum"] / totals["count"],
+            average_time_between_messages=average_between,
+    )
 
 
 async def analyse_messages(ctx: CContext, time_filter: str | None = None) -> MessageAnalysisResult | str:
     """
     analyse all messages in the database.
+    Results are cached until the messages or the guild members change.
 
     Args:
         time_filter: Optional time filter - "w" for last week, "d" for last day,
@@ -304,220 +632,148 @@ async def analyse_messages(ctx: CContext, time_filter: str | None = None) -> Mes
     Returns:
         Dictionary containing analysis results or error message
     """
-    valid_messages, total_messages = await get_valid_messages(time_filter, ctx=ctx)
-    if not valid_messages:
+    config = ctx.bot.config.analysis
+    return await result_cache.get_or_compute(
+            "analyse_messages",
+            (time_filter, config.backend, config.word_sketches and db_stuff.word_sketch is not None),
+            lambda: _analyse_messages(ctx, time_filter),
+    )
+
+
+async def _analyse_messages(ctx: CContext, time_filter: str | None = None) -> MessageAnalysisResult | str:
+    if ctx.bot.config.analysis.backend == "aggregate":
+        aggregated = await aggregate_analyse_messages(ctx, time_filter)
+        if aggregated is not None:
+            return aggregated
+        logger.warning("Aggregation backend unavailable, falling back to local message analysis")
+    elif ctx.bot.config.analysis.backend == "stream":
+        streamed = await stream_analyse_messages(ctx, time_filter)
+        if streamed is not None:
+            return streamed
+        logger.warning("Database unavailable for streaming, falling back to local message analysis")
+    
+    frame = await get_message_frame()
+    if frame is None:
         return "No valid messages found to analyse."
     
-    # Extract message content
-    content_list = [message["content"] for message in valid_messages]
+    selected = frame.mask(since=time_filter_since(time_filter), excluded_author_ids=EXCLUDED_USER_IDS)
+    guild: discord.Guild | None = ctx.bot.get_guild(ctx.bot.config.guild_id)
+    if time_filter != "il" and guild is not None:
+        # don't include messages from users no longer in the guild
+        selected &= frame.mask(author_ids=[member.id for member in guild.members])
     
-    # analyse word statistics
-    word_stats: WordStats | None = analyse_word_stats(content_list)
-    if not word_stats:
-        return "No valid content to analyse."
+    if not selected.any():
+        return "No valid messages found to analyse."
     
-    # Get user message counts
-    user_message_count = collections.Counter(msg["author_id"] for msg in valid_messages)
-    active_users: list[UserMessageStats] = [
-        UserMessageStats(user_id=user_id, num_messages=count)
-        for user_id, count in user_message_count.items()
-    ]
-    
-    # Get channel stats
-    active_channels = get_channel_stats(valid_messages)
-    
-    lengths: list[int] = [len(c) for c in content_list]
-    median_length: float = statistics.median(lengths) if lengths else 0.0
-    
-    word_counts: list[int] = [len(c.split()) for c in content_list]
-    avg_words: float = sum(word_counts) / len(word_counts) if word_counts else 0.0
-    
-    timestamps: list[float] = sorted(msg["timestamp"] for msg in valid_messages)
-    longest_silence_str: str = "N/A"
-    longest_silence_start: str = "N/A"
-    longest_silence_end: str = "N/A"
-    average_time_between_messages: str = "N/A"
-    if len(timestamps) >= 2:
-        gaps = [(timestamps[i + 1] - timestamps[i], timestamps[i], timestamps[i + 1]) for i in range(len(timestamps) - 1)]
-        max_gap, silence_start_ts, silence_end_ts = max(gaps, key=lambda x: x[0])
-        gap_td: datetime.timedelta = datetime.timedelta(seconds=max_gap)
-        days: int = gap_td.days
-        hours, remainder = divmod(gap_td.seconds, 3600)
-        minutes: int = remainder // 60
-        parts = []
-        if days:
-            parts.append(f"{days}d")
-        if hours:
-            parts.append(f"{hours}h")
-        if minutes:
-            parts.append(f"{minutes}m")
-        longest_silence_str = " ".join(parts) if parts else "<1m"
-        longest_silence_start = f"<t:{int(silence_start_ts)}>"
-        longest_silence_end = f"<t:{int(silence_end_ts)}>"
-        avg_gap_seconds = (timestamps[-1] - timestamps[0]) / (len(timestamps) - 1)
-        avg_gap_td = datetime.timedelta(seconds=avg_gap_seconds)
-        avg_days = avg_gap_td.days
-        avg_hours, avg_remainder = divmod(avg_gap_td.seconds, 3600)
-        avg_minutes = avg_remainder // 60
-        avg_parts = []
-        if avg_days:
-            avg_parts.append(f"{avg_days}d")
-        if avg_hours:
-            avg_parts.append(f"{avg_hours}h")
-        if avg_minutes:
-            avg_parts.append(f"{avg_minutes}m")
-        average_time_between_messages = " ".join(avg_parts) if avg_parts else "<1m"
-    
-    messages_per_day: float = 0.0
-    if len(timestamps) >= 2:
-        span_days: float = (timestamps[-1] - timestamps[0]) / 86400
-        if span_days > 0:
-            messages_per_day = len(valid_messages) / span_days
+    # The sketch counts every message, so with it the word statistics include users who have left
+    sketch = db_stuff.word_sketch if ctx.bot.config.analysis.word_sketches and time_filter in SKETCH_FILTERS else None
+    try:
+        summary = await analysis_executor.run(summarise, frame.select(selected, with_contents=sketch is None), sketch is None)
+    except AnalysisTimeoutError:
+        logger.warning(f"Message analysis of {int(selected.sum())} messages timed out")
+        return TIMEOUT_MESSAGE
     
-    return MessageAnalysisResult(
-            total_messages=total_messages,
-            total_valid_messages=len(valid_messages),
-            most_common_word=word_stats["most_common_word"],
-            most_common_word_count=word_stats["most_common_word_count"],
-            top_3_words=word_stats["top_3_words"],
-            total_unique_words=word_stats["total_unique_words"],
-            average_length=word_stats["average_length"],
-            vocabulary_diversity=word_stats["vocabulary_diversity"],
-            active_users_lb=active_users,
-            active_channels_lb=active_channels,
-            total_users=len(user_message_count),
-            median_message_length=median_length,
-            longest_silence=longest_silence_str,
-            longest_silence_start=longest_silence_start,
-            longest_silence_end=longest_silence_end,
-            messages_per_day=messages_per_day,
-            average_words_per_message=avg_words,
-            average_time_between_messages=average_time_between_messages,
-    )
+    if sketch is None:
+        return _summary_result(summary, frame.total_documents, summary["word_stats"])
+    return _summary_result(summary, frame.total_documents, sketch.stats(), sketch.error_bounds())
 
 
-async def analyse_user_messages(member: discord.User | discord.Member, time_filter: str | None = None) -> UserMessageAnalysisResult | str:
+async def analyse_user_messages(member: discord.User | discord.Member,
+                                time_filter: str | None = None,
+                                backend: str = "aggregate",
+                                use_rollups: bool = False,
+                                ) -> UserMessageAnalysisResult | str:
     """
     analyse messages from a specific user.
+    Results are cached until the messages change.
 
     Args:
         member: Discord user to analyse
         time_filter: Optional time filter - "w" for last week, "d" for last day,
                     "h" for last hour, or None for all messages
+        backend: "aggregate" to compute the statistics in MongoDB, "local" to compute them in Python.
+                 "stream" also uses MongoDB, a single user's statistics don't need the whole history in memory
+        use_rollups: With the aggregate backend, rank the user from the daily rollups
 
     Returns:
         Dictionary containing analysis results, error message, or None
     """
-    valid_messages, _ = await get_valid_messages(time_filter)
-    if not valid_messages:
+    return await result_cache.get_or_compute(
+            "analyse_user_messages",
+            (member.id, time_filter, backend, use_rollups),
+            lambda: _analyse_user_messages(member, time_filter, backend, use_rollups),
+    )
+
+
+async def _analyse_user_messages(member: discord.User | discord.Member,
+                                 time_filter: str | None,
+                                 backend: str,
+                                 use_rollups: bool,
+                                 ) -> UserMessageAnalysisResult | str:
+    if backend in ("aggregate", "stream"):
+        aggregated = await aggregate_analyse_user_messages(member, time_filter, use_rollups)
+        if aggregated is not None:
+            return aggregated
+        logger.warning("Aggregation backend unavailable, falling back to local user message analysis")
+    
+    frame = await get_message_frame()
+    if frame is None:
         return "No valid messages found to analyse."
     
-    user_id_str = str(member.id)
-    messages_by_user = [msg for msg in valid_messages if msg["author_id"] == user_id_str]
+    since = time_filter_since(time_filter)
+    selected = frame.mask(since=since, excluded_author_ids=EXCLUDED_USER_IDS)
+    if not selected.any():
+        return "No valid messages found to analyse."
     
-    if not messages_by_user:
+    user_id_str = str(member.id)
+    by_user = selected & (frame.author_ids == member.id)
+    user_total = int(by_user.sum())
+    if not user_total:
         return f"No messages found for user {member.display_name}."
     
-    content_list = [msg["content"] for msg in messages_by_user]
-    word_stats = analyse_word_stats(content_list)
+    # Word statistics come from the word index when it is available, instead of re-splitting every message
+    word_counts = indexed_word_counts(frame, by_user, user_id_str, since)
+    try:
+        summary = await analysis_executor.run(summarise, frame.select(by_user, with_contents=word_counts is None), word_counts is None)
+    except AnalysisTimeoutError:
+        logger.warning(f"Message analysis of {user_total} messages by {member.id} timed out")
+        return TIMEOUT_MESSAGE
     
+    word_stats = summary["word_stats"] if word_counts is None else word_counts.stats()
     if not word_stats:
         return f"No analysable content found for user {member.display_name}."
     
-    active_channels = get_channel_stats(messages_by_user)
+    # Leaderboard position, users with the same count are ranked by who sent their first message first
+    user_message_count = frame.author_counts(selected)
+    lb_position = 1 + sum(1 for count in user_message_count.values() if count > user_total)
+    for user_id, count in user_message_count.items():
+        if user_id == user_id_str:
+            break
+        if count == user_total:
+            lb_position += 1
     
-    # Find most recent message timestamp
-    most_recent: datetime.datetime | None = max(
-            (datetime.datetime.fromtimestamp(msg["timestamp"], tz=datetime.UTC) for msg in messages_by_user),
-            default=None,
-    )
-    
-    # Calculate leaderboard position
-    user_message_count = collections.Counter(msg["author_id"] for msg in valid_messages)
-    active_users: list[UserMessageStats] = [
-        {"user_id": user, "num_messages": count}
-        for user, count in user_message_count.items()
-    ]
-    
-    # Sort users by message count
-    active_user_lb = sorted(
-            active_users,
-            key=lambda x: x["num_messages"],
-            reverse=True,
-    )
-    
-    # Find user"s position in leaderboard
-    lb_position = next(
-            (i for i, user in enumerate(active_user_lb, 1)
-             if user["user_id"] == user_id_str), 0,
-    )
-    
-    lengths: list[int] = [len(c) for c in content_list]
-    median_length: float = statistics.median(lengths) if lengths else 0.0
-    
-    word_counts: list[int] = [len(c.split()) for c in content_list]
-    avg_words: float = sum(word_counts) / len(word_counts) if word_counts else 0.0
-    
-    timestamps: list[float] = sorted(msg["timestamp"] for msg in messages_by_user)
-    longest_silence_str: str = "N/A"
-    longest_silence_start: str = "N/A"
-    longest_silence_end: str = "N/A"
-    average_time_between_messages: str = "N/A"
-    if len(timestamps) >= 2:
-        gaps = [(timestamps[i + 1] - timestamps[i], timestamps[i], timestamps[i + 1]) for i in range(len(timestamps) - 1)]
-        max_gap, silence_start_ts, silence_end_ts = max(gaps, key=lambda x: x[0])
-        gap_td: datetime.timedelta = datetime.timedelta(seconds=max_gap)
-        days: int = gap_td.days
-        hours, remainder = divmod(gap_td.seconds, 3600)
-        minutes: int = remainder // 60
-        parts = []
-        if days:
-            parts.append(f"{days}d")
-        if hours:
-            parts.append(f"{hours}h")
-        if minutes:
-            parts.append(f"{minutes}m")
-        longest_silence_str = " ".join(parts) if parts else "<1m"
-        longest_silence_start = f"<t:{int(silence_start_ts)}>"
-        longest_silence_end = f"<t:{int(silence_end_ts)}>"
-        avg_gap_seconds = (timestamps[-1] - timestamps[0]) / (len(timestamps) - 1)
-        avg_gap_td = datetime.timedelta(seconds=avg_gap_seconds)
-        avg_days = avg_gap_td.days
-        avg_hours, avg_remainder = divmod(avg_gap_td.seconds, 3600)
-        avg_minutes = avg_remainder // 60
-        avg_parts: list[str] = []
-        if avg_days:
-            avg_parts.append(f"{avg_days}d")
-        if avg_hours:
-            avg_parts.append(f"{avg_hours}h")
-        if avg_minutes:
-            avg_parts.append(f"{avg_minutes}m")
-        average_time_between_messages = " ".join(avg_parts) if avg_parts else "<1m"
-    
-    messages_per_day: float = 0.0
-    if len(timestamps) >= 2:
-        span_days: float = (timestamps[-1] - timestamps[0]) / 86400
-        if span_days > 0:
-            messages_per_day = len(messages_by_user) / span_days
+    longest_silence, silence_start, silence_end, average_between, messages_per_day = _frame_timing(summary["timing"])
+    most_recent = summary["latest"]
     
     return UserMessageAnalysisResult(
-            total_messages=len(messages_by_user),
+            total_messages=user_total,
             most_common_word=word_stats["most_common_word"],
             most_common_word_count=word_stats["most_common_word_count"],
             top_3_words=word_stats["top_3_words"],
             total_unique_words=word_stats["total_unique_words"],
             average_length=word_stats["average_length"],
             vocabulary_diversity=word_stats["vocabulary_diversity"],
-            active_channels_lb=active_channels,
+            active_channels_lb=[ChannelMessageStats(channel_id=channel_id, num_messages=count)
+                                for channel_id, count in summary["channel_counts"].items()],
             active_users_lb_position=lb_position,
-            most_recent_message=int(most_recent.timestamp()) if most_recent else "N/A",
-            median_message_length=median_length,
-            longest_silence=longest_silence_str,
-            longest_silence_start=longest_silence_start,
-            longest_silence_end=longest_silence_end,
+            most_recent_message=int(most_recent) if most_recent is not None else "N/A",
+            median_message_length=summary["median_length"],
+            longest_silence=longest_silence,
+            longest_silence_start=silence_start,
+            longest_silence_end=silence_end,
             messages_per_day=messages_per_day,
-            average_words_per_message=avg_words,
-            average_time_between_messages=average_time_between_messages,
+            average_words_per_message=summary["average_words"],
+            average_time_between_messages=average_between,
     )
 
 
@@ -534,13 +790,15 @@ async def format_analysis(ctx: CContext, graph: bool = False, to_analyse: discor
     # TODO: Make the filtering less dumb
     
     # Parse time filter from message
-    valid_flags = ["-w", "-d", "-h", "-il", "-dm"]
+    valid_flags = ["-w", "-d", "-h", "-il", "-dm", "-exact"]
     if flag:
         if flag.lower() not in valid_flags:
             await ctx.send(f"Invalid flag. Flag should be one of {valid_flags}.")
         else:
             ctx.message.content = ctx.message.content.replace(flag, "")
             flag = flag.lower().replace("-", "")
+    # The commands pass "" without a flag, which is the all time analysis the rollups and sketches serve
+    flag = flag or None
     
     new_msg = await ctx.send("Analysing...")
     
@@ -598,8 +856,9 @@ async def format_analysis(ctx: CContext, graph: bool = False, to_analyse: discor
     )
     
     # Add top users
+    names = await user_ids_to_display_names([int(user["user_id"]) for user in top_5_users], ctx.bot)
     for i, user in enumerate(top_5_users, start=1):
-        msg += f"**{i}. {await user_id_to_display_name(int(user["user_id"]), ctx.bot)}** {user["num_messages"]} messages\n"
+        msg += f"**{i}. {names[int(user["user_id"])]}** {user["num_messages"]} messages\n"
     
     # Add top channels
     msg += "\nTop 5 most active channels:\n"
@@ -616,23 +875,27 @@ async def format_analysis(ctx: CContext, graph: bool = False, to_analyse: discor
     msg += f"Messages per day: **{result["messages_per_day"]:.2f}**\n"
     msg += f"Average time between messages: **{result["average_time_between_messages"]}**\n"
     msg += f"Longest silence: **{result["longest_silence"]}** (from {result["longest_silence_start"]} to {result["longest_silence_end"]})"
+    if "word_stats_error" in result:
+        error = result["word_stats_error"]
+        msg += (f"\n*Word statistics are estimates: word counts up to {error["top_words_error"]} too high, "
+                f"unique words ±{error["unique_words_error"]:.1%}, average word length ±{error["average_length_error"]:.2f}. "
+                "Use -exact for exact values.*")
     
     # Send the message
     await new_msg.edit(content=msg)
     
     # Generate graph if requested
     if graph:
-        await generate_user_activity_graph(ctx, result, guild)
+        await generate_user_activity_graph(ctx, result)
 
 
-async def generate_user_activity_graph(ctx: CContext, result: MessageAnalysisResult, guild: discord.Guild) -> None:
+async def generate_user_activity_graph(ctx: CContext, result: MessageAnalysisResult) -> None:
     """
     Generate and send a graph of user activity.
     
     Args:
         ctx: Discord command context
         result: Analysis results
-        guild: Discord guild
     """
     # Get top 15 users
     top_15_users = sorted(
@@ -644,17 +907,10 @@ async def generate_user_activity_graph(ctx: CContext, result: MessageAnalysisRes
     usernames: list[str] = []
     message_counts: list[int] = []
     
+    # Members of the guild first, users who left are fetched together
+    discord_members = await discord_utils.resolve_users([int(user["user_id"].strip()) for user in top_15_users], ctx.bot)
     for user in top_15_users:
-        user_id = int(user["user_id"].strip())
-        
-        # Try to get member from guild first
-        discord_member: discord.Member | discord.User | None = guild.get_member(user_id)
-        if discord_member is None:
-            # Fetch user if not in guild
-            try:
-                discord_member = await ctx.bot.fetch_user(user_id)
-            except (discord.NotFound, discord.HTTPException):
-                discord_member = None
+        discord_member = discord_members[int(user["user_id"].strip())]
         
         # Get display name
         display = user["user_id"]
@@ -667,32 +923,9 @@ async def generate_user_activity_graph(ctx: CContext, result: MessageAnalysisRes
         usernames.append(display)
         message_counts.append(user["num_messages"])
     
-    # Reverse lists so users with most messages are at the top
-    usernames = usernames[::-1]
-    message_counts = message_counts[::-1]
-    
-    # Create the plot
-    plt.figure(figsize=(10, 6), facecolor="#1f1f1f")
-    ax = plt.gca()
-    ax.set_facecolor("#2d2d2d")
-    plt.barh(usernames, message_counts, color="#8a2be2")
-    plt.xlabel("Number of Messages", color="white")
-    plt.title("Top 15 Active Users", color="white")
-    plt.tick_params(axis="both", colors="white")
-    
-    # Style the plot
-    for spine in ax.spines.values():
-        spine.set_color("#555555")
-    plt.tight_layout()
-    
-    # Save and send the graph
-    with tempfile.TemporaryDirectory() as temp_dir:
-        temp_dir_path = Path(temp_dir)
-        graph_file = temp_dir_path / Path("top_active_users.png")
-        plt.savefig(graph_file)
-        plt.close()
-        
-        await ctx.send(file=discord.File(graph_file))
+    chart = BarChart(tuple(usernames), tuple(message_counts), "Top 15 Active Users", "Number of Messages")
+    image = await chart_renderer.render(chart)
+    await ctx.send(file=discord.File(io.BytesIO(image), filename="top_active_users.png"))
 
 
 async def analyse_single_user_cmd(ctx: CContext, member: discord.User,
@@ -708,7 +941,7 @@ async def analyse_single_user_cmd(ctx: CContext, member: discord.User,
         time_filter: Optional time filter
         dm_user: Whether to DM the user the results or send it in the current channel
     """
-    result = await analyse_user_messages(member, time_filter)
+    result = await analyse_user_messages(member, time_filter, ctx.bot.config.analysis.backend, ctx.bot.config.analysis.rollups)
     if isinstance(result, str):
         await ctx.send(result)
         return
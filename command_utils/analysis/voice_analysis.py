@@ -1,89 +1,41 @@
+import asyncio
 import datetime
+import io
 import logging
-import tempfile
+import time
 import traceback
-from collections import Counter
 from collections.abc import Mapping
-from pathlib import Path
-from statistics import median
-from typing import Any, NotRequired, TypedDict, TypeVar
+from typing import Any, Final
 
 import discord
 from discord import DMChannel
-from matplotlib import pyplot as plt
 
-from command_utils.analysis.ana_utils import try_resolve_channel_id, user_id_to_display_name
+from command_utils.analysis.ana_utils import try_resolve_channel_id, user_ids_to_display_names
+from command_utils.analysis.charts import BarChart, chart_renderer
+from command_utils.analysis.executor import analysis_executor
+from command_utils.analysis.result_cache import result_cache
+from command_utils.analysis.voice_index import VoiceIndex, seconds_by_user
+from command_utils.analysis.voice_stats import (
+    DBVoiceSession,
+    UserVoiceAnalysisResult,
+    UserVoiceStats,
+    VoiceAnalysisResult,
+    add_time_stats,
+    compute_user_voice_statistics,
+    compute_voice_statistics,
+)
 from command_utils.CContext import CContext, CoolBot
-from utils import db_stuff
+from utils import db_indexes, db_stuff, voice_totals
 
 logger = logging.getLogger("discord")
 
+VOICE_INDEX_MAX_AGE: Final[float] = 3600  # Seconds before the voice index is rebuilt, to pick up sessions saved elsewhere
+OCCUPANCY_MAX_USERS: Final[int] = 30  # Users listed by channel_occupancy, keeping the message under Discord's length limit
 
-class DBVoiceSession(TypedDict):
-    user_id: str
-    channel_id: str
-    duration_seconds: int
-    _id: Any  # The database internal ID, type depends on the database
-    timestamp: NotRequired[int]
-
-
-class UserVoiceStats(TypedDict):
-    user_id: str
-    total_seconds: int
-
-
-class ChannelVoiceStats(TypedDict):
-    channel_id: str
-    total_seconds: int
-
-
-class CompanionStats(TypedDict):
-    user_id: str
-    total_seconds: int
-
-
-class UserVoiceAnalysisResult(TypedDict):
-    user_id: str
-    total_seconds: int
-    active_channel_lb: list[ChannelVoiceStats]
-    top_companions: list[CompanionStats]
-    avg_session_duration: int
-    total_sessions: int
-    avg_users_per_session: float
-    median_session_duration: int
-    peak_activity_hour: NotRequired[int]
-    favorite_day: NotRequired[str]
-
-
-class DuoStats(TypedDict):
-    user_id_1: str
-    user_id_2: str
-    total_seconds: int
-
-
-class WeeklyActiveStats(TypedDict):
-    this_week: int
-    last_week: int
-    activity_ratio: float  # this_week / total_users
-
-
-class VoiceAnalysisResult(TypedDict):
-    total_seconds: int
-    total_users: int
-    active_users_lb: list[UserVoiceStats]
-    active_channels_lb: list[ChannelVoiceStats]
-    best_duo: NotRequired[DuoStats]
-    avg_users_per_session: NotRequired[float]
-    total_sessions: NotRequired[int]
-    avg_session_duration: NotRequired[int]
-    median_session_duration: NotRequired[int]
-    weekly_active: NotRequired[WeeklyActiveStats]
-
-T = TypeVar("T", UserVoiceStats, ChannelVoiceStats)
-
-def add_time_stats[T: (UserVoiceStats, ChannelVoiceStats)](stats: T, seconds: int) -> T:
-    stats["total_seconds"] = stats.get("total_seconds", 0) + seconds
-    return stats
+db_indexes.register_index("voice_sessions", [("user_id", 1), ("timestamp", 1)])
+db_indexes.register_index("voice_sessions", [("timestamp", 1)])
+db_indexes.register_query("Voice sessions of user", "voice_sessions", {"user_id": "0", "timestamp": {"$gte": 0}})
+db_indexes.register_query("Voice sessions since time", "voice_sessions", {"timestamp": {"$gte": 0}})
 
 
 def format_duration(seconds: int) -> str:
@@ -106,70 +58,20 @@ def format_duration(seconds: int) -> str:
     return f"{seconds}s"
 
 
-def _merge_adjacent_sessions(sessions: list[DBVoiceSession], max_gap_seconds: int = 60) -> list[DBVoiceSession]:
-    """
-    Merge sessions from the same user and channel that are close together in time.
-    This handles the case where the bot restarts and creates two separate sessions
-    for what is effectively a single continuous voice session.
-    
-    Sessions are merged when the gap between one session"s end and the next session"s
-    start is within max_gap_seconds.
-    """
-    # Only timed sessions can be merged; keep untimed ones as-is
-    timed = [s for s in sessions if "timestamp" in s]
-    untimed = [s for s in sessions if "timestamp" not in s]
-    
-    if not timed:
-        return sessions
-    
-    # Sort by user_id, channel_id, then timestamp
-    timed.sort(key=lambda s: (s["user_id"], s["channel_id"], s["timestamp"]))
-    
-    merged: list[DBVoiceSession] = []
-    current = timed[0]
-    
-    for next_session in timed[1:]:
-        same_user = current["user_id"] == next_session["user_id"]
-        same_channel = current["channel_id"] == next_session["channel_id"]
-        
-        if same_user and same_channel:
-            current_end = current["timestamp"]
-            next_start = next_session["timestamp"] - next_session["duration_seconds"]
-            gap = next_start - current_end
-            
-            if 0 <= gap <= max_gap_seconds:
-                # Merge: combine durations + gap, keep the later timestamp
-                current = DBVoiceSession(
-                        user_id=current["user_id"],
-                        channel_id=current["channel_id"],
-                        duration_seconds=current["duration_seconds"] + next_session["duration_seconds"] + gap,
-                        _id=current["_id"],
-                        timestamp=next_session["timestamp"],
-                )
-                continue
-        
-        merged.append(current)
-        current = next_session
-    
-    merged.append(current)
-    return untimed + merged
-
-
-async def remove_invalid_voice_sessions(
-        sessions: list[Mapping[str, Any]],
-        merge_sessions: bool = True
-    ) -> tuple[list[DBVoiceSession], int] | None:
+async def remove_invalid_voice_sessions(sessions: list[Mapping[str, Any]]) -> tuple[list[DBVoiceSession], int] | None:
     required_keys = {"user_id", "channel_id", "duration_seconds"}
     valid_sessions: list[DBVoiceSession] = []
     total_seconds: int = 0
+    invalid_ids: list[Any] = []
     
     for session in sessions:
         
         valid = all(key in session for key in required_keys)
         
         if not valid:
-            logger.warning(f"deleting invalid voice session: {session}")
-            await db_stuff.del_db_entry("voice_sessions", session["_id"])
+            logger.warning(f"Removing invalid voice session: {session}")
+            if "_id" in session:
+                invalid_ids.append(session["_id"])
             continue
         
         total_seconds += session["duration_seconds"]
@@ -185,30 +87,31 @@ async def remove_invalid_voice_sessions(
         
         valid_sessions.append(valid_session)
     
+    db_stuff.quarantine_in_background("voice_sessions", invalid_ids)
     if not valid_sessions:
         return None
     
-    if merge_sessions:
-        valid_sessions = _merge_adjacent_sessions(valid_sessions)
-    merged_total = sum(s["duration_seconds"] for s in valid_sessions)
-    return valid_sessions, merged_total
+    return valid_sessions, total_seconds
 
 
-async def get_valid_voice_sessions(
-        skip_cache: bool = False,
-        merge_sessions: bool = True
-    ) -> tuple[list[DBVoiceSession], int] | None:
+async def get_valid_voice_sessions(skip_cache: bool = False) -> tuple[list[DBVoiceSession], int] | None:
+    """
+    The valid voice sessions and their total duration.
+    Sessions split by bot restarts are already merged in the database, see db_stuff.compact_voice_sessions.
+    """
     sessions = await db_stuff.cached_download_voice_sessions(skip_cache)
     
     if not sessions:
         return None
     
-    return await remove_invalid_voice_sessions(sessions, merge_sessions)
+    return await remove_invalid_voice_sessions(sessions)
 
 
 async def get_voice_statistics(include_left: bool = False, guild: discord.Guild | None = None) -> VoiceAnalysisResult | None:
     """
     Retrieve voice statistics from MongoDB and calculate user and channel totals.
+    The calculation runs on the analysis executor, so large session histories don't block the bot.
+    Results are cached until the voice sessions or the guild members change.
     
     Args:
         include_left: Whether to include users who have left the server
@@ -217,143 +120,37 @@ async def get_voice_statistics(include_left: bool = False, guild: discord.Guild
     Returns:
         Dictionary containing voice statistics or None if no data
     """
+    return await result_cache.get_or_compute(
+            "get_voice_statistics",
+            (include_left, guild.id if guild is not None else None),
+            lambda: _get_voice_statistics(include_left, guild),
+    )
+
+
+async def _get_voice_statistics(include_left: bool, guild: discord.Guild | None) -> VoiceAnalysisResult | None:
     DB_sessions: tuple[list[DBVoiceSession], int] | None = await get_valid_voice_sessions()
     
     if not DB_sessions:
         return None
     
     sessions, total_seconds_including_left = DB_sessions
-    total_seconds: int = 0
-    # Calculate user statistics
-    user_stats: dict[str, UserVoiceStats] = {}
-    channel_stats: dict[str, ChannelVoiceStats] = {}
-    for session in sessions:
-        user_id = session["user_id"]
-        if not include_left and guild is not None and guild.get_member(int(user_id)) is None:
-            continue
-        
-        user_stat: UserVoiceStats = user_stats.get(user_id, {"user_id": user_id, "total_seconds": 0})
-        user_stats[user_id] = add_time_stats(user_stat, session["duration_seconds"])
-        total_seconds += session["duration_seconds"]
-        
-        channel_id = session["channel_id"]
-        if guild is not None:
-            exists = discord.utils.get(guild.channels, id=int(channel_id)) is not None
-            if not exists:
-                continue
-        
-        channel_stat: ChannelVoiceStats = channel_stats.get(channel_id, {"channel_id": channel_id, "total_seconds": 0})
-        channel_stats[channel_id] = add_time_stats(channel_stat, session["duration_seconds"])
-    
-    # Sort statistics
-    top_users: list[UserVoiceStats] = sorted(
-            [UserVoiceStats(user_id=user_id, total_seconds=data["total_seconds"])
-             for user_id, data in user_stats.items()],
-            key=lambda x: x["total_seconds"],
-            reverse=True,
-    )
-    
-    top_channels: list[ChannelVoiceStats] = sorted(
-            [ChannelVoiceStats(channel_id=channel_id, total_seconds=data["total_seconds"])
-             for channel_id, data in channel_stats.items()],
-            key=lambda x: x["total_seconds"],
-            reverse=True,
-    )
-    
-    # Best duo calculation
-    timed_sessions = [s for s in sessions if "timestamp" in s]
-    duo_seconds: dict[tuple[str, str], int] = {}
-    for i, s1 in enumerate(timed_sessions):
-        s1_start = s1["timestamp"] - s1["duration_seconds"]
-        s1_end = s1["timestamp"]
-        for s2 in timed_sessions[i + 1:]:
-            if s1["user_id"] == s2["user_id"]:
-                continue
-            if s1["channel_id"] != s2["channel_id"]:
-                continue
-            s2_start = s2["timestamp"] - s2["duration_seconds"]
-            s2_end = s2["timestamp"]
-            overlap = min(s1_end, s2_end) - max(s1_start, s2_start)
-            if overlap > 0:
-                uid1, uid2 = sorted([s1["user_id"], s2["user_id"]])
-                pair: tuple[str, str] = (uid1, uid2)
-                duo_seconds[pair] = duo_seconds.get(pair, 0) + overlap
-    
-    best_duo: DuoStats | None = None
-    if duo_seconds:
-        best_pair = max(duo_seconds, key=lambda k: duo_seconds[k])
-        best_duo = DuoStats(user_id_1=best_pair[0], user_id_2=best_pair[1], total_seconds=duo_seconds[best_pair])
-    
-    # Average users per session and total sessions
-    # A "session" is approximated by grouping overlapping timed sessions per channel
-    total_session_count = len(sessions)
-    # Count unique users per channel-session overlap window is complex;
-    # simpler: for each session, count how many other users were in the same channel at the same time
-    # Average users per session = average number of concurrent users when a session starts
-    if timed_sessions:
-        concurrent_counts: list[int] = []
-        for s in timed_sessions:
-            s_start = s["timestamp"] - s["duration_seconds"]
-            count: int = 0
-            for other in timed_sessions:
-                if other is s:
-                    continue
-                if other["channel_id"] != s["channel_id"]:
-                    continue
-                o_start = other["timestamp"] - other["duration_seconds"]
-                o_end = other["timestamp"]
-                if o_start <= s_start < o_end:
-                    count += 1
-            concurrent_counts.append(count + 1)  # +1 for the user themselves
-        avg_users_per_session = sum(concurrent_counts) / len(concurrent_counts)
-    else:
-        avg_users_per_session = 1.0
-    
-    # Average and median session duration
-    session_durations = [s["duration_seconds"] for s in sessions]
-    avg_session_duration = sum(session_durations) // len(session_durations) if session_durations else 0
-    median_session_duration = int(median(session_durations)) if session_durations else 0
-    
-    # Weekly unique active users
-    now = datetime.datetime.now(datetime.UTC)
-    one_week_ago = now - datetime.timedelta(days=7)
-    two_weeks_ago = now - datetime.timedelta(days=14)
-    this_week_users: set[str] = set()
-    last_week_users: set[str] = set()
-    for s in timed_sessions:
-        session_time = datetime.datetime.fromtimestamp(s["timestamp"], datetime.UTC)
-        if session_time >= one_week_ago:
-            this_week_users.add(s["user_id"])
-        elif session_time >= two_weeks_ago:
-            last_week_users.add(s["user_id"])
-    
-    total_user_count = len(user_stats) if user_stats else 1
-    weekly_active = WeeklyActiveStats(
-            this_week=len(this_week_users),
-            last_week=len(last_week_users),
-            activity_ratio=len(this_week_users) / total_user_count,
+    member_ids: set[int] | None = None
+    channel_ids: set[int] | None = None
+    if guild is not None:
+        if not include_left:
+            member_ids = {member.id for member in guild.members}
+        channel_ids = {channel.id for channel in guild.channels}
+    
+    return await analysis_executor.run(
+            compute_voice_statistics,
+            sessions, total_seconds_including_left, include_left, member_ids, channel_ids, time.time(),
     )
-    
-    result_dict = VoiceAnalysisResult(
-            total_seconds=total_seconds_including_left if include_left else total_seconds,
-            total_users=len(user_stats),
-            active_users_lb=top_users,
-            active_channels_lb=top_channels,
-            total_sessions=total_session_count,
-            avg_users_per_session=avg_users_per_session,
-            avg_session_duration=avg_session_duration,
-            median_session_duration=median_session_duration,
-            weekly_active=weekly_active,
-    )
-    if best_duo:
-        result_dict["best_duo"] = best_duo
-    
-    return result_dict
 
 
 async def get_user_voice_statistics(user_id: str) -> UserVoiceAnalysisResult | None:
     """
     Retrieve voice statistics for a specific user.
+    Results are cached until the voice sessions change.
 
     Args:
         user_id: Discord user ID
@@ -361,120 +158,17 @@ async def get_user_voice_statistics(user_id: str) -> UserVoiceAnalysisResult | N
     Returns:
         Dictionary containing user voice statistics or None if no data
     """
+    return await result_cache.get_or_compute("get_user_voice_statistics", (user_id,), lambda: _get_user_voice_statistics(user_id))
+
+
+async def _get_user_voice_statistics(user_id: str) -> UserVoiceAnalysisResult | None:
     DB_sessions: tuple[list[DBVoiceSession], int] | None = await get_valid_voice_sessions()
     
     if not DB_sessions:
         return None
     
-    sessions, total_seconds = DB_sessions
-    
-    # Filter sessions for this user
-    user_sessions = [s for s in sessions if s["user_id"] == user_id]
-    
-    if not user_sessions:
-        return None
-    
-    # Calculate total time
-    total_seconds = sum(s["duration_seconds"] for s in user_sessions)
-    
-    # Calculate per-channel stats
-    channel_stats: dict[str, ChannelVoiceStats] = {}
-    for session in user_sessions:
-        channel_id = session["channel_id"]
-        channel_stat: ChannelVoiceStats = channel_stats.get(channel_id, {"channel_id": channel_id, "total_seconds": 0})
-        channel_stats[channel_id] = add_time_stats(channel_stat, session["duration_seconds"])
-    
-    # Sort channels by time
-    top_channels = sorted(
-            [ChannelVoiceStats(channel_id=channel_id, total_seconds=data["total_seconds"])
-             for channel_id, data in channel_stats.items()],
-            key=lambda x: x["total_seconds"],
-            reverse=True,
-    )
-    
-    # Calculate top companions (who they spent the most time with)
-    # Only consider sessions that have a timestamp
-    timed_user_sessions = [s for s in user_sessions if "timestamp" in s]
-    other_sessions = [s for s in sessions if s["user_id"] != user_id and "timestamp" in s]
-    
-    companion_seconds: dict[str, int] = {}
-    for us in timed_user_sessions:
-        us_end = us["timestamp"]
-        us_start = us_end - us["duration_seconds"]
-        us_channel = us["channel_id"]
-        
-        for other in other_sessions:
-            if other["channel_id"] != us_channel:
-                continue
-            o_end = other["timestamp"]
-            o_start = o_end - other["duration_seconds"]
-            
-            overlap_start = max(us_start, o_start)
-            overlap_end = min(us_end, o_end)
-            overlap = overlap_end - overlap_start
-            
-            if overlap > 0:
-                companion_seconds[other["user_id"]] = companion_seconds.get(other["user_id"], 0) + overlap
-    
-    top_companions = sorted(
-            [CompanionStats(user_id=uid, total_seconds=secs) for uid, secs in companion_seconds.items()],
-            key=lambda x: x["total_seconds"],
-            reverse=True,
-    )
-    
-    # Session duration stats
-    avg_session_duration = total_seconds // len(user_sessions) if user_sessions else 0
-    median_session_duration = int(median([s["duration_seconds"] for s in user_sessions])) if user_sessions else 0
-    total_sessions = len(user_sessions)
-    
-    # Average users per session for this user
-    timed_user_sessions_for_avg = [s for s in user_sessions if "timestamp" in s]
-    all_timed = [s for s in sessions if "timestamp" in s]
-    if timed_user_sessions_for_avg:
-        concurrent_counts_user: list[int] = []
-        for s in timed_user_sessions_for_avg:
-            s_start = s["timestamp"] - s["duration_seconds"]
-            count: int = 0
-            for other in all_timed:
-                if other is s:
-                    continue
-                if other["channel_id"] != s["channel_id"]:
-                    continue
-                o_start = other["timestamp"] - other["duration_seconds"]
-                o_end = other["timestamp"]
-                if o_start <= s_start < o_end:
-                    count += 1
-            concurrent_counts_user.append(count + 1)
-        avg_users_per_session = sum(concurrent_counts_user) / len(concurrent_counts_user)
-    else:
-        avg_users_per_session = 1.0
-    
-    # Peak activity hour and favorite day (only from timed sessions)
-    result_dict = UserVoiceAnalysisResult(
-            user_id=user_id,
-            total_seconds=total_seconds,
-            active_channel_lb=top_channels,
-            top_companions=top_companions,
-            avg_session_duration=avg_session_duration,
-            total_sessions=total_sessions,
-            avg_users_per_session=avg_users_per_session,
-            median_session_duration=median_session_duration,
-    )
-    
-    if timed_user_sessions:
-        hour_counter: Counter[int] = Counter()
-        day_counter: Counter[int] = Counter()
-        for s in timed_user_sessions:
-            start_ts = s["timestamp"] - s["duration_seconds"]
-            start_dt = datetime.datetime.fromtimestamp(start_ts, tz=datetime.UTC)
-            hour_counter[start_dt.hour] += s["duration_seconds"]
-            day_counter[start_dt.weekday()] += s["duration_seconds"]
-        
-        result_dict["peak_activity_hour"] = hour_counter.most_common(1)[0][0]
-        day_names = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-        result_dict["favorite_day"] = day_names[day_counter.most_common(1)[0][0]]
-    
-    return result_dict
+    sessions, _ = DB_sessions
+    return await analysis_executor.run(compute_user_voice_statistics, sessions, user_id)
 
 
 async def voice_analysis(ctx: CContext, graph: bool = False, include_left: bool = False) -> None:
@@ -496,11 +190,16 @@ async def voice_analysis(ctx: CContext, graph: bool = False, include_left: bool
     
     result = "**Voice Activity Statistics**\n\n"
     
+    user_ids = [int(user["user_id"]) for user in stats["active_users_lb"][:5]]
+    if "best_duo" in stats:
+        user_ids += [int(stats["best_duo"]["user_id_1"]), int(stats["best_duo"]["user_id_2"])]
+    names = await user_ids_to_display_names(user_ids, ctx.bot)
+    
     # Top users
     result += "**Top 5 Users by Voice Activity**\n"
     for i, user in enumerate(stats["active_users_lb"][:5], 1):
         formatted_time = format_duration(user["total_seconds"])
-        result += f"{i}. {await user_id_to_display_name(int(user["user_id"]), ctx.bot)}: {formatted_time}\n"
+        result += f"{i}. {names[int(user["user_id"])]}: {formatted_time}\n"
     
     result += "\n"
     
@@ -520,15 +219,16 @@ async def voice_analysis(ctx: CContext, graph: bool = False, include_left: bool
     if "best_duo" in stats:
         duo = stats["best_duo"]
         duo_time = format_duration(duo["total_seconds"])
-        user1 = await user_id_to_display_name(int(duo["user_id_1"]), ctx.bot)
-        user2 = await user_id_to_display_name(int(duo["user_id_2"]), ctx.bot)
-        result += f"\n**Best Duo:** {user1} & {user2} — {duo_time} together\n"
+        result += f"\n**Best Duo:** {names[int(duo["user_id_1"])]} & {names[int(duo["user_id_2"])]} — {duo_time} together\n"
     
     # Session stats
     if "total_sessions" in stats:
         result += f"**Total sessions:** {stats["total_sessions"]}\n"
     if "avg_users_per_session" in stats:
         result += f"**Average users per session:** {stats["avg_users_per_session"]:.1f}\n"
+    if stats.get("channel_peaks"):
+        peak = stats["channel_peaks"][0]
+        result += f"**Most users at once:** {peak["peak_users"]} in {await try_resolve_channel_id(peak["channel_id"], guild)}\n"
     if "avg_session_duration" in stats:
         result += f"**Average session length:** {format_duration(stats["avg_session_duration"])}\n"
     if "median_session_duration" in stats:
@@ -577,8 +277,9 @@ async def add_voice_analysis_for_user(ctx: CContext,
         return
     
     formatted_total_time: str = format_duration(stats["total_seconds"])
+    names = await user_ids_to_display_names([int(stats["user_id"])] + [int(c["user_id"]) for c in stats["top_companions"][:5]], ctx.bot)
     
-    result = f"**Voice Activity for {await user_id_to_display_name(int(stats["user_id"]), ctx.bot)}**\n\n"
+    result = f"**Voice Activity for {names[int(stats["user_id"])]}**\n\n"
     result += f"**Total time in voice channels:** {formatted_total_time}\n\n"
     
     result += f"**Top {len(stats["active_channel_lb"][:5])} Most Used Voice Channels**\n"
@@ -590,7 +291,7 @@ async def add_voice_analysis_for_user(ctx: CContext,
         result += f"\n**Top {len(stats["top_companions"][:5])} Most Time Spent With**\n"
         for i, companion in enumerate(stats["top_companions"][:5], 1):
             formatted_time = format_duration(companion["total_seconds"])
-            result += f"{i}. {await user_id_to_display_name(int(companion["user_id"]), ctx.bot)}: {formatted_time}\n"
+            result += f"{i}. {names[int(companion["user_id"])]}: {formatted_time}\n"
     
     result += f"\n**Total sessions:** {stats["total_sessions"]}\n"
     result += f"**Average users per session:** {stats["avg_users_per_session"]:.1f}\n"
@@ -675,11 +376,12 @@ async def generate_voice_activity_graph(channel: discord.TextChannel | discord.D
     
     usernames: list[str] = []
     voice_time_hours = []
+    names = await user_ids_to_display_names([int(user_data["user_id"]) for user_data in top_users], bot)
     
     for user_data in top_users:
         total_seconds = user_data["total_seconds"]
         
-        name = await user_id_to_display_name(int(user_data["user_id"]), bot)
+        name = names[int(user_data["user_id"])]
         
         usernames.append(name if name is not None else f"ID:{user_data["user_id"]}")
         voice_time_hours.append(total_seconds / 3600)
@@ -690,84 +392,94 @@ async def generate_voice_activity_graph(channel: discord.TextChannel | discord.D
             await channel.send("No valid user data to generate a graph.")
         return
     
-    # Reverse so the highest is at the top
-    usernames.reverse()
-    voice_time_hours.reverse()
-    
-    # Create the plot
-    plt.figure(figsize=(10, 8), facecolor="#1f1f1f")
-    ax = plt.gca()
-    ax.set_facecolor("#2d2d2d")
-    plt.barh(usernames, voice_time_hours, color="#8a2be2")
-    plt.xlabel("Total Voice Time (hours)", color="white")
-    plt.title("Top Users by Voice Activity", color="white")
-    plt.tick_params(axis="both", colors="white")
-    
-    for spine in ax.spines.values():
-        spine.set_color("#555555")
-    plt.tight_layout()
-    
-    with tempfile.TemporaryDirectory() as temp_dir:
-        temp_dir_path = Path(temp_dir)
-        graph_file = Path("top_voice_users.png")
-        graph_path = temp_dir_path / graph_file
-        plt.savefig(graph_path)
-        plt.close()
-        
-        await channel.send(file=discord.File(graph_path))
+    chart = BarChart(tuple(usernames), tuple(voice_time_hours), "Top Users by Voice Activity", "Total Voice Time (hours)", figsize=(10, 8))
+    image = await chart_renderer.render(chart)
+    await channel.send(file=discord.File(io.BytesIO(image), filename="top_voice_users.png"))
 
 
-async def user_time_in_channel(ctx: CContext, user: discord.User, channel: discord.VoiceChannel) -> None:
-    sessions = await get_valid_voice_sessions()
+async def get_voice_index(skip_cache: bool = False) -> VoiceIndex | None:
+    """
+    Get the index of the valid voice sessions, building it if there is none yet or it is too old.
+    Sessions this bot saves are added to it as they are saved, see db_stuff.send_voice_session.
+    
+    Args:
+        skip_cache: Download the sessions and rebuild the index even if there is a recent one
     
+    Returns:
+        The index, or None if there is no voice activity data
+    """
+    index = db_stuff.voice_index
+    if index is not None and not skip_cache and time.monotonic() - index.built_at < VOICE_INDEX_MAX_AGE:
+        return index
+    
+    generation = db_stuff.voice_index_generation
+    sessions = await get_valid_voice_sessions(skip_cache)
     if not sessions:
-        await ctx.send("No voice activity data available.")
-        return
+        return None
     
     sessions_list, _ = sessions
-    
-    total_seconds: int = 0
-    for session in sessions_list:
-        if session["user_id"] == str(user.id) and session["channel_id"] == str(channel.id):
-            total_seconds += session["duration_seconds"]
+    index = await asyncio.to_thread(VoiceIndex, sessions_list)
+    # Sessions saved while building may be missing from it, so only keep it if there were none
+    if db_stuff.voice_index_generation == generation:
+        db_stuff.voice_index = index
+    return index
+
+
+async def user_time_in_channel(ctx: CContext, user: discord.User, channel: discord.VoiceChannel) -> None:
+    if ctx.bot.config.analysis.voice_totals:
+        query = {"user_id": str(user.id), "week": None, "channel_id": str(channel.id)}
+        row = await db_stuff.get_from_db(voice_totals.TOTALS_COLLECTION, query)
+        total_seconds: int = row["seconds"] if row is not None else 0
+    else:
+        index = await get_voice_index()
+        if index is None:
+            await ctx.send("No voice activity data available.")
+            return
+        total_seconds = index.user_channel_seconds[str(user.id), str(channel.id)]
     
     await ctx.send(f"{user.display_name} has been in {channel.mention} for {format_duration(total_seconds)}")
 
 
 async def all_sessions_this_week(skip_cache: bool = False) -> list[DBVoiceSession]:
     """
-    Retrieve all voice sessions from the past week.
+    Retrieve all voice sessions that ended in the past week.
 
     Returns:
         List of voice session dictionaries
     """
-    sessions = await get_valid_voice_sessions(skip_cache, False)
+    index = await get_voice_index(skip_cache)
     
-    if not sessions:
+    if index is None:
         return []
     
-    sessions_list, _ = sessions
-    
-    valid_sessions: list[DBVoiceSession] = []
-    for session in sessions_list:
-        if "timestamp" not in session:
-            continue
-        
-        logger.debug("session timestamp: %s", session["timestamp"])
-        session_time = datetime.datetime.fromtimestamp(session["timestamp"], datetime.UTC)
-        difference = discord.utils.utcnow() - session_time
-        if difference <= datetime.timedelta(days=7):
-            valid_sessions.append(DBVoiceSession(
-                    user_id=session["user_id"],
-                    channel_id=session["channel_id"],
-                    duration_seconds=session["duration_seconds"],
-                    _id=session["_id"],
-            ))
-    
-    return valid_sessions
+    now = time.time()
+    return [
+        DBVoiceSession(
+                user_id=session["user_id"],
+                channel_id=session["channel_id"],
+                duration_seconds=session["duration_seconds"],
+                _id=session.get("_id"),
+        )
+        for session in index.during(now - datetime.timedelta(days=7).total_seconds(), now)
+    ]
 
 
-async def voice_activity_this_week(skip_cache: bool = False) -> list[UserVoiceStats]:
+async def voice_activity_this_week(skip_cache: bool = False, use_totals: bool = False) -> list[UserVoiceStats]:
+    """
+    The 5 users who spent the most time in voice channels in the past week.
+    
+    Args:
+        skip_cache: Download the sessions again rather than using the cached ones
+        use_totals: Read the last full ISO week, Monday to Sunday, from the voice totals instead of going through the sessions
+    
+    Returns:
+        The users and their time, most first
+    """
+    if use_totals:
+        last_week = voice_totals.week_start(time.time()) - voice_totals.WEEK_SECONDS
+        rows = db_stuff.stream_from_db(voice_totals.TOTALS_COLLECTION, {"week": last_week}, sort_by="seconds", direction="desc", limit=5)
+        return [UserVoiceStats(user_id=row["user_id"], total_seconds=row["seconds"]) async for row in rows if row["seconds"] > 0]
+    
     sessions = await all_sessions_this_week(skip_cache)
     stats: dict[str, UserVoiceStats] = {}
     for session in sessions:
@@ -776,3 +488,61 @@ async def voice_activity_this_week(skip_cache: bool = False) -> list[UserVoiceSt
         stats[user_id] = add_time_stats(user_stat, session["duration_seconds"])
     
     return sorted(stats.values(), key=lambda x: x["total_seconds"], reverse=True)[:5]
+
+
+async def channel_occupancy(
+        ctx: CContext,
+        channel: discord.VoiceChannel,
+        active_sessions: Mapping[int, Mapping[str, Any]],
+        start: float,
+        end: float | None = None,
+    ) -> None:
+    """
+    Send who was in a voice channel at a moment, or during a range of time with how long each user was there.
+    
+    Args:
+        ctx: Command context
+        channel: The voice channel
+        active_sessions: The sessions of the users in voice now by user ID, with the channel_id and joined_at of each,
+            they aren't saved until the users leave
+        start: UNIX timestamp of the moment, or the start of the range
+        end: UNIX timestamp of the end of the range, None for just the moment
+    """
+    index = await get_voice_index()
+    channel_id = str(channel.id)
+    now = time.time()
+    # The users in voice now count as sessions running until now
+    sessions: list[Mapping[str, Any]] = [
+        {
+            "user_id":          str(user_id),
+            "channel_id":       channel_id,
+            "duration_seconds": int(now - active["joined_at"].timestamp()),
+            "timestamp":        int(now),
+        }
+        for user_id, active in active_sessions.items()
+        if active["channel_id"] == channel_id
+    ]
+    
+    seconds: Mapping[str, int | None]
+    if end is None:
+        sessions = [session for session in sessions if session["timestamp"] - session["duration_seconds"] <= start <= now]
+        sessions += index.in_channel_at(channel_id, start) if index is not None else []
+        seconds = dict.fromkeys(session["user_id"] for session in sessions)
+        heading = f"In {channel.mention} at <t:{int(start)}:f>"
+    else:
+        sessions += index.in_channel_during(channel_id, start, end) if index is not None else []
+        seconds = {user_id: user_seconds for user_id, user_seconds in seconds_by_user(sessions, start, end).items() if user_seconds > 0}
+        heading = f"In {channel.mention} from <t:{int(start)}:f> to <t:{int(end)}:f>"
+    
+    if not seconds:
+        await ctx.send(f"{heading}: nobody")
+        return
+    
+    names = await user_ids_to_display_names([int(user_id) for user_id in seconds], ctx.bot)
+    lines = [
+        f"{names[int(user_id)]}: {format_duration(user_seconds)}" if user_seconds is not None else names[int(user_id)]
+        for user_id, user_seconds in list(seconds.items())[:OCCUPANCY_MAX_USERS]
+    ]
+    if len(seconds) > OCCUPANCY_MAX_USERS:
+        lines.append(f"...and {len(seconds) - OCCUPANCY_MAX_USERS} more")
+    await ctx.send(f"{heading}:\n" + "\n".join(lines))
@@ -0,0 +1,173 @@
+"""
+Index of voice sessions by time, for questions like who was in a channel at a given moment.
+Kept free of Discord and database imports like voice_stats.
+
+Each channel's and each user's sessions are kept in an interval tree, so finding the sessions at a moment or
+during a range takes O(log n + matches) instead of going through every session.
+"""
+import bisect
+import collections
+import math
+import time
+from collections.abc import Iterable, Iterator, Mapping
+from typing import Any, Final
+
+from command_utils.analysis.voice_sweep import session_bounds
+
+# Added intervals wait unsorted until there are more than this many, or the square root of the sorted ones if more
+MIN_PENDING: Final[int] = 32
+
+
+class IntervalTree[T]:
+    """
+    Half-open intervals with an item each, searchable by the time they cover.
+    
+    The intervals are sorted by start, with a segment tree over them holding the latest end under each node.
+    A search bisects to the intervals starting early enough, then only descends into nodes whose latest end is
+    late enough. Added intervals wait in an unsorted list that searches go through, and are sorted in once it
+    grows past the square root of the sorted ones, so adding stays cheap without making searches linear.
+    """
+    
+    def __init__(self, intervals: Iterable[tuple[int, int, T]] = ()):
+        self._starts: list[int] = []
+        self._ends: list[int] = []
+        self._items: list[T] = []
+        self._leaves: int = 1
+        self._ends_follow_starts: bool = True  # No interval ends before it starts, the usual case
+        self._latest_end: list[float] = []  # Node i has children 2i and 2i + 1, the leaves start at self._leaves
+        self._pending: list[tuple[int, int, T]] = list(intervals)
+        self._rebuild()
+    
+    def __len__(self) -> int:
+        return len(self._starts) + len(self._pending)
+    
+    def _rebuild(self) -> None:
+        intervals = sorted([*zip(self._starts, self._ends, self._items, strict=True), *self._pending], key=lambda interval: interval[0])
+        self._pending = []
+        self._starts = [start for start, _, _ in intervals]
+        self._ends = [end for _, end, _ in intervals]
+        self._items = [item for _, _, item in intervals]
+        self._ends_follow_starts = all(end >= start for start, end, _ in intervals)
+        
+        self._leaves = 1 << max(len(intervals) - 1, 0).bit_length()
+        self._latest_end = [-math.inf] * (2 * self._leaves)
+        self._latest_end[self._leaves:self._leaves + len(intervals)] = self._ends
+        for node in range(self._leaves - 1, 0, -1):
+            self._latest_end[node] = max(self._latest_end[2 * node], self._latest_end[2 * node + 1])
+    
+    def add(self, start: int, end: int, item: T) -> None:
+        self._pending.append((start, end, item))
+        if len(self._pending) > max(MIN_PENDING, math.isqrt(len(self._starts))):
+            self._rebuild()
+    
+    def _search(self, before_position: int, ending_after: float) -> Iterator[T]:
+        """The items of the sorted intervals before a position that end after a time, in order of start"""
+        stack: list[tuple[int, int, int]] = [(1, 0, self._leaves)]  # Node, its first position and the position after its last
+        while stack:
+            node, first, after = stack.pop()
+            if first >= before_position or self._latest_end[node] <= ending_after:
+                continue
+            if node >= self._leaves:
+                yield self._items[first]
+                continue
+            middle = (first + after) // 2
+            stack.append((2 * node + 1, middle, after))
+            stack.append((2 * node, first, middle))
+    
+    def at(self, moment: float) -> list[T]:
+        """The items of the intervals covering a moment"""
+        found = list(self._search(bisect.bisect_right(self._starts, moment), moment))
+        found.extend(item for start, end, item in self._pending if start <= moment < end)
+        return found
+    
+    def overlapping(self, start: float, end: float) -> list[T]:
+        """The items of the intervals sharing any time with [start, end)"""
+        starting_before_end = bisect.bisect_left(self._starts, end)
+        if self._ends_follow_starts:
+            # The intervals starting within the range all end after its start, only the earlier ones need the tree
+            starting_within = min(bisect.bisect_right(self._starts, start), starting_before_end)
+            found = list(self._search(starting_within, start))
+            found += self._items[starting_within:starting_before_end]
+        else:
+            found = list(self._search(starting_before_end, start))
+        found.extend(item for item_start, item_end, item in self._pending if item_start < end and item_end > start)
+        return found
+
+
+def clipped_seconds(session: Mapping[str, Any], start: float, end: float) -> int:
+    """The seconds of a timed session within [start, end)"""
+    session_start, session_end = session_bounds(session)
+    return max(int(min(session_end, end) - max(session_start, start)), 0)
+
+
+class VoiceIndex:
+    """
+    Voice sessions in interval trees per channel, per user and all together,
+    with the total seconds per user, per channel and per user in each channel.
+    Sessions without a timestamp can't be placed in time, so they only count towards the totals.
+    """
+    
+    def __init__(self, sessions: Iterable[Mapping[str, Any]] = ()):
+        self.built_at: float = time.monotonic()
+        self.user_seconds: collections.Counter[str] = collections.Counter()
+        self.channel_seconds: collections.Counter[str] = collections.Counter()
+        self.user_channel_seconds: collections.Counter[tuple[str, str]] = collections.Counter()
+        
+        by_channel: dict[str, list[tuple[int, int, Mapping[str, Any]]]] = {}
+        by_user: dict[str, list[tuple[int, int, Mapping[str, Any]]]] = {}
+        everyone: list[tuple[int, int, Mapping[str, Any]]] = []
+        for session in sessions:
+            self._count(session)
+            if "timestamp" not in session:
+                continue
+            interval = (*session_bounds(session), session)
+            by_channel.setdefault(session["channel_id"], []).append(interval)
+            by_user.setdefault(session["user_id"], []).append(interval)
+            everyone.append(interval)
+        
+        self.channels: dict[str, IntervalTree[Mapping[str, Any]]] = {key: IntervalTree(intervals) for key, intervals in by_channel.items()}
+        self.users: dict[str, IntervalTree[Mapping[str, Any]]] = {key: IntervalTree(intervals) for key, intervals in by_user.items()}
+        self.everyone: IntervalTree[Mapping[str, Any]] = IntervalTree(everyone)
+    
+    def _count(self, session: Mapping[str, Any]) -> None:
+        user_id, channel_id, seconds = session["user_id"], session["channel_id"], session["duration_seconds"]
+        self.user_seconds[user_id] += seconds
+        self.channel_seconds[channel_id] += seconds
+        self.user_channel_seconds[user_id, channel_id] += seconds
+    
+    def add(self, session: Mapping[str, Any]) -> None:
+        """Index a session saved after the index was built"""
+        self._count(session)
+        if "timestamp" not in session:
+            return
+        start, end = session_bounds(session)
+        self.channels.setdefault(session["channel_id"], IntervalTree()).add(start, end, session)
+        self.users.setdefault(session["user_id"], IntervalTree()).add(start, end, session)
+        self.everyone.add(start, end, session)
+    
+    def in_channel_at(self, channel_id: str, moment: float) -> list[Mapping[str, Any]]:
+        """The sessions in a channel at a moment"""
+        tree = self.channels.get(channel_id)
+        return tree.at(moment) if tree is not None else []
+    
+    def in_channel_during(self, channel_id: str, start: float, end: float) -> list[Mapping[str, Any]]:
+        """The sessions in a channel at any time during [start, end)"""
+        tree = self.channels.get(channel_id)
+        return tree.overlapping(start, end) if tree is not None else []
+    
+    def user_during(self, user_id: str, start: float, end: float) -> list[Mapping[str, Any]]:
+        """The sessions of a user at any time during [start, end)"""
+        tree = self.users.get(user_id)
+        return tree.overlapping(start, end) if tree is not None else []
+    
+    def during(self, start: float, end: float) -> list[Mapping[str, Any]]:
+        """Every session at any time during [start, end)"""
+        return self.everyone.overlapping(start, end)
+
+
+def seconds_by_user(sessions: Iterable[Mapping[str, Any]], start: float, end: float) -> dict[str, int]:
+    """The seconds each user spent within [start, end) in timed sessions, most first"""
+    seconds: collections.Counter[str] = collections.Counter()
+    for session in sessions:
+        seconds[session["user_id"]] += clipped_seconds(session, start, end)
+    return dict(seconds.most_common())
@@ -0,0 +1,291 @@
+"""
+Voice session statistics. Kept free of Discord and database imports so they can run in worker processes.
+"""
+import datetime
+from collections import Counter
+from collections.abc import Collection
+from statistics import median
+from typing import Any, NotRequired, TypedDict, TypeVar
+
+from command_utils.analysis.voice_sweep import SessionSweep, companion_seconds, user_pair_seconds
+
+
+class DBVoiceSession(TypedDict):
+    user_id: str
+    channel_id: str
+    duration_seconds: int
+    _id: Any  # The database internal ID, type depends on the database
+    timestamp: NotRequired[int]
+
+
+class UserVoiceStats(TypedDict):
+    user_id: str
+    total_seconds: int
+
+
+class ChannelVoiceStats(TypedDict):
+    channel_id: str
+    total_seconds: int
+
+
+class CompanionStats(TypedDict):
+    user_id: str
+    total_seconds: int
+
+
+class UserVoiceAnalysisResult(TypedDict):
+    user_id: str
+    total_seconds: int
+    active_channel_lb: list[ChannelVoiceStats]
+    top_companions: list[CompanionStats]
+    avg_session_duration: int
+    total_sessions: int
+    avg_users_per_session: float
+    median_session_duration: int
+    peak_activity_hour: NotRequired[int]
+    favorite_day: NotRequired[str]
+
+
+class DuoStats(TypedDict):
+    user_id_1: str
+    user_id_2: str
+    total_seconds: int
+
+
+class ChannelPeakStats(TypedDict):
+    channel_id: str
+    peak_users: int  # The most sessions running in the channel at once
+
+
+class WeeklyActiveStats(TypedDict):
+    this_week: int
+    last_week: int
+    activity_ratio: float  # this_week / total_users
+
+
+class VoiceAnalysisResult(TypedDict):
+    total_seconds: int
+    total_users: int
+    active_users_lb: list[UserVoiceStats]
+    active_channels_lb: list[ChannelVoiceStats]
+    best_duo: NotRequired[DuoStats]
+    avg_users_per_session: NotRequired[float]
+    total_sessions: NotRequired[int]
+    avg_session_duration: NotRequired[int]
+    median_session_duration: NotRequired[int]
+    weekly_active: NotRequired[WeeklyActiveStats]
+    channel_peaks: NotRequired[list[ChannelPeakStats]]
+
+T = TypeVar("T", UserVoiceStats, ChannelVoiceStats)
+
+def add_time_stats[T: (UserVoiceStats, ChannelVoiceStats)](stats: T, seconds: int) -> T:
+    stats["total_seconds"] = stats.get("total_seconds", 0) + seconds
+    return stats
+
+
+def compute_voice_statistics(
+        sessions: list[DBVoiceSession],
+        total_seconds_including_left: int,
+        include_left: bool,
+        member_ids: Collection[int] | None,
+        channel_ids: Collection[int] | None,
+        now_timestamp: float,
+    ) -> VoiceAnalysisResult:
+    """
+    Calculate the server wide voice statistics from the valid sessions.
+    
+    Args:
+        sessions: The valid, merged voice sessions
+        total_seconds_including_left: Total duration of all sessions, including users who have left
+        include_left: Whether to include users who have left the server
+        member_ids: IDs of the users still in the server, None to count every user
+        channel_ids: IDs of the channels still in the server, None to count every channel
+        now_timestamp: The current UNIX timestamp, the weekly activity is relative to it
+    
+    Returns:
+        Dictionary containing voice statistics
+    """
+    total_seconds: int = 0
+    # Calculate user statistics
+    user_stats: dict[str, UserVoiceStats] = {}
+    channel_stats: dict[str, ChannelVoiceStats] = {}
+    for session in sessions:
+        user_id = session["user_id"]
+        if member_ids is not None and int(user_id) not in member_ids:
+            continue
+        
+        user_stat: UserVoiceStats = user_stats.get(user_id, {"user_id": user_id, "total_seconds": 0})
+        user_stats[user_id] = add_time_stats(user_stat, session["duration_seconds"])
+        total_seconds += session["duration_seconds"]
+        
+        channel_id = session["channel_id"]
+        if channel_ids is not None and int(channel_id) not in channel_ids:
+            continue
+        
+        channel_stat: ChannelVoiceStats = channel_stats.get(channel_id, {"channel_id": channel_id, "total_seconds": 0})
+        channel_stats[channel_id] = add_time_stats(channel_stat, session["duration_seconds"])
+    
+    # Sort statistics
+    top_users: list[UserVoiceStats] = sorted(
+            [UserVoiceStats(user_id=user_id, total_seconds=data["total_seconds"])
+             for user_id, data in user_stats.items()],
+            key=lambda x: x["total_seconds"],
+            reverse=True,
+    )
+    
+    top_channels: list[ChannelVoiceStats] = sorted(
+            [ChannelVoiceStats(channel_id=channel_id, total_seconds=data["total_seconds"])
+             for channel_id, data in channel_stats.items()],
+            key=lambda x: x["total_seconds"],
+            reverse=True,
+    )
+    
+    # Best duo calculation
+    timed_sessions = [s for s in sessions if "timestamp" in s]
+    sweep = SessionSweep(sessions)
+    duo_seconds = user_pair_seconds(sweep)
+    
+    best_duo: DuoStats | None = None
+    if duo_seconds:
+        best_pair = max(duo_seconds, key=lambda k: duo_seconds[k])
+        best_duo = DuoStats(user_id_1=best_pair[0], user_id_2=best_pair[1], total_seconds=duo_seconds[best_pair])
+    
+    # Average users per session and total sessions
+    # Average users per session = average number of concurrent users when a session starts
+    total_session_count = len(sessions)
+    concurrency = sweep.concurrency()
+    avg_users_per_session = sum(concurrency.values()) / len(concurrency) if concurrency else 1.0
+    
+    channel_peaks: list[ChannelPeakStats] = sorted(
+            [ChannelPeakStats(channel_id=channel_id, peak_users=peak)
+             for channel_id, peak in sweep.peak_concurrency().items()
+             if channel_ids is None or int(channel_id) in channel_ids],
+            key=lambda x: x["peak_users"],
+            reverse=True,
+    )
+    
+    # Average and median session duration
+    session_durations = [s["duration_seconds"] for s in sessions]
+    avg_session_duration = sum(session_durations) // len(session_durations) if session_durations else 0
+    median_session_duration = int(median(session_durations)) if session_durations else 0
+    
+    # Weekly unique active users
+    now = datetime.datetime.fromtimestamp(now_timestamp, datetime.UTC)
+    one_week_ago = now - datetime.timedelta(days=7)
+    two_weeks_ago = now - datetime.timedelta(days=14)
+    this_week_users: set[str] = set()
+    last_week_users: set[str] = set()
+    for s in timed_sessions:
+        session_time = datetime.datetime.fromtimestamp(s["timestamp"], datetime.UTC)
+        if session_time >= one_week_ago:
+            this_week_users.add(s["user_id"])
+        elif session_time >= two_weeks_ago:
+            last_week_users.add(s["user_id"])
+    
+    total_user_count = len(user_stats) if user_stats else 1
+    weekly_active = WeeklyActiveStats(
+            this_week=len(this_week_users),
+            last_week=len(last_week_users),
+            activity_ratio=len(this_week_users) / total_user_count,
+    )
+    
+    result_dict = VoiceAnalysisResult(
+            total_seconds=total_seconds_including_left if include_left else total_seconds,
+            total_users=len(user_stats),
+            active_users_lb=top_users,
+            active_channels_lb=top_channels,
+            total_sessions=total_session_count,
+            avg_users_per_session=avg_users_per_session,
+            avg_session_duration=avg_session_duration,
+            median_session_duration=median_session_duration,
+            weekly_active=weekly_active,
+            channel_peaks=channel_peaks,
+    )
+    if best_duo:
+        result_dict["best_duo"] = best_duo
+    
+    return result_dict
+
+
+def compute_user_voice_statistics(sessions: list[DBVoiceSession], user_id: str) -> UserVoiceAnalysisResult | None:
+    """
+    Calculate the voice statistics of a specific user from the valid sessions.
+    
+    Args:
+        sessions: The valid, merged voice sessions
+        user_id: Discord user ID
+    
+    Returns:
+        Dictionary containing user voice statistics or None if the user has no sessions
+    """
+    # Filter sessions for this user
+    user_sessions = [s for s in sessions if s["user_id"] == user_id]
+    
+    if not user_sessions:
+        return None
+    
+    # Calculate total time
+    total_seconds = sum(s["duration_seconds"] for s in user_sessions)
+    
+    # Calculate per-channel stats
+    channel_stats: dict[str, ChannelVoiceStats] = {}
+    for session in user_sessions:
+        channel_id = session["channel_id"]
+        channel_stat: ChannelVoiceStats = channel_stats.get(channel_id, {"channel_id": channel_id, "total_seconds": 0})
+        channel_stats[channel_id] = add_time_stats(channel_stat, session["duration_seconds"])
+    
+    # Sort channels by time
+    top_channels = sorted(
+            [ChannelVoiceStats(channel_id=channel_id, total_seconds=data["total_seconds"])
+             for channel_id, data in channel_stats.items()],
+            key=lambda x: x["total_seconds"],
+            reverse=True,
+    )
+    
+    # Calculate top companions (who they spent the most time with)
+    # Only consider sessions that have a timestamp
+    timed_user_sessions = [s for s in user_sessions if "timestamp" in s]
+    sweep = SessionSweep(sessions)
+    companions = companion_seconds(sweep, user_id)
+    
+    top_companions = sorted(
+            [CompanionStats(user_id=uid, total_seconds=secs) for uid, secs in companions.items()],
+            key=lambda x: x["total_seconds"],
+            reverse=True,
+    )
+    
+    # Session duration stats
+    avg_session_duration = total_seconds // len(user_sessions) if user_sessions else 0
+    median_session_duration = int(median([s["duration_seconds"] for s in user_sessions])) if user_sessions else 0
+    total_sessions = len(user_sessions)
+    
+    # Average users per session for this user
+    user_concurrency = sweep.concurrency(user_id)
+    avg_users_per_session = sum(user_concurrency.values()) / len(user_concurrency) if user_concurrency else 1.0
+    
+    # Peak activity hour and favorite day (only from timed sessions)
+    result_dict = UserVoiceAnalysisResult(
+            user_id=user_id,
+            total_seconds=total_seconds,
+            active_channel_lb=top_channels,
+            top_companions=top_companions,
+            avg_session_duration=avg_session_duration,
+            total_sessions=total_sessions,
+            avg_users_per_session=avg_users_per_session,
+            median_session_duration=median_session_duration,
+    )
+    
+    if timed_user_sessions:
+        hour_counter: Counter[int] = Counter()
+        day_counter: Counter[int] = Counter()
+        for s in timed_user_sessions:
+            start_ts = s["timestamp"] - s["duration_seconds"]
+            start_dt = datetime.datetime.fromtimestamp(start_ts, tz=datetime.UTC)
+            hour_counter[start_dt.hour] += s["duration_seconds"]
+            day_counter[start_dt.weekday()] += s["duration_seconds"]
+        
+        result_dict["peak_activity_hour"] = hour_counter.most_common(1)[0][0]
+        day_names = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+        result_dict["favorite_day"] = day_names[day_counter.most_common(1)[0][0]]
+    
+    return result_dict
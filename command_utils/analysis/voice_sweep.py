@@ -0,0 +1,135 @@
+"""
+Sweep line over voice sessions, for the statistics that compare sessions with each other.
+Kept free of Discord and database imports like voice_stats, which uses it, so it can run in worker processes.
+
+Sessions are only compared within a channel. Each channel's sessions are sorted by start once, then swept
+keeping the sessions still running in a heap ordered by end, so a session is only compared with the sessions
+it overlaps: O(n log n + overlaps) instead of comparing every pair of sessions.
+"""
+import bisect
+import heapq
+from collections.abc import Iterator, Mapping, Sequence
+from typing import Any
+
+
+def session_bounds(session: Mapping[str, Any]) -> tuple[int, int]:
+    """The start and end of a timed session, which is timestamped when it ends"""
+    return session["timestamp"] - session["duration_seconds"], session["timestamp"]
+
+
+class SessionSweep:
+    """
+    The timed sessions of a list grouped by channel and sorted by start.
+    Sessions are identified by their index in the list, sessions without a timestamp are left out.
+    """
+    
+    def __init__(self, sessions: Sequence[Mapping[str, Any]]):
+        self.sessions: Sequence[Mapping[str, Any]] = sessions
+        self.starts: list[int] = [0] * len(sessions)
+        self.ends: list[int] = [0] * len(sessions)
+        self.channels: dict[str, list[int]] = {}
+        for index, session in enumerate(sessions):
+            if "timestamp" not in session:
+                continue
+            self.starts[index], self.ends[index] = session_bounds(session)
+            self.channels.setdefault(session["channel_id"], []).append(index)
+        
+        for indices in self.channels.values():
+            indices.sort(key=lambda index: self.starts[index])
+    
+    def overlaps(self, user_id: str | None = None) -> Iterator[tuple[int, int, int]]:
+        """
+        Every pair of sessions in the same channel that overlap by more than zero seconds.
+        
+        Args:
+            user_id: Only pairs of one of this user's sessions and another user's session, None for every pair
+        
+        Returns:
+            The two sessions as (lower index, higher index), and the seconds they overlap
+        """
+        sessions, starts, ends = self.sessions, self.starts, self.ends
+        for indices in self.channels.values():
+            if user_id is not None and all(sessions[index]["user_id"] != user_id for index in indices):
+                continue
+            
+            # (end, index) of the sessions started so far that may still run, the user's and everyone else's
+            own: list[tuple[int, int]] = []
+            others: list[tuple[int, int]] = []
+            for index in indices:
+                start, end = starts[index], ends[index]
+                for running in (own, others):
+                    while running and running[0][0] <= start:
+                        heapq.heappop(running)
+                if end <= start:
+                    continue
+                
+                is_own = user_id is not None and sessions[index]["user_id"] == user_id
+                for other_end, other in others if user_id is None or is_own else own:
+                    yield min(index, other), max(index, other), min(end, other_end) - start
+                heapq.heappush(own if is_own else others, (end, index))
+    
+    def concurrency(self, user_id: str | None = None) -> dict[int, int]:
+        """
+        The number of sessions running in the channel when each session started, itself included.
+        A session counts as running from its start until just before its end.
+        
+        Args:
+            user_id: Only count for this user's sessions, None for every session
+        
+        Returns:
+            Mapping of session index to the number of sessions
+        """
+        counts: dict[int, int] = {}
+        for indices in self.channels.values():
+            counted = indices if user_id is None else [index for index in indices if self.sessions[index]["user_id"] == user_id]
+            if not counted:
+                continue
+            
+            # Sessions without a positive duration are never running, so they only count themselves
+            lasting = [index for index in indices if self.ends[index] > self.starts[index]]
+            sorted_starts = [self.starts[index] for index in lasting]
+            sorted_ends = sorted(self.ends[index] for index in lasting)
+            for index in counted:
+                start, end = self.starts[index], self.ends[index]
+                # Every lasting session that started by now and hasn't ended, a session ending by now also started by now
+                running = bisect.bisect_right(sorted_starts, start) - bisect.bisect_right(sorted_ends, start)
+                counts[index] = running + (end <= start)
+        return counts
+    
+    def peak_concurrency(self) -> dict[str, int]:
+        """The most sessions running in each channel at once"""
+        concurrency = self.concurrency()
+        return {channel_id: max(concurrency[index] for index in indices) for channel_id, indices in self.channels.items()}
+
+
+def user_pair_seconds(sweep: SessionSweep) -> dict[tuple[str, str], int]:
+    """
+    The seconds every two users spent in the same channel together, keyed by their sorted IDs.
+    Pairs are ordered by their first overlapping sessions in list order, the order comparing every session
+    with every later one finds them in, so ties between pairs resolve the same way.
+    """
+    seconds: dict[tuple[str, str], int] = {}
+    first_found: dict[tuple[str, str], tuple[int, int]] = {}
+    for first, second, overlap in sweep.overlaps():
+        user_1, user_2 = sweep.sessions[first]["user_id"], sweep.sessions[second]["user_id"]
+        if user_1 == user_2:
+            continue
+        pair = (user_1, user_2) if user_1 < user_2 else (user_2, user_1)
+        seconds[pair] = seconds.get(pair, 0) + overlap
+        first_found[pair] = min(first_found.get(pair, (first, second)), (first, second))
+    return {pair: seconds[pair] for pair in sorted(seconds, key=first_found.__getitem__)}
+
+
+def companion_seconds(sweep: SessionSweep, user_id: str) -> dict[str, int]:
+    """
+    The seconds a user spent in the same channel as each other user.
+    Ordered by the first overlap, going through the user's sessions in list order and each one's companions in list order.
+    """
+    seconds: dict[str, int] = {}
+    first_found: dict[str, tuple[int, int]] = {}
+    for first, second, overlap in sweep.overlaps(user_id):
+        own, other = (first, second) if sweep.sessions[first]["user_id"] == user_id else (second, first)
+        companion = sweep.sessions[other]["user_id"]
+        seconds[companion] = seconds.get(companion, 0) + overlap
+        first_found[companion] = min(first_found.get(companion, (own, other)), (own, other))
+    return {companion: seconds[companion] for companion in sorted(seconds, key=first_found.__getitem__)}
@@ -0,0 +1,123 @@
+"""
+Word statistics of message content. Kept free of Discord and database imports so it can run in worker processes
+"""
+import collections
+import string
+from typing import Final, TypedDict
+
+
+class WordStats(TypedDict):
+    most_common_word: str
+    most_common_word_count: int
+    top_3_words: list[tuple[str, int]]
+    total_unique_words: int
+    average_length: float
+    vocabulary_diversity: float
+
+
+ARTICLES: Final[list[str]] = ["the", "a", "an", "this", "that", "these", "those"]
+PRONOUNS: Final[list[str]] = ["i", "you", "we", "they", "he", "she", "it", "me", "my", "your", "our", "their"]
+AUX_VERBS: Final[list[str]] = ["is", "am", "are", "was", "were", "be", "been", "being", "do", "does", "did", "have", "has", "had"]
+PREPOSITIONS: Final[list[str]] = ["to", "of", "in", "on", "at", "for", "from", "with", "by", "about", "as", "into", "over", "under"]
+CONJUNCTIONS: Final[list[str]] = ["and", "or", "but", "so", "if", "because", "while"]
+NOT_MEANINGFUL: Final[list[str]] = ["yeah", "yes", "no", "ok", "okay", "lol", "lmao", "haha", "uh", "um", "hmm"]
+EXCLUDED_WORDS: Final[set[str]] = set(ARTICLES + PRONOUNS + AUX_VERBS + PREPOSITIONS + CONJUNCTIONS + NOT_MEANINGFUL)
+PUNCT_SET: Final[set[str]] = set(string.punctuation)
+
+
+def is_valid_word(word: str):
+    return (
+            len(word) > 2
+            and not word.startswith("https://")
+            and not (word.startswith("<@") and word.endswith(">"))
+            and not all(c in PUNCT_SET for c in word)
+            and word not in EXCLUDED_WORDS
+    )
+
+
+def split_words(content: str) -> list[str]:
+    """The normalised words of a message, as counted by the word statistics"""
+    return [word.lower().strip() for word in content.split() if word]
+
+
+def analyse_word_stats(content_list: list[str]) -> WordStats | None:
+    """
+    Analyse word statistics from a list of message content.
+    
+    Args:
+        content_list: List of message content strings
+    
+    Returns:
+        Dictionary containing word statistics
+    """
+    return analyse_weighted_word_stats(content_list, [1] * len(content_list))
+
+
+def analyse_weighted_word_stats(contents: list[str], counts: list[int]) -> WordStats | None:
+    """
+    Analyse word statistics from distinct message contents and how many times each was sent,
+    so repeated messages are only split once. Gives the same result as analyse_word_stats on the expanded list.
+    
+    Args:
+        contents: Distinct message content strings, in order of first appearance
+        counts: How many messages had each content
+    
+    Returns:
+        Dictionary containing word statistics
+    """
+    if not contents:
+        return None
+    
+    counter = WordStatsCounter()
+    for content, count in zip(contents, counts, strict=True):
+        counter.add_text(content, count)
+    return counter.stats()
+
+
+class WordStatsCounter:
+    """
+    Exact word statistics built up one message at a time, for callers that can't hold every message at once.
+    Memory grows with the vocabulary, not the number of messages.
+    """
+    
+    def __init__(self):
+        self.total_words: int = 0
+        self.word_count: collections.Counter[str] = collections.Counter()
+        self.unique_words: set[str] = set()
+    
+    def add_text(self, content: str, count: int = 1) -> None:
+        """Count a message text, sent ``count`` times"""
+        # Extract and normalise all words
+        words = split_words(content)
+        self.total_words += len(words) * count
+        self.unique_words.update(words)
+        interesting_words = [word for word in words if is_valid_word(word)]
+        if count == 1:
+            self.word_count.update(interesting_words)
+        else:
+            for word in interesting_words:
+                self.word_count[word] += count
+    
+    def stats(self) -> WordStats | None:
+        """The statistics of the texts counted so far, None if none had a valid word"""
+        if not self.total_words or not self.word_count:
+            return None
+        
+        # Calculate statistics
+        top_3 = self.word_count.most_common(3)
+        most_common_word, most_common_count = top_3[0]
+        
+        # Calculate average word length
+        avg_length = sum(len(word) for word in self.unique_words) / len(self.unique_words)
+        
+        # Calculate vocabulary diversity: unique words / total words * 100
+        vocabulary_diversity = (len(self.unique_words) / self.total_words) * 100
+        
+        return WordStats(
+                most_common_word=most_common_word,
+                most_common_word_count=most_common_count,
+                top_3_words=top_3,
+                total_unique_words=len(self.unique_words),
+                average_length=avg_length,
+                vocabulary_diversity=vocabulary_diversity,
+        )
@@ -106,6 +106,28 @@ class CountingConfig(ConfigBase):
         self.last_counted_message_id = message_id
 
 
+@dataclass
+class AnalysisConfig(ConfigBase):
+    """Configuration for the message analysis commands"""
+    # "aggregate" computes statistics inside MongoDB, "local" in Python from the message store,
+    # "stream" in Python in one pass over a database cursor, without holding the messages in memory
+    backend: str = "aggregate"
+    rollups: bool = False  # Count messages from the daily rollups, enabled by the rebuild_rollups command
+    workers: int = 2  # Worker processes (or threads) running CPU heavy analysis
+    max_jobs: int = 2  # Analysis jobs allowed to run at once, further commands wait for a slot
+    job_timeout: float = 60.0  # Seconds before an analysis job is cancelled, 0 for no limit
+    use_processes: bool = True  # Run analysis jobs in worker processes, False to use threads
+    word_sketches: bool = False  # Estimate all time word statistics from bounded memory sketches, enabled by rebuild_word_sketch
+    voice_totals: bool = False  # Read the weekly voice leaderboard and time in channel from voice_totals, enabled by rebuild_voice_totals
+    cache_size: int = 64  # Analysis results kept until the data changes, least recently used first out, 0 to disable
+    cache_ttl: float = 300.0  # Seconds a cached analysis result is kept at most
+    
+    def __post_init__(self) -> None:
+        if self.backend not in ("aggregate", "local", "stream"):
+            logger.warning(f"Unknown analysis backend {self.backend}, using aggregate")
+            self.backend = "aggregate"
+
+
 @dataclass
 class BotConfig(ConfigBase):
     """Main bot configuration class"""
@@ -132,6 +154,7 @@ class BotConfig(ConfigBase):
     join_leave_log_channel_id: int = 0
     member_logs_channel_id: int = 0
     bot_logs_channel_id: int = 0
+    max_message_edits: int = 0  # Edits kept per message in the DB, older ones are dropped. 0 keeps every edit
     
     # User permissions
     admin_ids: set[int] = field(default_factory=set)
@@ -144,6 +167,7 @@ class BotConfig(ConfigBase):
     send_blacklist: BlacklistConfig = field(default_factory=BlacklistConfig)
     logging_channels: LoggingChannelsConfig = field(default_factory=LoggingChannelsConfig)
     reaction_roles: ReactionRolesConfig = field(default_factory=ReactionRolesConfig)
+    analysis: AnalysisConfig = field(default_factory=AnalysisConfig)
     
     # Dynamic properties (not saved to config)
     today: str | None = field(default=None, init=False)
@@ -181,6 +205,18 @@ class BotConfig(ConfigBase):
                 "message_id":    0,
                 "emoji_to_role": {}
             },
+            "analysis":                  {
+                "backend":       "aggregate",
+                "rollups":       False,
+                "workers":       2,
+                "max_jobs":      2,
+                "job_timeout":   60.0,
+                "use_processes": True,
+                "word_sketches": False,
+                "voice_totals":  False,
+                "cache_size":    64,
+                "cache_ttl":     300.0,
+            },
             
             "verified_roles":            [],
             "staff_role_id":             0,
@@ -208,6 +244,7 @@ class BotConfig(ConfigBase):
             "join_leave_log_channel_id": 0,
             "member_logs_channel_id":    0,
             "bot_logs_channel_id":       0,
+            "max_message_edits":         0,
         }
     
     @classmethod
@@ -231,6 +268,7 @@ class BotConfig(ConfigBase):
         config.join_leave_log_channel_id = data.get("join_leave_log_channel_id", config.join_leave_log_channel_id)
         config.member_logs_channel_id = data.get("member_logs_channel_id", config.member_logs_channel_id)
         config.bot_logs_channel_id = data.get("bot_logs_channel_id", config.bot_logs_channel_id)
+        config.max_message_edits = data.get("max_message_edits", config.max_message_edits)
         
         if "counting" in data:
             c = data["counting"]
@@ -286,6 +324,21 @@ class BotConfig(ConfigBase):
                     emoji_to_role=reaction_data.get("emoji_to_role", {})
             )
         
+        if "analysis" in data:
+            analysis_data = data["analysis"]
+            config.analysis = AnalysisConfig(
+                    backend=analysis_data.get("backend", "aggregate"),
+                    rollups=analysis_data.get("rollups", False),
+                    workers=analysis_data.get("workers", 2),
+                    max_jobs=analysis_data.get("max_jobs", 2),
+                    job_timeout=analysis_data.get("job_timeout", 60.0),
+                    use_processes=analysis_data.get("use_processes", True),
+                    word_sketches=analysis_data.get("word_sketches", False),
+                    voice_totals=analysis_data.get("voice_totals", False),
+                    cache_size=analysis_data.get("cache_size", 64),
+                    cache_ttl=analysis_data.get("cache_ttl", 300.0),
+            )
+        
         return config
     
     def to_dict(self) -> dict[str, Any]:
@@ -318,6 +371,18 @@ class BotConfig(ConfigBase):
                 "message_id":    self.reaction_roles.message_id,
                 "emoji_to_role": self.reaction_roles.emoji_to_role
             },
+            "analysis":                  {
+                "backend":       self.analysis.backend,
+                "rollups":       self.analysis.rollups,
+                "workers":       self.analysis.workers,
+                "max_jobs":      self.analysis.max_jobs,
+                "job_timeout":   self.analysis.job_timeout,
+                "use_processes": self.analysis.use_processes,
+                "word_sketches": self.analysis.word_sketches,
+                "voice_totals":  self.analysis.voice_totals,
+                "cache_size":    self.analysis.cache_size,
+                "cache_ttl":     self.analysis.cache_ttl,
+            },
             
             "verified_roles":            self.verified_roles,
             "staging":                   self.staging,
@@ -344,6 +409,7 @@ class BotConfig(ConfigBase):
             "join_leave_log_channel_id": self.join_leave_log_channel_id,
             "member_logs_channel_id":    self.member_logs_channel_id,
             "bot_logs_channel_id":       self.bot_logs_channel_id,
+            "max_message_edits":         self.max_message_edits,
         }
     
     def save(self, config_path: Path = Path("config.json")) -> None | str:
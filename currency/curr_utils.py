@@ -1,7 +1,12 @@
 import discord
 
 from currency.currency_types import Profile, ShopItem
-from utils import db_stuff
+from utils import db_indexes, db_stuff
+
+db_indexes.register_index("shop_items", [("item_name", 1)])
+db_indexes.register_index("currency", [("wallet", -1)])
+db_indexes.register_query("Shop item by name", "shop_items", {"item_name": ""})
+db_indexes.register_query("Top wallets", "currency", {}, sort=[("wallet", -1)])
 
 cached_profiles: dict[str, Profile] = {}
 
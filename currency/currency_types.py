@@ -14,10 +14,13 @@ import discord.ext.commands
 from command_utils.CContext import CContext
 from currency import collector
 from currency.curr_config import BASE_CREDIT_SCORE, BASE_FIRE_CHANCE, INCOME_TAX
-from utils import db_stuff, utils
+from utils import db_indexes, db_stuff, utils
 
 logger = logging.getLogger("discord")
 
+db_indexes.register_index("currency", [("user_id", 1)])
+db_indexes.register_query("Profile by user", "currency", {"user_id": "0"})
+
 
 def _is_invalid_db_item(item: list[str | int]) -> bool:
     logger.debug(f"Checking item: {item}")
@@ -13,14 +13,20 @@ from dotenv import load_dotenv
 
 import help_cmd
 from cogs import voice_events_utils
+from command_utils.analysis.charts import chart_renderer
+from command_utils.analysis.executor import analysis_executor
+from command_utils.analysis.result_cache import result_cache
 from command_utils.CContext import CContext, CoolBot
 from utils import db_stuff, utils
 
 load_dotenv()
 
 
-@atexit.register
 def on_exit() -> None:
+    analysis_executor.shutdown()
+    chart_renderer.shutdown()
+    utils.make_sync(db_stuff.flush_message_queue())
+    utils.make_sync(db_stuff.save_word_sketch())
     db_stuff.disable_connection()
     utils.make_sync(db_stuff.disconnect())
     utils.make_sync(bot.uptime_session.close() if bot.uptime_session else None)
@@ -42,11 +48,23 @@ def check_devs_reset(obj: Any) -> bool:
     
     return next(iter(obj)) == 0 and len(obj) == 1
 
+@bot.event
+async def setup_hook() -> None:
+    # Runs once before the first connection, unlike on_ready which runs again after every reconnect
+    analysis_config = bot.config.analysis
+    analysis_executor.configure(
+            analysis_config.workers, analysis_config.max_jobs, analysis_config.job_timeout, analysis_config.use_processes,
+    )
+    result_cache.configure(analysis_config.cache_size, analysis_config.cache_ttl)
+
 @bot.event
 async def on_ready() -> None:
     await load_extensions()
     utils.check_env_variables()
     utils.clean_up_APOD()
+    result_cache.membership_changed()  # Joins and leaves while disconnected weren't seen
+    if bot.config.analysis.word_sketches and db_stuff.word_sketch is None:
+        await db_stuff.load_word_sketch()
     
     logger.info(f"Loaded {len(bot.cogs)} cogs:")
     for cog in bot.cogs:
@@ -166,14 +184,17 @@ async def on_message(message: discord.Message) -> None:
 def ignore_hup(signum, frame) -> None:
     pass
 
-if sys.platform == "linux" or sys.platform == "linux2":
-    signal.signal(signal.SIGHUP, ignore_hup)
-
-# Run the bot
-token = os.getenv("TOKEN")
-if not isinstance(token, str):
-    raise TypeError("TOKEN environment variable not set.")
-
-bot.help_command = help_cmd.CustomHelpCommand()
-bot.run(token=token, reconnect=True, log_handler=None)
-sys.exit(bot.exit_code)
+# Analysis worker processes import this module too, only the bot process runs it
+if __name__ == "__main__":
+    atexit.register(on_exit)
+    if sys.platform == "linux" or sys.platform == "linux2":
+        signal.signal(signal.SIGHUP, ignore_hup)
+    
+    # Run the bot
+    token = os.getenv("TOKEN")
+    if not isinstance(token, str):
+        raise TypeError("TOKEN environment variable not set.")
+    
+    bot.help_command = help_cmd.CustomHelpCommand()
+    bot.run(token=token, reconnect=True, log_handler=None)
+    sys.exit(bot.exit_code)
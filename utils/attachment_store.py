@@ -0,0 +1,144 @@
+"""
+Streams Discord attachments into GridFS, storing each distinct file only once
+"""
+import asyncio
+import hashlib
+import logging
+from collections.abc import Collection, Mapping
+from typing import Any, Final
+
+import aiohttp
+import discord
+from gridfs import AsyncGridFSBucket
+from pymongo import ReturnDocument
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.database import AsyncDatabase
+
+from utils import db_indexes
+
+logger = logging.getLogger("discord")
+
+BUCKET_NAME: Final[str] = "attachments"
+# One document per distinct file, keyed by its SHA-256, with a reference count and the messages using it
+REFS_COLLECTION: Final[str] = "attachment_refs"
+CHUNK_SIZE: Final[int] = 255 * 1024  # GridFS default chunk size, so every network chunk fills one GridFS chunk
+
+# Shared by every message, so a burst of attachments can't open unbounded downloads and GridFS writes
+upload_semaphore: asyncio.Semaphore = asyncio.Semaphore(4)
+_session: aiohttp.ClientSession | None = None
+
+db_indexes.register_index(REFS_COLLECTION, [("uses.message_id", 1)])
+
+
+def _get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=300, sock_read=30))
+    return _session
+
+
+async def close_session() -> None:
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def store_attachment(db: AsyncDatabase[Mapping[str, Any]], message: discord.Message, attachment: discord.Attachment) -> bool:
+    """
+    Stream an attachment from the Discord CDN into GridFS, hashing it on the way.
+    If a file with the same content is already stored, the new copy is discarded and a reference is added instead.
+    :return: If the attachment was stored or referenced successfully.
+    """
+    async with upload_semaphore:
+        return await _stream_to_gridfs(db, message, attachment)
+
+
+async def _stream_to_gridfs(db: AsyncDatabase[Mapping[str, Any]], message: discord.Message, attachment: discord.Attachment) -> bool:
+    bucket = AsyncGridFSBucket(db, BUCKET_NAME, chunk_size_bytes=CHUNK_SIZE)
+    refs: AsyncCollection[Mapping[str, Any]] = db[REFS_COLLECTION]
+    grid_in = bucket.open_upload_stream(attachment.filename)
+    hasher = hashlib.sha256()
+    size: int = 0
+    
+    try:
+        async with _get_session().get(attachment.url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                hasher.update(chunk)
+                size += len(chunk)
+                await grid_in.write(chunk)
+    except Exception as e:
+        logger.error(f"Error downloading attachment {attachment.filename}: {e}")
+        await grid_in.abort()
+        return False
+    
+    digest: str = hasher.hexdigest()
+    use: dict[str, Any] = {
+        "message_id": str(message.id),
+        "author_id":  str(message.author.id),
+        "filename":   attachment.filename,
+        "timestamp":  message.created_at.timestamp(),
+    }
+    reference: dict[str, Any] = {"$inc": {"refcount": 1}, "$push": {"uses": use}}
+    
+    try:
+        if await refs.find_one({"_id": digest}, {"_id": 1}) is not None:
+            # Already stored, abort() removes the chunks written so far
+            await grid_in.abort()
+            await refs.update_one({"_id": digest}, reference)
+            logger.info(f"Attachment {attachment.filename} is a duplicate of {digest}, added a reference")
+            return True
+        
+        await grid_in.set("metadata", {"sha256": digest, "content_type": attachment.content_type, "size": size})
+        await grid_in.close()
+        previous = await refs.find_one_and_update(
+                {"_id": digest},
+                {**reference, "$setOnInsert": {"file_id": grid_in._id, "size": size, "content_type": attachment.content_type}},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
+        )
+        if previous is not None:
+            # Another upload of the same file finished first, keep theirs
+            await bucket.delete(grid_in._id)
+        
+        logger.info(f"Attachment saved successfully: {attachment.filename} ({size} bytes)")
+        return True
+    except Exception as e:
+        logger.error(f"Error saving attachment {attachment.filename}: {e}")
+        if not grid_in.closed:
+            await grid_in.abort()
+        return False
+
+
+async def release_attachments(db: AsyncDatabase[Mapping[str, Any]], message_ids: Collection[str]) -> int:
+    """
+    Drop the references the given messages hold, deleting files nothing refers to anymore.
+    :return: The number of files deleted.
+    """
+    if not message_ids:
+        return 0
+    
+    refs: AsyncCollection[Mapping[str, Any]] = db[REFS_COLLECTION]
+    bucket = AsyncGridFSBucket(db, BUCKET_NAME)
+    ids: list[str] = list(message_ids)
+    wanted: set[str] = set(ids)
+    deleted: int = 0
+    
+    async for ref in refs.find({"uses.message_id": {"$in": ids}}, {"uses.message_id": 1}):
+        released = sum(1 for use in ref["uses"] if use["message_id"] in wanted)
+        updated = await refs.find_one_and_update(
+                {"_id": ref["_id"]},
+                {"$inc": {"refcount": -released}, "$pull": {"uses": {"message_id": {"$in": ids}}}},
+                return_document=ReturnDocument.AFTER,
+        )
+        if updated is None or updated["refcount"] > 0:
+            continue
+        
+        # Only delete if no new reference was added in the meantime
+        result = await refs.delete_one({"_id": ref["_id"], "refcount": {"$lte": 0}})
+        if result.deleted_count:
+            await bucket.delete(updated["file_id"])
+            deleted += 1
+    
+    return deleted
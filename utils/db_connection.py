@@ -0,0 +1,228 @@
+"""
+Shared MongoDB connection with health checks, reconnect backoff and a circuit breaker
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from collections.abc import Awaitable, Callable, Mapping
+from dataclasses import dataclass
+from typing import Any, Literal, Self
+
+from pymongo.asynchronous.mongo_client import AsyncMongoClient
+from pymongo.server_api import ServerApi
+
+logger = logging.getLogger("discord")
+
+MongoClient = AsyncMongoClient[Mapping[str, Any]]
+ConnectListener = Callable[[MongoClient], Awaitable[None]]
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning(f"Invalid {name} value {value!r}, defaulting to {default}")
+        return default
+
+
+@dataclass(frozen=True)
+class PoolSettings:
+    """Connection pool tuning, overridable with the MONGO_* environment variables"""
+    max_pool_size: int = 50
+    min_pool_size: int = 0
+    max_connecting: int = 2
+    wait_queue_timeout_ms: int = 2000  # How long an operation waits for a free pooled connection
+    server_selection_timeout_ms: int = 5000
+    
+    @classmethod
+    def from_env(cls) -> Self:
+        return cls(
+                max_pool_size=_env_int("MONGO_MAX_POOL_SIZE", cls.max_pool_size),
+                min_pool_size=_env_int("MONGO_MIN_POOL_SIZE", cls.min_pool_size),
+                max_connecting=_env_int("MONGO_MAX_CONNECTING", cls.max_connecting),
+                wait_queue_timeout_ms=_env_int("MONGO_WAIT_QUEUE_TIMEOUT_MS", cls.wait_queue_timeout_ms),
+                server_selection_timeout_ms=_env_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", cls.server_selection_timeout_ms),
+        )
+
+
+def create_client(settings: PoolSettings) -> MongoClient:
+    return AsyncMongoClient(
+        host=os.getenv("MONGO_URI"),
+        server_api=ServerApi("1"),
+        serverSelectionTimeoutMS=settings.server_selection_timeout_ms,
+        maxPoolSize=settings.max_pool_size,
+        minPoolSize=settings.min_pool_size,
+        maxConnecting=settings.max_connecting,
+        waitQueueTimeoutMS=settings.wait_queue_timeout_ms,
+        tls=True,
+        tlsCertificateKeyFile="mongo_cert.pem"
+    )
+
+
+class ConnectionManager:
+    """
+    Owns the single MongoDB client and decides whether callers may use it.
+    
+    Only one connection attempt runs at a time and every concurrent caller awaits it. After a failed
+    attempt, a failed health ping or an operation losing the connection, the circuit opens: callers get
+    None straight away instead of each waiting out the server selection timeout, until an exponentially
+    growing backoff has passed.
+    A background task pings the server every ``health_interval`` seconds while connected, and probes
+    it once the backoff has passed while disconnected, so the circuit also closes without any traffic.
+    """
+    
+    def __init__(
+            self,
+            settings: PoolSettings | None = None,
+            health_interval: float = 30.0,
+            ping_timeout: float = 5.0,
+            base_backoff: float = 1.0,
+            max_backoff: float = 300.0,
+        ):
+        self._settings: PoolSettings | None = settings
+        self.health_interval: float = health_interval
+        self.ping_timeout: float = ping_timeout
+        self.base_backoff: float = base_backoff
+        self.max_backoff: float = max_backoff
+        self.enabled: bool = True
+        self._client: MongoClient | None = None
+        self._healthy: bool = False
+        self._failures: int = 0
+        self._retry_at: float = 0.0
+        self._probe: asyncio.Task[MongoClient | None] | None = None
+        self._monitor: asyncio.Task[None] | None = None
+        self._listeners: list[ConnectListener] = []
+    
+    @property
+    def settings(self) -> PoolSettings:
+        # Read lazily, the environment may not be loaded yet when the manager is created at import time
+        if self._settings is None:
+            self._settings = PoolSettings.from_env()
+        return self._settings
+    
+    @property
+    def state(self) -> Literal["closed", "open", "half-open"]:
+        """Circuit breaker state: closed while connected, open while backing off, half-open when a retry is due"""
+        if self._healthy:
+            return "closed"
+        if self._failures and time.monotonic() < self._retry_at:
+            return "open"
+        return "half-open"
+    
+    @property
+    def consecutive_failures(self) -> int:
+        return self._failures
+    
+    @property
+    def retry_in(self) -> float:
+        """Seconds until the next connection attempt is allowed"""
+        return max(0.0, self._retry_at - time.monotonic())
+    
+    def add_connect_listener(self, listener: ConnectListener) -> None:
+        """Run ``listener`` every time the connection is (re-)established"""
+        self._listeners.append(listener)
+    
+    async def get_client(self) -> MongoClient | None:
+        """Return the client if the DB is reachable, None if connections are disabled or the circuit is open"""
+        if not self.enabled:
+            logger.warning("Attempted to connect to MongoDB, but connection has been disabled.")
+            return None
+        
+        self._ensure_monitor()
+        if self._healthy and self._client is not None:
+            return self._client
+        if self.state == "open":
+            return None
+        
+        loop = asyncio.get_running_loop()
+        if self._probe is None or self._probe.done() or self._probe.get_loop() is not loop:
+            self._probe = loop.create_task(self._connect_once(), name="mongo-connect")
+        # Shielded so a caller being cancelled doesn't cancel the attempt for everyone else
+        return await asyncio.shield(self._probe)
+    
+    async def _connect_once(self) -> MongoClient | None:
+        if self._client is None:
+            logger.debug("Connecting to MongoDB...")
+            self._client = create_client(self.settings)
+        
+        try:
+            ping = await self._client.admin.command("ping")  # Bounded by the server selection timeout
+        except Exception as e:
+            self._record_failure(e)
+            return None
+        
+        logger.info(f"MongoDB connection established successfully: {ping}")
+        self._healthy = True
+        self._failures = 0
+        for listener in self._listeners:
+            try:
+                await listener(self._client)
+            except Exception as e:
+                logger.error(f"Error in MongoDB connect listener: {e}")
+        return self._client
+    
+    def mark_unhealthy(self, error: Exception) -> None:
+        """
+        Open the circuit after an operation lost the connection, so callers spool instead of each waiting out the
+        server selection timeout until the next health check notices.
+        Failures while the circuit is already open don't count again, the backoff only grows with failed attempts.
+        """
+        if self._healthy:
+            self._record_failure(error)
+    
+    def _record_failure(self, error: Exception) -> None:
+        self._healthy = False
+        self._failures += 1
+        delay = min(self.max_backoff, self.base_backoff * 2 ** min(self._failures - 1, 16))
+        delay *= random.uniform(0.5, 1.0)  # Jitter so reconnects from several processes don't line up
+        self._retry_at = time.monotonic() + delay
+        logger.error(f"MongoDB unreachable ({self._failures} consecutive failures), retrying in {delay:.1f}s: {error}")
+    
+    def _ensure_monitor(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._monitor is None or self._monitor.done() or self._monitor.get_loop() is not loop:
+            self._monitor = loop.create_task(self._run_health_checks(), name="mongo-health-check")
+    
+    async def _run_health_checks(self) -> None:
+        while self.enabled:
+            if not self._healthy:
+                await asyncio.sleep(max(self.retry_in, 1.0))
+                if self.enabled and not self._healthy:
+                    await self.get_client()
+                continue
+            
+            await asyncio.sleep(self.health_interval)
+            if not self._healthy or self._client is None:
+                continue
+            try:
+                await asyncio.wait_for(self._client.admin.command("ping"), self.ping_timeout)
+            except Exception as e:
+                self._record_failure(e)
+    
+    async def close(self) -> bool:
+        """
+        Stop the health checks and close the client.
+        :return: If there was no client, or it was closed successfully.
+        """
+        if self._monitor is not None and not self._monitor.done() and self._monitor.get_loop() is asyncio.get_running_loop():
+            self._monitor.cancel()
+        self._monitor = None
+        self._probe = None
+        self._healthy = False
+        
+        client = self._client
+        self._client = None
+        if client is None:
+            return True
+        try:
+            await client.close()
+            logger.info("MongoDB connection closed")
+            return True
+        except Exception as e:
+            logger.error(f"Error closing MongoDB connection: {e}")
+            return False
@@ -0,0 +1,93 @@
+"""
+Registry of the indexes and query patterns used on each MongoDB collection.
+
+Modules declare the indexes their queries need with register_index, and the queries worth
+checking with register_query. db_stuff creates every registered index when it connects.
+"""
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from typing import Any
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    """A single (possibly compound) index on a collection"""
+    collection: str
+    keys: tuple[tuple[str, int], ...]
+    unique: bool = False
+    
+    @property
+    def name(self) -> str:
+        return "_".join(f"{key}_{direction}" for key, direction in self.keys)
+
+
+@dataclass(frozen=True)
+class QueryPattern:
+    """A representative query, used to check which index serves it"""
+    name: str
+    collection: str
+    query: Mapping[str, Any] = field(hash=False)
+    sort: tuple[tuple[str, int], ...] = ()
+
+
+all_indexes: list[IndexSpec] = []
+all_query_patterns: list[QueryPattern] = []
+pending_indexes: list[IndexSpec] = []
+
+
+def register_index(collection: str, keys: list[tuple[str, int]], unique: bool = False) -> IndexSpec:
+    spec = IndexSpec(collection, tuple(keys), unique)
+    if spec in all_indexes:
+        return spec
+    
+    all_indexes.append(spec)
+    pending_indexes.append(spec)
+    return spec
+
+
+def register_query(name: str, collection: str, query: Mapping[str, Any], sort: list[tuple[str, int]] | None = None) -> QueryPattern:
+    pattern = QueryPattern(name, collection, query, tuple(sort or ()))
+    all_query_patterns.append(pattern)
+    return pattern
+
+
+def take_pending() -> list[IndexSpec]:
+    """Return the indexes registered since the last call, and clear them"""
+    pending = pending_indexes.copy()
+    pending_indexes.clear()
+    return pending
+
+
+def _find_stages(plan: Mapping[str, Any]) -> list[Mapping[str, Any]]:
+    stages: list[Mapping[str, Any]] = []
+    stack: list[Any] = [plan]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Mapping):
+            if "stage" in node:
+                stages.append(node)
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+    return stages
+
+
+def describe_plan(explain: Mapping[str, Any]) -> str:
+    """
+    Summarise the output of explain() as the index (or collection scan) used and its execution stats.
+    """
+    winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+    stages = _find_stages(winning_plan)
+    index_names = sorted({stage["indexName"] for stage in stages if "indexName" in stage})
+    if index_names:
+        used = "index " + ", ".join(f"`{name}`" for name in index_names)
+    elif any(stage["stage"] == "COLLSCAN" for stage in stages):
+        used = "**collection scan**"
+    else:
+        used = ", ".join(stage["stage"] for stage in stages) or "unknown plan"
+    
+    stats = explain.get("executionStats")
+    if not stats:
+        return used
+    return (f"{used}\n{stats.get("nReturned", 0)} returned, {stats.get("totalKeysExamined", 0)} keys and "
+            f"{stats.get("totalDocsExamined", 0)} documents examined, {stats.get("executionTimeMillis", 0)} ms")
@@ -1,75 +1,230 @@
+import asyncio
+import contextlib
 import datetime
+import itertools
 import logging
-import os
-from collections.abc import Mapping
-from typing import Any, Literal
+import time
+from collections.abc import AsyncGenerator, AsyncIterator, Mapping, Sequence
+from typing import Any, Final, Literal
 
 import cachetools
 import discord
 import pymongo
 from bson import ObjectId
-from gridfs import AsyncGridFS
+from pymongo import DeleteOne, ReturnDocument, UpdateOne
 from pymongo.asynchronous.collection import AsyncCollection
 from pymongo.asynchronous.database import AsyncDatabase
 from pymongo.asynchronous.mongo_client import AsyncMongoClient
+from pymongo.errors import BulkWriteError, ConnectionFailure
 from pymongo.results import DeleteResult, InsertManyResult, InsertOneResult
-from pymongo.server_api import ServerApi
 
-from command_utils.analysis.text_analysis import DBMessage
+from command_utils.analysis import aggregation
+from command_utils.analysis.result_cache import result_cache
+from command_utils.analysis.sketches import WordSketch
+from command_utils.analysis.text_analysis import EXCLUDED_USER_IDS, DBMessage
+from command_utils.analysis.voice_index import VoiceIndex
+from utils import attachment_store, db_indexes, doc_validation, message_rollups, voice_compaction, voice_totals
+from utils.db_connection import ConnectionManager
+from utils.message_queue import MessageIngestQueue
+from utils.message_store import MessageStore
+from utils.write_spool import SpooledWrite, SpoolOp, WriteSpool
 
 logger = logging.getLogger("discord")
 
-# Global client instance
-_mongo_client: AsyncMongoClient[Mapping[str, Any]] | None = None
-_DB_connect_enabled: bool = False
-message_download_cache: cachetools.TTLCache[None, list[Mapping[Any, Any]] | None] = cachetools.TTLCache(maxsize=1, ttl=300)
+# Global connection manager, owns the client instance
+connection: ConnectionManager = ConnectionManager()
+message_store: MessageStore = MessageStore(required_keys=aggregation.REQUIRED_MESSAGE_KEYS)
+# Writes made while the DB is unreachable, or while older spooled writes are still waiting to be replayed
+write_spool: WriteSpool = WriteSpool()
+_spool_replay_task: asyncio.Task[None] | None = None
+_quarantine_tasks: set[asyncio.Task[int | None]] = set()  # Referenced until done so they aren't garbage collected
+# Held while messages are written or deleted with their rollups, a rollup rebuild holds it briefly to pause them
+_message_writes_lock: asyncio.Lock = asyncio.Lock()
+# While a rollup rebuild reads the history: the days whose rollup rows were written to since, and the channels cleared since
+_rollup_rebuild_days: set[int] | None = None
+_rollup_rebuild_channels: set[Any] = set()
+word_sketch: WordSketch | None = None  # Set by load_word_sketch or rebuild_word_sketch, when sketched word statistics are enabled
+_word_sketch_unsaved: int = 0
+WORD_SKETCH_COLLECTION: Final[str] = "word_sketches"
+WORD_SKETCH_SAVE_INTERVAL: Final[int] = 500  # Messages added to the word sketch between saves
 voice_download_cache: cachetools.TTLCache[None, list[Mapping[Any, Any]] | None] = cachetools.TTLCache(maxsize=1, ttl=300)
+voice_index: VoiceIndex | None = None  # Built by voice_analysis.get_voice_index, saved sessions are added to it
+voice_index_generation: int = 0  # Bumped when the voice index is dropped, so an index built from older sessions isn't kept
+ANALYSED_COLLECTIONS: Final[set[str]] = {"messages", "voice_sessions"}  # Writes to these invalidate cached analysis results
+
+db_indexes.register_index("messages", [("id", 1)])
+db_indexes.register_index("messages", [("channel_id", 1)])
+db_indexes.register_index("xp", [("user_id", 1)])
+db_indexes.register_query("Message by ID", "messages", {"id": "0"})
+db_indexes.register_query("Messages in channel", "messages", {"channel_id": 0})
+db_indexes.register_query("XP of user", "xp", {"user_id": "0"})
 
 
 def disable_connection() -> None:
-    global _DB_connect_enabled
-    _DB_connect_enabled = False
+    connection.enabled = False
 
 
 def enable_connection() -> None:
-    global _DB_connect_enabled
-    _DB_connect_enabled = True
+    connection.enabled = True
 
 
 async def _connect() -> AsyncMongoClient[Mapping[str, Any]] | None:
     """
-    Establishes a connection to the MongoDB database using the URI from environment variables.
-    :return: MongoClient instance if successful, None otherwise.
+    Gets the shared MongoDB client, connecting if needed.
+    Concurrent callers share a single connection attempt, and while the DB is unreachable this returns
+    None immediately until the reconnect backoff has passed.
+    :return: MongoClient instance if the DB is reachable, None otherwise.
     """
-    if _DB_connect_enabled:
-        logger.warning("Attempted to connect to MongoDB, but connection has been disabled.")
-        return None
+    client = await connection.get_client()
+    if client is not None and db_indexes.pending_indexes:
+        await _ensure_indexes(client)
+    return client
+
+
+async def _ensure_indexes(client: AsyncMongoClient[Mapping[str, Any]]) -> None:
+    """
+    Creates the indexes registered in db_indexes that haven't been created yet.
+    create_index is a no-op for indexes that already exist, so this is safe to run on every connect.
+    """
+    db = client["discord"]
+    for spec in db_indexes.take_pending():
+        try:
+            await db[spec.collection].create_index(list(spec.keys), name=spec.name, unique=spec.unique)
+            logger.debug(f"Ensured index {spec.name} on {spec.collection}")
+        except Exception as e:
+            logger.error(f"Error creating index {spec.name} on {spec.collection} collection: {e}")
+
+
+connection.add_connect_listener(_ensure_indexes)
+
+
+def _data_changed(collection_name: str) -> None:
+    """
+    Invalidates the cached analysis results, and the downloaded voice sessions and their index, after a write the analysis would see.
+    :param collection_name: The collection that was written to.
+    :return: None
+    """
+    global voice_index, voice_index_generation
+    if collection_name not in ANALYSED_COLLECTIONS:
+        return
+    if collection_name == "voice_sessions":
+        voice_download_cache.clear()
+        voice_index = None
+        voice_index_generation += 1
+    result_cache.data_changed()
+
+
+def _voice_session_saved(session: Mapping[str, Any]) -> None:
+    """
+    Invalidates like _data_changed after a voice session is inserted, but keeps the voice index, adding the session to it.
+    :param session: The inserted voice session.
+    :return: None
+    """
+    global voice_index
+    index = voice_index
+    _data_changed("voice_sessions")
+    if index is not None:
+        index.add(session)
+        voice_index = index
+
+
+def _spool(write: SpooledWrite) -> bool:
+    """
+    Keeps a write in the local spool, to be replayed once the DB is reachable again.
+    :return: If the write was spooled.
+    """
+    if write["op"] == "insert":
+        for doc in write["docs"]:
+            doc.setdefault("_id", ObjectId())  # Lets an interrupted replay be retried without duplicating documents
     
-    global _mongo_client
+    try:
+        write_spool.append(write)
+    except OSError as e:
+        logger.error(f"Could not spool {write["op"]} on {write["collection"]} collection, write lost: {e}")
+        return False
+    logger.debug(f"Spooled {write["op"]} on {write["collection"]} collection")
+    _data_changed(write["collection"])
+    return True
+
+
+async def _apply_spooled(collection_name: str, op: SpoolOp, writes: list[SpooledWrite]) -> None:
+    """
+    Applies a run of spooled writes in bulk. Raises ConnectionFailure if the DB is unreachable,
+    other errors are logged and the writes dropped, the same as for a direct write.
+    """
+    client = await _connect()
+    if not client:
+        raise ConnectionFailure("MongoDB is unreachable")
     
-    if _mongo_client is not None:
-        return _mongo_client
+    db = client["discord"]
+    collection: AsyncCollection[Mapping[str, Any]] = db[collection_name]
     
-    uri = os.getenv("MONGO_URI")
-    logger.debug("Connecting to MongoDB...")
-    client: AsyncMongoClient[Mapping[str, Any]] = AsyncMongoClient(
-        host=uri,
-        server_api=ServerApi("1"),
-        serverSelectionTimeoutMS=5000,
-        tls=True,
-        tlsCertificateKeyFile="mongo_cert.pem"
-    )
-    try:
-        ping = await client.admin.command("ping")
-        _mongo_client = client  # Store the connection
-        logger.info(f"MongoDB connection established successfully: {ping}")
-        return client
-    except ConnectionError:
-        logger.error("Connection error while connecting to MongoDB")
-        return None
-    except Exception as e:
-        logger.error(f"An error occurred while connecting to MongoDB: {e}")
-        return None
+    docs: list[dict[str, Any]] = [doc for write in writes for doc in write.get("docs", [])]
+    async with _message_writes_lock if collection_name == "messages" else contextlib.nullcontext():
+        try:
+            if op == "insert":
+                await collection.insert_many(docs, ordered=False)
+                if collection_name == "messages":
+                    await _record_inserted_messages(db, docs)
+                elif collection_name == "voice_sessions":
+                    await _update_voice_totals(docs)
+            elif op == "update":
+                updates = [UpdateOne(write["query"], write["update"], upsert=write.get("upsert", False)) for write in writes]
+                await collection.bulk_write(updates, ordered=True)
+            elif collection_name == "messages":
+                # One at a time, so exactly the messages that were still there are taken out of the rollups
+                deleted: list[Mapping[str, Any]] = []
+                for write in writes:
+                    doc = await collection.find_one_and_delete(write["query"])
+                    if doc is not None:
+                        deleted.append(doc)
+                await _record_deleted_messages(deleted)
+            else:
+                await collection.bulk_write([DeleteOne(write["query"]) for write in writes], ordered=True)
+        except ConnectionFailure as e:
+            connection.mark_unhealthy(e)
+            raise
+        except BulkWriteError as e:
+            # Duplicate key errors are inserts already applied by an earlier, interrupted replay
+            errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+            failed: set[int] = {error["index"] for error in e.details.get("writeErrors", [])}
+            if op == "insert" and collection_name == "messages":
+                await _record_inserted_messages(db, [doc for i, doc in enumerate(docs) if i not in failed])
+            elif op == "insert" and collection_name == "voice_sessions":
+                await _update_voice_totals([doc for i, doc in enumerate(docs) if i not in failed])
+            if errors:
+                logger.error(f"Failed to replay {len(errors)} spooled writes on {collection_name} collection: {errors[0].get("errmsg")}")
+        except Exception as e:
+            logger.error(f"Dropping {len(writes)} spooled writes on {collection_name} collection: {e}")
+    _data_changed(collection_name)
+
+
+async def replay_spool() -> None:
+    """
+    Replays the write spool into MongoDB, retrying while the connection stays up.
+    If the connection drops, the next reconnect starts the replay again.
+    """
+    while write_spool.pending:
+        try:
+            replayed = await write_spool.replay(_apply_spooled)
+            logger.info(f"Replayed {replayed} spooled writes into MongoDB")
+        except Exception as e:
+            logger.error(f"Error replaying spooled writes: {e}")
+            await asyncio.sleep(5)
+            if connection.state != "closed":
+                return
+
+
+async def _start_spool_replay(_client: AsyncMongoClient[Mapping[str, Any]]) -> None:
+    global _spool_replay_task
+    if not write_spool.pending:
+        return
+    # Runs in the background so connecting callers don't wait for the whole spool
+    if _spool_replay_task is None or _spool_replay_task.done():
+        _spool_replay_task = asyncio.get_running_loop().create_task(replay_spool(), name="write-spool-replay")
+
+
+connection.add_connect_listener(_start_spool_replay)
 
 
 async def disconnect() -> bool:
@@ -77,41 +232,170 @@ async def disconnect() -> bool:
     Closes the MongoDB connection if it exists.
     :return: If the connection existed and was closed successfully.
     """
-    global _mongo_client
-    if _mongo_client is not None:
+    write_spool.close()
+    await attachment_store.close_session()
+    return await connection.close()
+
+
+async def _record_inserted_messages(db: AsyncDatabase[Mapping[str, Any]], docs: list[dict[str, Any]]) -> None:
+    """
+    Adds newly inserted messages to the daily message rollups, and to the word sketch if it is loaded.
+    :param db: The database the messages were inserted into.
+    :param docs: The inserted message documents.
+    :return: None
+    """
+    global _word_sketch_unsaved
+    _data_changed("messages")
+    if word_sketch is not None:
+        for doc in docs:
+            if isinstance(doc.get("content"), str) and doc.get("author_id") not in EXCLUDED_USER_IDS:
+                word_sketch.add_text(doc["content"])
+        _word_sketch_unsaved += len(docs)
+        if _word_sketch_unsaved >= WORD_SKETCH_SAVE_INTERVAL:
+            await save_word_sketch()
+    
+    await _apply_rollup_writes(message_rollups.rollup_updates(docs, aggregation.REQUIRED_MESSAGE_KEYS))
+
+
+async def _record_deleted_messages(docs: list[Mapping[str, Any]]) -> None:
+    """
+    Takes deleted messages back out of the daily message rollups.
+    Deleted messages stay counted in the word sketch until it is rebuilt.
+    :param docs: The deleted message documents.
+    :return: None
+    """
+    await _apply_rollup_writes(message_rollups.removal_updates(docs, aggregation.REQUIRED_MESSAGE_KEYS))
+
+
+async def _apply_rollup_writes(writes: list[SpooledWrite]) -> None:
+    """
+    Applies writes to the message rollups, noting their days for a rebuild that is reading the history meanwhile.
+    :param writes: The rollup writes.
+    :return: None
+    """
+    if _rollup_rebuild_days is not None:
+        _rollup_rebuild_days.update(write["query"]["day"] for write in writes)
+    await _apply_follow_up_writes(writes)
+
+
+async def _apply_follow_up_writes(writes: list[SpooledWrite]) -> None:
+    """
+    Applies writes keeping derived data, like the message rollups, in step with writes that were already saved.
+    If the DB becomes unreachable part way, the rest are spooled rather than lost, so the derived data doesn't stay wrong.
+    :param writes: The writes, applied in order.
+    :return: None
+    """
+    applied: int = 0
+    for (collection_name, op), group in itertools.groupby(writes, key=lambda write: (write["collection"], write["op"])):
+        run = list(group)
         try:
-            await _mongo_client.close()
-            logger.info("MongoDB connection closed")
-            return True
-        except Exception as e:
-            logger.error(f"Error closing MongoDB connection: {e}")
-        finally:
-            _mongo_client = None
-        
-        return False
-    return True
+            await _apply_spooled(collection_name, op, run)
+        except ConnectionFailure as e:
+            connection.mark_unhealthy(e)
+            logger.warning(f"Lost connection updating {collection_name} collection, spooling {len(writes) - applied} writes: {e}")
+            for write in writes[applied:]:
+                _spool(write)
+            return
+        applied += len(run)
 
 
-async def send_message(message: DBMessage) -> bool:
+async def _update_voice_totals(added: Sequence[Mapping[str, Any]], removed: Sequence[Mapping[str, Any]] = ()) -> None:
     """
-    Saves a single message to MongoDB.
-    :param message: A dictionary representing the message to be saved.
-    :return: If the message was saved successfully
+    Adds saved voice sessions to the per user voice totals, and takes out sessions that were merged into others.
+    :param added: The saved sessions.
+    :param removed: The sessions that were replaced, as they were.
+    :return: None
+    """
+    await _apply_follow_up_writes(voice_totals.totals_updates(added, removed))
+
+
+async def _insert_message_batch(docs: list[dict[str, Any]]) -> None:
+    """
+    Saves a batch of queued messages to MongoDB in a single unordered insert.
+    :param docs: The message documents to insert.
+    :return: None
     """
     client = await _connect()
-    if not client:
-        return False
+    if not client or write_spool.pending:
+        if _spool(SpooledWrite(op="insert", collection="messages", docs=docs)):
+            for doc in docs:
+                message_store.add(doc)
+        return
     
     db = client["discord"]
     collection: AsyncCollection[Mapping[str, Any]] = db["messages"]
     
-    try:
-        await collection.insert_one(dict(message))
-        logger.info("Message saved successfully")
-        return True
-    except Exception as e:
-        logger.error(f"Error saving message: {e}")
-        return False
+    async with _message_writes_lock:
+        try:
+            result = await collection.insert_many(docs, ordered=False)
+            for doc in docs:
+                message_store.add(doc)
+            logger.info(f"{len(result.inserted_ids)} messages saved successfully")
+            await _record_inserted_messages(db, docs)
+        except ConnectionFailure as e:
+            connection.mark_unhealthy(e)
+            logger.warning(f"Lost connection saving {len(docs)} messages, spooling them: {e}")
+            if _spool(SpooledWrite(op="insert", collection="messages", docs=docs)):
+                for doc in docs:
+                    message_store.add(doc)
+        except BulkWriteError as e:
+            write_errors: list[dict[str, Any]] = e.details.get("writeErrors", [])
+            failed: set[int] = {error["index"] for error in write_errors}
+            inserted = [doc for i, doc in enumerate(docs) if i not in failed]
+            for doc in inserted:
+                message_store.add(doc)
+            # Duplicates are already saved, the rest were put in the store when queued and never will be
+            for error in write_errors:
+                if error.get("code") != 11000:
+                    _discard_unsaved_message(docs[error["index"]])
+            rejected = sum(1 for error in write_errors if error.get("code") == 121)  # DocumentValidationFailure
+            if rejected:
+                logger.warning(f"{rejected} messages failed schema validation and were not saved")
+            if len(failed) > rejected:
+                logger.error(f"Error saving {len(failed) - rejected} of {len(docs)} messages: {e}")
+            await _record_inserted_messages(db, inserted)
+        except Exception as e:
+            logger.error(f"Error saving messages: {e}")
+            for doc in docs:
+                _discard_unsaved_message(doc)
+
+
+def _discard_unsaved_message(doc: Mapping[str, Any]) -> None:
+    """Takes a message that failed to save back out of the message store, which it was put in when queued"""
+    if "id" in doc:
+        message_store.remove(str(doc["id"]))
+
+
+message_queue: MessageIngestQueue = MessageIngestQueue(_insert_message_batch)
+
+
+async def send_message(message: DBMessage) -> bool:
+    """
+    Queues a single message to be saved to MongoDB with the next batch.
+    It is put in the message store right away, so analysis and edits see it while it waits.
+    :param message: A dictionary representing the message to be saved.
+    :return: If the message was queued successfully
+    """
+    doc = dict(message)
+    message_store.add(doc)
+    await message_queue.put(doc)
+    return True
+
+
+async def write_queued_messages() -> None:
+    """
+    Writes the queued messages now instead of with their batch, for reads that must see every message sent so far.
+    :return: None
+    """
+    await message_queue.flush()
+
+
+async def flush_message_queue() -> None:
+    """
+    Writes all queued messages and stops the background writer. Messages sent afterwards are written immediately.
+    :return: None
+    """
+    await message_queue.drain()
 
 
 async def bulk_send_messages(messages: list[Mapping[str, Any]]) -> None:
@@ -120,66 +404,91 @@ async def bulk_send_messages(messages: list[Mapping[str, Any]]) -> None:
     :param messages: A list of dictionaries, each representing a message.
     :return: None
     """
+    docs = [dict(message) for message in messages]
     client = await _connect()
-    if not client:
+    if not client or write_spool.pending:
+        if _spool(SpooledWrite(op="insert", collection="messages", docs=docs)):
+            for doc in docs:
+                message_store.add(doc)
         return
     
     db: AsyncDatabase[Mapping[str, Any]] = client["discord"]
     collection: AsyncCollection[Mapping[str, Any]] = db["messages"]
     
-    try:
-        await collection.insert_many(messages)
-        logger.info(f"{len(messages)} messages saved successfully")
-    except Exception as e:
-        logger.error(f"Error saving messages: {e}")
+    async with _message_writes_lock:
+        try:
+            await collection.insert_many(docs)
+            for doc in docs:
+                message_store.add(doc)
+            logger.info(f"{len(messages)} messages saved successfully")
+            await _record_inserted_messages(db, docs)
+        except Exception as e:
+            logger.error(f"Error saving messages: {e}")
 
 
-async def send_attachment(message: discord.Message, attachment: discord.Attachment) -> None:
+async def send_attachment(message: discord.Message, attachment: discord.Attachment) -> bool:
     """
-    Saves an attachment to MongoDB using GridFS.
+    Saves an attachment to MongoDB using GridFS, streaming it from Discord and storing identical files only once.
     :param message: discord.Message object containing the message metadata.
     :param attachment: discord.Attachment object containing the attachment data.
-    :return: None
+    :return: If the attachment was saved.
     """
     client = await _connect()
     if not client:
-        return None
+        return False
     
-    db = client["discord"]
-    fs = AsyncGridFS(db, "attachments")
+    return await attachment_store.store_attachment(client["discord"], message, attachment)
+
+
+async def send_attachments(message: discord.Message) -> int:
+    """
+    Saves all attachments of a message concurrently, limited by the global attachment upload semaphore.
+    :param message: discord.Message object with the attachments to save.
+    :return: The number of attachments saved.
+    """
+    client = await _connect()
+    if not client:
+        return 0
     
-    try:
-        # Download the attachment data
-        attachment_bytes = await attachment.read()
+    db = client["discord"]
+    saved = await asyncio.gather(*(attachment_store.store_attachment(db, message, attachment)
+                                   for attachment in message.attachments))
+    return sum(saved)
+
+
+async def sync_message_store(force_full: bool = False) -> bool:
+    """
+    Bring the in-process message store up to date.
+    The first call (and every full resync interval) downloads the whole collection,
+    otherwise only messages newer than the store's high-water mark are fetched.
+    :param force_full: Download the whole collection even if a delta sync would do.
+    :return: If the store holds usable data, which may be stale if the DB could not be reached.
+    """
+    async with message_store.lock:
+        if not force_full and not message_store.needs_refresh():
+            return True
         
-        # Store metadata
-        metadata = {
-            "message_id":   str(message.id),
-            "author_id":    str(message.author.id),
-            "content_type": attachment.content_type,
-            "timestamp":    message.created_at.timestamp(),
-        }
+        if force_full or message_store.needs_full_sync():
+            downloaded = await _download_all()
+            if downloaded is None:
+                return message_store.loaded
+            message_store.load_all(downloaded)
+            _data_changed("messages")
+            return True
         
-        # Store file in GridFS
-        await fs.put(
-                attachment_bytes,
-                filename=attachment.filename,
-                metadata=metadata,
-        )
-        logger.info(f"Attachment saved successfully: {attachment.filename}")
-        return None
-    except Exception as e:
-        logger.error(f"Error saving attachment: {e}")
-        return None
+        new_docs = await _download_since(message_store.high_water)
+        if new_docs is None:
+            return True
+        message_store.apply_delta(new_docs)
+        if new_docs:
+            _data_changed("messages")
+        return True
 
 
 async def cached_download_all() -> list[Mapping[str, Any]] | None:
-    global message_download_cache
-    if message_download_cache.get(None) is not None:
-        return message_download_cache[None]
-    downloaded = await _download_all()
-    message_download_cache[None] = downloaded
-    return downloaded
+    if not await sync_message_store():
+        return None
+    return message_store.snapshot()
 
 
 async def _download_all() -> list[Mapping[str, Any]] | None:
@@ -201,6 +510,169 @@ async def _download_all() -> list[Mapping[str, Any]] | None:
         return None
 
 
+async def _download_since(high_water: ObjectId | None) -> list[Mapping[str, Any]] | None:
+    """
+    Downloads the messages inserted after the given high-water mark, in insertion order.
+    """
+    client = await _connect()
+    if not client:
+        return None
+    
+    db = client["discord"]
+    collection = db["messages"]
+    query: dict[str, Any] = {} if high_water is None else {"_id": {"$gt": high_water}}
+    
+    try:
+        messages = collection.find(query).sort("_id", pymongo.ASCENDING)
+        return [doc async for doc in messages]
+    
+    except Exception as e:
+        logger.error(f"DB Error retrieving new messages: {e}")
+        return None
+
+
+async def load_word_sketch() -> bool:
+    """
+    Loads the saved word sketch, after which it is kept up to date as messages are inserted.
+    :return: If a sketch was loaded. If none was saved yet, rebuild_word_sketch creates one.
+    """
+    global word_sketch
+    doc = await get_from_db(WORD_SKETCH_COLLECTION, {"_id": "messages"})
+    if doc is None:
+        logger.warning("No word sketch saved, it has to be rebuilt before sketched word statistics can be used")
+        return False
+    
+    try:
+        word_sketch = WordSketch.from_document(doc)
+    except (KeyError, TypeError, ValueError) as e:
+        logger.error(f"Saved word sketch is malformed and has to be rebuilt: {e}")
+        return False
+    
+    logger.info(f"Loaded word sketch of {word_sketch.messages} messages")
+    return True
+
+
+async def save_word_sketch() -> bool:
+    """
+    Saves the word sketch, replacing the saved one.
+    :return: If the sketch was saved.
+    """
+    global _word_sketch_unsaved
+    if word_sketch is None:
+        return False
+    
+    client = await _connect()
+    if not client:
+        return False
+    
+    db = client["discord"]
+    collection: AsyncCollection[Mapping[str, Any]] = db[WORD_SKETCH_COLLECTION]
+    doc = {"_id": "messages", **word_sketch.to_document(), "saved_at": datetime.datetime.now(datetime.UTC).timestamp()}
+    try:
+        await collection.replace_one({"_id": "messages"}, doc, upsert=True)
+    except Exception as e:
+        logger.error(f"Error saving word sketch: {e}")
+        return False
+    
+    _word_sketch_unsaved = 0
+    return True
+
+
+async def rebuild_message_rollups(match: Mapping[str, Any]) -> bool:
+    """
+    Replaces the message rollups with ones recomputed from the messages selected by ``match``.
+    Every day before today is built into a staging collection while messages keep being written. Then, with message
+    writes paused, today and the days written to meanwhile are recomputed, the rows of channels cleared meanwhile
+    dropped, and the staging collection renamed over the rollups. No message is counted twice or lost, and writes
+    only wait for a day or so of messages rather than the whole history.
+    Refuses while writes are spooled, their rollup updates would be applied again on top of the rebuilt rollups.
+    :param match: The messages to count, see aggregation.build_message_match.
+    :return: If the rollups were rebuilt.
+    """
+    global _rollup_rebuild_days
+    if write_spool.pending:
+        logger.warning("Not rebuilding the message rollups while spooled writes are waiting to be replayed")
+        return False
+    if _rollup_rebuild_days is not None:
+        logger.warning("Not rebuilding the message rollups, a rebuild is already running")
+        return False
+    
+    client = await _connect()
+    if not client:
+        return False
+    
+    db = client["discord"]
+    staging: AsyncCollection[Mapping[str, Any]] = db[message_rollups.REBUILD_COLLECTION]
+    cutoff: int = message_rollups.day_start(time.time())
+    _rollup_rebuild_days = set()
+    _rollup_rebuild_channels.clear()
+    try:
+        history = message_rollups.rebuild_pipeline({"$and": [match, {"timestamp": {"$lt": cutoff}}]}, message_rollups.REBUILD_COLLECTION)
+        if await aggregate_db("messages", history) is None:
+            return False
+        for spec in db_indexes.all_indexes:
+            if spec.collection == message_rollups.ROLLUP_COLLECTION:
+                await staging.create_index(list(spec.keys), name=spec.name, unique=spec.unique)
+        
+        async with _message_writes_lock:
+            if write_spool.pending:
+                logger.warning("Abandoning the message rollup rebuild, writes were spooled while it ran")
+                return False
+            
+            days = sorted(_rollup_rebuild_days)
+            recent: list[dict[str, Any]] = [{"timestamp": {"$gte": cutoff}}]
+            recent.extend({"timestamp": {"$gte": day, "$lt": day + message_rollups.DAY_SECONDS}} for day in days)
+            await staging.delete_many({"day": {"$in": days}})
+            if _rollup_rebuild_channels:
+                await staging.delete_many({"channel_id": {"$in": list(_rollup_rebuild_channels)}})
+            rows = await aggregate_db("messages", message_rollups.rebuild_pipeline({"$and": [match, {"$or": recent}]}, out=None))
+            if rows is None:
+                return False
+            if rows:
+                await staging.insert_many(rows, ordered=False)
+            await staging.rename(message_rollups.ROLLUP_COLLECTION, dropTarget=True)
+    except Exception as e:
+        logger.error(f"Error rebuilding the message rollups: {e}")
+        return False
+    finally:
+        _rollup_rebuild_days = None
+        _rollup_rebuild_channels.clear()
+    
+    _data_changed("messages")
+    logger.info(f"Rebuilt the message rollups, recomputing {len(days)} days written to during the rebuild")
+    return True
+
+
+async def rebuild_word_sketch() -> int | None:
+    """
+    Builds a new word sketch from the whole message history and saves it.
+    Messages inserted while the history is read may be missed, which is within the sketch's error anyway.
+    :return: The number of messages in the sketch, or None if it couldn't be saved.
+    """
+    global word_sketch
+    sketch = WordSketch()
+    async for doc in stream_from_db("messages", {"author_id": {"$nin": EXCLUDED_USER_IDS}}, projection={"content": 1}, batch_size=2000):
+        if isinstance(doc.get("content"), str):
+            sketch.add_text(doc["content"])
+    
+    word_sketch = sketch
+    _data_changed("messages")
+    if not await save_word_sketch():
+        return None
+    logger.info(f"Rebuilt word sketch of {sketch.messages} messages")
+    return sketch.messages
+
+
+async def get_message(message_id: str) -> dict[str, Any] | None:
+    """
+    Get a single message by its Discord ID, from the message store if it is loaded, otherwise from the DB.
+    """
+    cached = message_store.get(message_id)
+    if cached is not None:
+        return dict(cached)
+    return await get_from_db("messages", {"id": message_id})
+
+
 async def delete_message(ObjId: ObjectId) -> None:
     """
     Deletes a message from the MongoDB database by its ObjectId.
@@ -208,19 +680,30 @@ async def delete_message(ObjId: ObjectId) -> None:
     :return: None
     """
     client = await _connect()
-    if not client:
+    if not client or write_spool.pending:
+        if _spool(SpooledWrite(op="delete", collection="messages", query={"_id": ObjId})):
+            message_store.remove_object_id(ObjId)
         return
     
     db = client["discord"]
     collection = db["messages"]
-    try:
-        result = await collection.delete_one({"_id": ObjId})
-        if result.acknowledged and result.deleted_count > 0:
-            logger.info("Message deleted successfully")
-        else:
-            logger.warning("No message found with the given ID")
-    except Exception as e:
-        logger.error(f"Error deleting message: {e}")
+    async with _message_writes_lock:
+        try:
+            deleted = await collection.find_one_and_delete({"_id": ObjId})
+            message_store.remove_object_id(ObjId)
+            _data_changed("messages")
+            if deleted is not None:
+                logger.info("Message deleted successfully")
+                await _record_deleted_messages([deleted])
+            else:
+                logger.warning("No message found with the given ID")
+        except ConnectionFailure as e:
+            connection.mark_unhealthy(e)
+            logger.warning(f"Lost connection deleting message, spooling the delete: {e}")
+            if _spool(SpooledWrite(op="delete", collection="messages", query={"_id": ObjId})):
+                message_store.remove_object_id(ObjId)
+        except Exception as e:
+            logger.error(f"Error deleting message: {e}")
 
 
 async def del_channel_from_db(channel: discord.TextChannel) -> int | None:
@@ -236,43 +719,194 @@ async def del_channel_from_db(channel: discord.TextChannel) -> int | None:
     db = client["discord"]
     collection = db["messages"]
     
-    try:
-        result: DeleteResult = await collection.delete_many({"channel_id": channel.id})
-        if not result.acknowledged:
-            logger.warning("Channel deletion was not acknowledged by MongoDB")
-            return 0
+    async with _message_writes_lock:
+        try:
+            query: dict[str, Any] = {"channel_id": channel.id}
+            attached = [doc["id"] async for doc in collection.find({**query, "HasAttachments": True}, {"id": 1}) if "id" in doc]
+            released = await attachment_store.release_attachments(db, attached)
+            if released:
+                logger.info(f"Deleted {released} attachments no longer used after clearing channel {channel.id}")
+            
+            result: DeleteResult = await collection.delete_many(query)
+            message_store.invalidate()
+            _data_changed("messages")
+            if not result.acknowledged:
+                logger.warning("Channel deletion was not acknowledged by MongoDB")
+                return 0
+            
+            # Every message of the channel is gone, and with them its rollup rows. Clearing the channel again retries this
+            if _rollup_rebuild_days is not None:
+                _rollup_rebuild_channels.add(channel.id)
+            await db[message_rollups.ROLLUP_COLLECTION].delete_many(query)
+            
+            logger.info(f"Deleted {result.deleted_count} messages from channel {channel.id}")
+            return result.deleted_count
         
-        logger.info(f"Deleted {result.deleted_count} messages from channel {channel.id}")
-        return result.deleted_count
-    
-    except Exception as e:
-        logger.error(f"Error deleting messages from channel {channel.id}: {e}")
-        return None
+        except Exception as e:
+            logger.error(f"Error deleting messages from channel {channel.id}: {e}")
+            return None
 
 
 async def send_voice_session(session_data: Mapping[str, Any]) -> None:
     """
     Saves a voice session to the MongoDB database.
+    If the user's previous session in the channel ended right before this one started, e.g. because the bot restarted,
+    that session is stretched to cover this one instead.
     :param session_data: A dictionary containing the voice session data.
     :return: None
     """
     client = await _connect()
-    if not client:
+    if not client or write_spool.pending:
+        _spool(SpooledWrite(op="insert", collection="voice_sessions", docs=[dict(session_data)]))
         return
     
     db = client["discord"]
     collection: AsyncCollection[Mapping[str, Any]] = db["voice_sessions"]
     
     try:
+        if "timestamp" in session_data:
+            previous = await collection.find_one_and_update(
+                    voice_compaction.adjacent_session_query(session_data),
+                    voice_compaction.extend_pipeline(session_data),
+                    sort=[("timestamp", pymongo.DESCENDING)],
+                    return_document=ReturnDocument.BEFORE,
+            )
+            if previous is not None:
+                _data_changed("voice_sessions")
+                extended = {**previous, **voice_compaction.extended_fields(previous, session_data)}
+                await _update_voice_totals([extended], [previous])
+                logger.info(f"Voice session for {session_data["user_id"]} merged into the session before it")
+                return
+        
         result = await collection.insert_one(session_data)
+        _voice_session_saved(session_data)
+        await _update_voice_totals([session_data])
         if not result.acknowledged:
             logger.warning("Voice session not acknowledged by MongoDB")
             return
         logger.info(f"Voice session for {session_data["user_id"]} saved successfully")
+    except ConnectionFailure as e:
+        connection.mark_unhealthy(e)
+        logger.warning(f"Lost connection saving voice session, spooling it: {e}")
+        _spool(SpooledWrite(op="insert", collection="voice_sessions", docs=[dict(session_data)]))
     except Exception as e:
         logger.error(f"Error saving voice session: {e}")
 
 
+async def compact_voice_sessions() -> int | None:
+    """
+    Merges the voice sessions split by bot restarts in the voice_sessions collection, see voice_compaction.
+    Only the users and channels with sessions inserted since the last compaction are looked at,
+    the first compaction looks at every session.
+    :return: The number of sessions merged into others, or None if the sessions couldn't be compacted.
+    """
+    if write_spool.pending:
+        # Spooled sessions keep the IDs they got when spooled, which may be below the watermark by the time they are replayed
+        return None
+    
+    client = await _connect()
+    if not client:
+        return None
+    
+    db = client["discord"]
+    collection: AsyncCollection[Mapping[str, Any]] = db["voice_sessions"]
+    state_collection: AsyncCollection[Mapping[str, Any]] = db[voice_compaction.COMPACTION_COLLECTION]
+    
+    try:
+        state = await state_collection.find_one({"_id": voice_compaction.COMPACTION_STATE_ID})
+        watermark: ObjectId | None = state.get("watermark") if state is not None else None
+        query: dict[str, Any] = {} if watermark is None else {"_id": {"$gt": watermark}}
+        new_sessions = [doc async for doc in collection.find(query, {"user_id": 1, "channel_id": 1})]
+        if not new_sessions:
+            return 0
+        
+        if watermark is None:
+            sessions = [doc async for doc in collection.find({})]
+        else:
+            pairs = {(doc.get("user_id"), doc.get("channel_id")) for doc in new_sessions}
+            user_ids = list({user_id for user_id, _ in pairs})
+            candidates = collection.find({"user_id": {"$in": user_ids}})
+            sessions = [doc async for doc in candidates if (doc.get("user_id"), doc.get("channel_id")) in pairs]
+        
+        # Applied one at a time, so the totals only change for sessions that were still as they were read
+        plan = voice_compaction.plan_compaction(sessions)
+        added: list[dict[str, Any]] = []
+        removed: list[Mapping[str, Any]] = []
+        merged: int = 0
+        skipped: int = 0
+        try:
+            for chain in plan["chains"]:
+                for step in chain:
+                    result = await collection.bulk_write([step["write"]])
+                    if not (result.matched_count or result.deleted_count):
+                        skipped += 1
+                        if "added" in step:
+                            break  # The first session changed, deleting the rest of the chain would lose their time
+                        continue
+                    
+                    removed.append(step["removed"])
+                    if "added" in step:
+                        added.append(step["added"])
+                    else:
+                        merged += 1
+        finally:
+            # Also when a write failed part way, the ones before it were applied
+            if removed:
+                await _update_voice_totals(added, removed)
+        
+        new_watermark = max((doc["_id"] for doc in new_sessions if isinstance(doc["_id"], ObjectId)), default=watermark)
+        if skipped:
+            # Sessions changed while compacting, look at them again next time
+            logger.info(f"Skipped {skipped} voice compaction writes to sessions that changed since they were read")
+            new_watermark = watermark
+        await state_collection.update_one(
+                {"_id": voice_compaction.COMPACTION_STATE_ID},
+                {"$set": {"watermark": new_watermark, "compacted_at": datetime.datetime.now(datetime.UTC).timestamp()}},
+                upsert=True,
+        )
+    except Exception as e:
+        logger.error(f"Error compacting voice sessions: {e}")
+        return None
+    
+    if removed:
+        _data_changed("voice_sessions")
+        logger.info(f"Compacted voice sessions, merged {merged} into others")
+    return merged
+
+
+async def rebuild_voice_totals() -> int | None:
+    """
+    Recomputes the per user voice totals from every voice session, replacing the current ones.
+    Sessions saved while the history is read may be counted twice or not at all, rebuilding again fixes that.
+    Refuses while writes are spooled, their totals updates would be applied again on top of the rebuilt totals.
+    :return: The number of totals rows, or None if they couldn't be rebuilt.
+    """
+    if write_spool.pending:
+        logger.warning("Not rebuilding the voice totals while spooled writes are waiting to be replayed")
+        return None
+    
+    client = await _connect()
+    if not client:
+        return None
+    
+    db = client["discord"]
+    collection: AsyncCollection[Mapping[str, Any]] = db[voice_totals.TOTALS_COLLECTION]
+    required_keys = ("user_id", "channel_id", "duration_seconds")
+    try:
+        # Read directly rather than with stream_from_db, which stops quietly on errors and would leave totals missing
+        sessions = [doc async for doc in db["voice_sessions"].find({}, batch_size=2000) if all(key in doc for key in required_keys)]
+        docs = voice_totals.totals_documents(sessions)
+        await collection.delete_many({})
+        if docs:
+            await collection.insert_many(docs, ordered=False)
+    except Exception as e:
+        logger.error(f"Error rebuilding voice totals: {e}")
+        return None
+    
+    logger.info(f"Rebuilt {len(docs)} voice totals rows from {len(sessions)} voice sessions")
+    return len(docs)
+
+
 async def cached_download_voice_sessions(skip_cache: bool = False) -> list[Mapping[Any, Any]] | None:
     if voice_download_cache.get(None) is not None and not skip_cache:
         return voice_download_cache[None]
@@ -305,19 +939,24 @@ async def send_to_db(collection_name: str, data: Mapping[str, Any]) -> bool:
     Generic function to send data to a specified MongoDB await collection.
     """
     client = await _connect()
-    if not client:
-        return False
+    if not client or write_spool.pending:
+        return _spool(SpooledWrite(op="insert", collection=collection_name, docs=[dict(data)]))
     
     db = client["discord"]
     collection: AsyncCollection[Mapping[str, Any]] = db[collection_name]
     
     try:
         result: InsertOneResult = await collection.insert_one(data)
-        if not result.acknowledged:
+        _data_changed(collection_name)
+        if result.acknowledged:
             logger.info(f"Data sent successfully to {collection_name} collection")
             return True
         
         logger.warning(f"Data not acknowledged by MongoDB for {collection_name} collection")
+    except ConnectionFailure as e:
+        connection.mark_unhealthy(e)
+        logger.warning(f"Lost connection sending data to {collection_name} collection, spooling it: {e}")
+        return _spool(SpooledWrite(op="insert", collection=collection_name, docs=[dict(data)]))
     except Exception as e:
         logger.error(f"Error sending data to {collection_name} collection: {e}")
     
@@ -329,14 +968,15 @@ async def edit_db_entry(collection_name: str, query: Mapping[str, Any], update_d
     Generic function to edit an entry in a specified MongoDB await collection.
     """
     client = await _connect()
-    if not client:
-        return False
+    if not client or write_spool.pending:
+        return _spool(SpooledWrite(op="update", collection=collection_name, query=dict(query), update={"$set": dict(update_data)}))
     
     db = client["discord"]
     collection: AsyncCollection[Mapping[str, Any]] = db[collection_name]
     
     try:
         result = await collection.update_one(query, {"$set": update_data})
+        _data_changed(collection_name)
         if not result.acknowledged:
             logger.error("Update operation not acknowledged")
             return False
@@ -345,6 +985,10 @@ async def edit_db_entry(collection_name: str, query: Mapping[str, Any], update_d
             return True
         else:
             logger.warning(f"No entry matched the query in {collection_name} collection")
+    except ConnectionFailure as e:
+        connection.mark_unhealthy(e)
+        logger.warning(f"Lost connection updating entry in {collection_name} collection, spooling the update: {e}")
+        return _spool(SpooledWrite(op="update", collection=collection_name, query=dict(query), update={"$set": dict(update_data)}))
     except Exception as e:
         logger.error(f"Error updating entry in {collection_name} collection: {e}")
     
@@ -356,14 +1000,15 @@ async def del_db_entry(collection_name: str, query: dict[str, Any]) -> bool:
     Generic function to delete an entry from a specified MongoDB await collection.
     """
     client = await _connect()
-    if not client:
-        return False
+    if not client or write_spool.pending:
+        return _spool(SpooledWrite(op="delete", collection=collection_name, query=query))
     
     db = client["discord"]
     collection: AsyncCollection[Mapping[str, Any]] = db[collection_name]
     
     try:
         result: DeleteResult = await collection.delete_one(query)
+        _data_changed(collection_name)
         if not result.acknowledged:
             logger.warning(f"DB entry deletion from {collection_name} collection not acknowledged. Query: {query}")
             return False
@@ -372,6 +1017,10 @@ async def del_db_entry(collection_name: str, query: dict[str, Any]) -> bool:
             return True
         else:
             logger.warning(f"No entry matched the query in {collection_name} collection")
+    except ConnectionFailure as e:
+        connection.mark_unhealthy(e)
+        logger.warning(f"Lost connection deleting entry from {collection_name} collection, spooling the delete: {e}")
+        return _spool(SpooledWrite(op="delete", collection=collection_name, query=query))
     except Exception as e:
         logger.error(f"Error deleting entry from {collection_name} collection: {e}")
     
@@ -391,6 +1040,7 @@ async def del_many_db_entries(collection_name: str, query: dict[str, Any]) -> in
     
     try:
         result: DeleteResult = await collection.delete_many(query)
+        _data_changed(collection_name)
         if not result.acknowledged:
             logger.warning("Delete operation not acknowledged")
             return None
@@ -401,6 +1051,93 @@ async def del_many_db_entries(collection_name: str, query: dict[str, Any]) -> in
         return None
 
 
+async def quarantine_documents(collection_name: str, ids: list[Any]) -> int | None:
+    """
+    Moves documents to the collection's quarantine collection, with one aggregation and one delete.
+    :param collection_name: The collection the documents are in.
+    :param ids: The ObjectIds of the documents to move.
+    :return: The number of documents removed from the collection, or None if they couldn't be moved.
+    """
+    if not ids:
+        return 0
+    
+    client = await _connect()
+    if not client:
+        return None
+    
+    db = client["discord"]
+    collection: AsyncCollection[Mapping[str, Any]] = db[collection_name]
+    pipeline = doc_validation.quarantine_pipeline(collection_name, ids, datetime.datetime.now(datetime.UTC).timestamp())
+    
+    async with _message_writes_lock if collection_name == "messages" else contextlib.nullcontext():
+        try:
+            # The copies are written before anything is deleted, so a failure part way through loses nothing
+            await (await collection.aggregate(pipeline)).to_list()
+            counted: list[Mapping[str, Any]] = []
+            if collection_name == "messages":
+                counted = await collection.find({"_id": {"$in": ids}}, dict.fromkeys(aggregation.REQUIRED_MESSAGE_KEYS, 1)).to_list()
+            result: DeleteResult = await collection.delete_many({"_id": {"$in": ids}})
+            _data_changed(collection_name)
+            # Only messages with every required key were counted, which are rarely the ones quarantined
+            await _record_deleted_messages(counted)
+            logger.info(f"Quarantined {result.deleted_count} invalid documents from {collection_name} collection")
+            return result.deleted_count
+        except Exception as e:
+            logger.error(f"Error quarantining invalid documents from {collection_name} collection: {e}")
+            return None
+
+
+def quarantine_in_background(collection_name: str, ids: list[Any]) -> None:
+    """
+    Drops invalid documents from the local caches straight away, and moves them to quarantine
+    without making the caller wait. Documents that fail to move are found again by the next analysis.
+    :param collection_name: The collection the documents are in.
+    :param ids: The ObjectIds of the documents to move.
+    :return: None
+    """
+    if not ids:
+        return
+    
+    if collection_name == "messages":
+        for object_id in ids:
+            message_store.remove_object_id(object_id)
+    _data_changed(collection_name)
+    
+    task = asyncio.get_running_loop().create_task(quarantine_documents(collection_name, list(ids)), name=f"quarantine-{collection_name}")
+    _quarantine_tasks.add(task)
+    task.add_done_callback(_quarantine_tasks.discard)
+
+
+async def set_schema_validation(collection_name: str, action: doc_validation.ValidationAction) -> bool:
+    """
+    Enables or disables schema validation of inserts into a collection, creating the collection if needed.
+    With "error", MongoDB rejects malformed documents so they never reach the analysis commands.
+    :param collection_name: One of the collections in doc_validation.SCHEMAS.
+    :param action: "error" to reject invalid documents, "warn" to only log them in the server log, "off" to disable validation.
+    :return: If the validator was applied.
+    """
+    if collection_name not in doc_validation.SCHEMAS:
+        raise ValueError(f"No schema defined for {collection_name} collection")
+    
+    client = await _connect()
+    if not client:
+        return False
+    
+    db = client["discord"]
+    options = doc_validation.validator_command(collection_name, action)
+    
+    try:
+        if await db.list_collection_names(filter={"name": collection_name}):
+            await db.command("collMod", collection_name, **options)
+        else:
+            await db.create_collection(collection_name, **options)
+        logger.info(f"Set schema validation of {collection_name} collection to {action}")
+        return True
+    except Exception as e:
+        logger.error(f"Error setting schema validation of {collection_name} collection: {e}")
+        return False
+
+
 async def insert_many_db_entries(collection_name: str, query: list[Mapping[str, Any]]) -> int | None:
     """
     Generic function to insert multiple entries into a specified MongoDB await collection.
@@ -414,6 +1151,7 @@ async def insert_many_db_entries(collection_name: str, query: list[Mapping[str,
     
     try:
         result: InsertManyResult = await collection.insert_many(query)
+        _data_changed(collection_name)
         if result.acknowledged:
             logger.info(f"Inserted {len(result.inserted_ids)} entries into {collection_name} collection")
             return len(result.inserted_ids)
@@ -484,17 +1222,206 @@ async def get_many_from_db(
         return None
 
 
-async def edit_db_message(message_id: str, content: str) -> bool:
+async def stream_from_db(
+        collection_name: str,
+        query: Mapping[str, Any],
+        projection: Mapping[str, Any] | None = None,
+        sort_by: str | None = None,
+        direction: Literal["asc", "desc"] = "asc",
+        limit: int = 0,
+        batch_size: int = 500
+    ) -> AsyncGenerator[dict[str, Any]]:
+    """
+    Generic function to iterate over documents from a specified MongoDB collection without loading them all at once.
+    
+    The cursor fetches batch_size documents per round trip, and only the fields in projection if one is given.
+    If the DB can't be reached or the cursor fails part way through, the error is logged and iteration stops.
+    Direction should be either "asc" for ascending or "desc" for descending.
+    """
+    if direction not in ["asc", "desc"]:
+        raise ValueError("Direction must be either 'asc' for ascending or 'desc' for descending.")
+    
+    client = await _connect()
+    if not client:
+        return
+    
+    db = client["discord"]
+    collection: AsyncCollection[Mapping[str, Any]] = db[collection_name]
+    
+    cursor = collection.find(query, projection, batch_size=batch_size)
+    if sort_by is not None:
+        cursor = cursor.sort(sort_by, pymongo.ASCENDING if direction == "asc" else pymongo.DESCENDING)
+    if limit > 0:
+        cursor = cursor.limit(limit)
+    
+    try:
+        async for doc in cursor:
+            yield dict(doc)
+    except Exception as e:
+        logger.error(f"Error streaming data from {collection_name} collection: {e}")
+    finally:
+        await cursor.close()
+
+
+async def stream_batches_from_db(
+        collection_name: str,
+        query: Mapping[str, Any],
+        projection: Mapping[str, Any] | None = None,
+        sort_by: str | None = None,
+        direction: Literal["asc", "desc"] = "asc",
+        limit: int = 0,
+        batch_size: int = 500
+    ) -> AsyncIterator[list[dict[str, Any]]]:
+    """
+    Same as stream_from_db, but yields lists of up to batch_size documents.
+    """
+    batch: list[dict[str, Any]] = []
+    docs = stream_from_db(collection_name, query, projection, sort_by, direction, limit, batch_size)
+    async with contextlib.aclosing(docs):
+        async for doc in docs:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    
+    if batch:
+        yield batch
+
+
+async def aggregate_db(collection_name: str, pipeline: Sequence[Mapping[str, Any]]) -> list[dict[str, Any]] | None:
+    """
+    Generic function to run an aggregation pipeline on a specified MongoDB collection.
+    Returns None if the pipeline could not be run, e.g. because the server does not support one of its stages.
+    """
+    client = await _connect()
+    if not client:
+        return None
+    
+    db = client["discord"]
+    collection: AsyncCollection[Mapping[str, Any]] = db[collection_name]
+    
+    try:
+        cursor = await collection.aggregate(pipeline, allowDiskUse=True)
+        return [dict(result) async for result in cursor]
+    except Exception as e:
+        logger.error(f"Error running aggregation on {collection_name} collection: {e}")
+        return None
+
+
+async def explain_query(
+        collection_name: str,
+        query: Mapping[str, Any],
+        sort: list[tuple[str, int]] | None = None
+    ) -> dict[str, Any] | None:
+    """
+    Get the query plan and execution stats MongoDB uses for a find on a collection.
+    """
+    client = await _connect()
+    if not client:
+        return None
+    
+    db = client["discord"]
+    collection: AsyncCollection[Mapping[str, Any]] = db[collection_name]
+    
+    try:
+        cursor = collection.find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        return dict(await cursor.explain())
+    except Exception as e:
+        logger.error(f"Error explaining query on {collection_name} collection: {e}")
+        return None
+
+
+async def estimated_count(collection_name: str) -> int | None:
+    """
+    Get the approximate number of documents in a collection from its metadata, without scanning it.
+    """
+    client = await _connect()
+    if not client:
+        return None
+    
+    db = client["discord"]
+    collection: AsyncCollection[Mapping[str, Any]] = db[collection_name]
+    
+    try:
+        return await collection.estimated_document_count()
+    except Exception as e:
+        logger.error(f"Error counting documents in {collection_name} collection: {e}")
+        return None
+
+
+def _stored_message_copy(message_id: str) -> dict[str, Any] | None:
+    # Copied, apply_edit replaces the edits of the stored document
+    cached = message_store.get(message_id)
+    return dict(cached) if cached is not None else None
+
+
+def _spool_message_edit(
+        message_id: str, query: dict[str, Any], update: dict[str, Any], edit: dict[str, Any], max_edits: int,
+    ) -> dict[str, Any] | None:
+    """Spools an edit for when the DB is back, returning the message as it was from the message store"""
+    before = _stored_message_copy(message_id)
+    if _spool(SpooledWrite(op="update", collection="messages", query=query, update=update)):
+        message_store.apply_edit(message_id, edit, max_edits)
+    return before
+
+
+async def record_message_edit(message_id: str, content: str, max_edits: int = 0) -> dict[str, Any] | None:
+    """
+    Appends an edit to a message's edit history in a single atomic update, so concurrent edits can't overwrite each other.
+    :param message_id: The Discord ID of the edited message.
+    :param content: The new content of the message.
+    :param max_edits: Keep only this many of the most recent edits, 0 keeps every edit.
+    :return: The message as it was before the edit, with only its original content and latest edit,
+             or None if it isn't in the DB.
+    """
     logger.debug(f"Editing message {message_id}")
-    current = await get_from_db("messages", {"id": message_id})
+    edit = {"timestamp": datetime.datetime.now(datetime.UTC).timestamp(), "content": content}
+    push: dict[str, Any] = {"$each": [edit], "$slice": -max_edits} if max_edits > 0 else edit
+    query: dict[str, Any] = {"id": message_id}
+    update: dict[str, Any] = {"$push": {"edits": push}}
+    
+    client = await _connect()
+    if not client or write_spool.pending:
+        return _spool_message_edit(message_id, query, update, edit, max_edits)
     
-    if current is None:
+    db = client["discord"]
+    collection: AsyncCollection[Mapping[str, Any]] = db["messages"]
+    
+    try:
+        before: Mapping[str, Any] | None = None
+        for _ in range(2):
+            before = await collection.find_one_and_update(
+                    query,
+                    update,
+                    projection={"content": 1, "edits": {"$slice": -1}},
+                    return_document=ReturnDocument.BEFORE,
+            )
+            if before is not None or not len(message_queue):
+                break
+            
+            # Messages are often edited right after they were sent, while still waiting in the ingest queue
+            await message_queue.flush()
+            if write_spool.pending:
+                # The message was spooled, the edit is replayed after it
+                return _spool_message_edit(message_id, query, update, edit, max_edits)
+    except ConnectionFailure as e:
+        connection.mark_unhealthy(e)
+        logger.warning(f"Lost connection editing message {message_id}, spooling the edit: {e}")
+        return _spool_message_edit(message_id, query, update, edit, max_edits)
+    except Exception as e:
+        logger.error(f"Error editing message {message_id}: {e}")
+        return None
+    
+    if before is None:
         logger.error(f"failed to edit message {message_id}. Message not found in DB")
-        return False
+        return None
     
-    edits = current.get("edits", [])
-    edits.append({"timestamp": datetime.datetime.now(datetime.UTC).timestamp(), "content": content})
-    return await edit_db_entry("messages", {"id": message_id}, {"edits": edits})
+    message_store.apply_edit(message_id, edit, max_edits)
+    _data_changed("messages")
+    return dict(before)
+
 
 async def get_xp_all() -> list[dict[str, Any]] | None:
     return await get_many_from_db("xp", {})
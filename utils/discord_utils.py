@@ -2,7 +2,8 @@ import asyncio
 import datetime
 import logging
 import traceback
-from typing import TypeVar
+from collections.abc import Iterable
+from typing import Final, TypeVar
 
 import discord
 from cachetools import TTLCache
@@ -30,10 +31,16 @@ class TTLLRUCache[K, V](TTLCache[K, V]):
         except KeyError:
             return default
 
+USER_FETCH_CONCURRENCY: Final[int] = 5  # REST user lookups in flight at once
+MISSING_USER_TTL: Final[int] = 3600  # Seconds an ID the API doesn't know is remembered as missing
+
 _member_cache: TTLLRUCache[int, discord.Member | None] = TTLLRUCache(25, 300)
-_user_cache: TTLLRUCache[int, discord.User | None] = TTLLRUCache(25, 300)
+# Users fetched from the API, the gateway cache is checked before these on every lookup
+_user_cache: TTLLRUCache[int, discord.User] = TTLLRUCache(512, 300)
+_missing_user_cache: TTLLRUCache[int, None] = TTLLRUCache(512, MISSING_USER_TTL)
 _channel_cache: TTLLRUCache[int, discord.abc.GuildChannel | discord.Thread | None] = TTLLRUCache(25, 300)
 _api_lock: asyncio.Lock = asyncio.Lock()
+_user_fetch_slots: asyncio.Semaphore = asyncio.Semaphore(USER_FETCH_CONCURRENCY)
 
 async def _get_member_by_id(guild: discord.Guild, member_id: int) -> discord.Member | None:
     global _member_cache
@@ -69,50 +76,64 @@ async def get_member_by_id(member_id: int, bot: CoolBot) -> discord.Member | Non
     async with _api_lock:
         return await _get_member_by_id(guild, member_id)
 
-async def _unsafe_get_member_by_id(member_id: int, bot: CoolBot) -> discord.Member | None:
-    guild: discord.Guild | None = bot.get_guild(bot.config.guild_id)
-    if guild is None:
-        logger.error("Guild not found when trying to get member by ID.")
-        return None
-
-    return await _get_member_by_id(guild, member_id)
-
-async def _get_user_by_id(
-        user_id: int,
-        bot: CoolBot,
-    ) -> discord.User | None:
-    global _user_cache
-    logger.debug(f"Getting user {user_id} by ID.")
-    
-    if user_id in _user_cache:
-        logger.debug(f"User {user_id} found in cache.")
-        return _user_cache[user_id]
-    
-    user = bot.get_user(user_id)
-    if user is not None:
-        logger.debug(f"User {user_id} found in discord cache.")
-        _user_cache[user_id] = user
-        return user
-    
-    try:
+async def _fetch_user(user_id: int, bot: CoolBot) -> discord.User | None:
+    async with _user_fetch_slots:
         logger.debug(f"User {user_id} not found in discord cache. Fetching from API.")
-        user = await bot.fetch_user(user_id)
-        logger.debug(f"User {user_id} found in API.")
-        _user_cache[user_id] = user
-        return user
+        retried: bool = False
+        while True:
+            try:
+                user = await bot.fetch_user(user_id)
+                _user_cache[user_id] = user
+                return user
+            
+            except discord.NotFound:
+                logger.debug(f"User {user_id} not found in API.")
+                _missing_user_cache[user_id] = None
+                return None
+            
+            except discord.RateLimited as e:
+                # Only raised for waits longer than discord.py sleeps by itself. The slot is held while waiting,
+                # so the other lookups slow down too instead of running into the same limit
+                if retried:
+                    logger.warning(f"Still rate limited fetching user {user_id}, giving up")
+                    return None
+                logger.warning(f"Rate limited fetching user {user_id}, retrying in {e.retry_after:.1f}s")
+                await asyncio.sleep(e.retry_after)
+                retried = True
+            
+            except discord.HTTPException as e:
+                logger.warning(f"Failed to fetch user {user_id}: {e}")
+                return None
+
+async def resolve_users(user_ids: Iterable[int], bot: CoolBot) -> dict[int, discord.User | discord.Member | None]:
+    """
+    Resolve many user IDs at once.
+    Guild members and users come from the gateway cache, then from the fetched user caches, and the remaining IDs
+    are fetched from the API concurrently, at most USER_FETCH_CONCURRENCY at a time.
+    Users the API doesn't know are cached as None for MISSING_USER_TTL seconds, other API errors aren't cached.
+    :param user_ids: The IDs to resolve, duplicates are looked up once.
+    :param bot: The bot.
+    :return: Each ID mapped to the member if they are in the guild, otherwise the user, or None if they can't be found.
+    """
+    guild: discord.Guild | None = bot.get_guild(bot.config.guild_id)
+    resolved: dict[int, discord.User | discord.Member | None] = {}
+    to_fetch: list[int] = []
+    for user_id in dict.fromkeys(user_ids):
+        user: discord.User | discord.Member | None = guild.get_member(user_id) if guild is not None else None
+        if user is None:
+            user = bot.get_user(user_id) or _user_cache.get(user_id)
+        if user is not None or user_id in _missing_user_cache:
+            resolved[user_id] = user
+        else:
+            to_fetch.append(user_id)
     
-    except discord.HTTPException:
-        logger.debug(f"User {user_id} not found in API.")
-        _user_cache[user_id] = None
-        return None
+    if to_fetch:
+        fetched = await asyncio.gather(*(_fetch_user(user_id, bot) for user_id in to_fetch))
+        resolved.update(zip(to_fetch, fetched, strict=True))
+    return resolved
 
 async def get_user_by_id(user_id: int, bot: CoolBot) -> discord.User | discord.Member | None:
-    async with _api_lock:
-        member = await get_member_by_id(user_id, bot)
-    if member is not None:
-        return member
-    async with _api_lock:
-        return await _unsafe_get_member_by_id(user_id, bot)
+    return (await resolve_users([user_id], bot))[user_id]
 
 async def get_channel_by_id(channel_id: int, bot: CoolBot) -> discord.abc.GuildChannel | discord.Thread | None:
     async with _api_lock:
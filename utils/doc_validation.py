@@ -0,0 +1,80 @@
+"""
+Document schemas for the collections the analysis commands read, enforced by MongoDB at insert time
+"""
+from collections.abc import Collection
+from typing import Any, Final, Literal
+
+ValidationAction = Literal["error", "warn", "off"]
+
+QUARANTINE_SUFFIX: Final[str] = "_quarantine"
+NUMBER: Final[list[str]] = ["double", "int", "long", "decimal"]
+
+MESSAGE_SCHEMA: Final[dict[str, Any]] = {
+    "bsonType":   "object",
+    "required":   [
+        "author", "author_id", "author_global_name",
+        "content", "reply_to", "HasAttachments",
+        "timestamp", "channel", "channel_id", "id",
+    ],
+    "properties": {
+        "author":             {"bsonType": "string"},
+        "author_id":          {"bsonType": "string"},
+        "author_global_name": {"bsonType": ["string", "null"]},
+        "content":            {"bsonType": "string"},
+        "reply_to":           {"bsonType": ["string", "null"]},
+        "HasAttachments":     {"bsonType": "bool"},
+        "timestamp":          {"bsonType": NUMBER},
+        "id":                 {"bsonType": "string"},
+        "channel":            {"bsonType": "string"},
+        "channel_id":         {"bsonType": "string"},
+        "edits":              {"bsonType": "array"},
+    },
+}
+
+VOICE_SESSION_SCHEMA: Final[dict[str, Any]] = {
+    "bsonType":   "object",
+    "required":   ["user_id", "channel_id", "duration_seconds"],
+    "properties": {
+        "user_id":          {"bsonType": "string"},
+        "channel_id":       {"bsonType": ["string", "int", "long"]},
+        "duration_seconds": {"bsonType": NUMBER, "minimum": 0},
+        "timestamp":        {"bsonType": NUMBER},
+    },
+}
+
+SCHEMAS: Final[dict[str, dict[str, Any]]] = {
+    "messages":       MESSAGE_SCHEMA,
+    "voice_sessions": VOICE_SESSION_SCHEMA,
+}
+
+
+def quarantine_name(collection_name: str) -> str:
+    """The side collection invalid documents of ``collection_name`` are moved to"""
+    return collection_name + QUARANTINE_SUFFIX
+
+
+def validator_command(collection_name: str, action: ValidationAction) -> dict[str, Any]:
+    """
+    Build the collMod options enabling or disabling schema validation on a collection.
+    The "moderate" level only checks inserts and updates of documents that are already valid,
+    so existing malformed documents can still be cleaned up by the analysis path.
+    """
+    if action == "off":
+        return {"validator": {}, "validationLevel": "off"}
+    return {
+        "validator":        {"$jsonSchema": SCHEMAS[collection_name]},
+        "validationLevel":  "moderate",
+        "validationAction": action,
+    }
+
+
+def quarantine_pipeline(collection_name: str, ids: Collection[Any], quarantined_at: float) -> list[dict[str, Any]]:
+    """
+    Aggregation pipeline copying the given documents, in full, to the quarantine collection.
+    Documents quarantined before are left as they are, so an interrupted cleanup can be retried.
+    """
+    return [
+        {"$match": {"_id": {"$in": list(ids)}}},
+        {"$addFields": {"quarantined_at": quarantined_at}},
+        {"$merge": {"into": quarantine_name(collection_name), "on": "_id", "whenMatched": "keepExisting", "whenNotMatched": "insert"}},
+    ]
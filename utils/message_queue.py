@@ -0,0 +1,139 @@
+"""
+Write-behind queue that batches message inserts
+"""
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+logger = logging.getLogger("discord")
+
+FlushFunc = Callable[[list[dict[str, Any]]], Awaitable[None]]
+
+
+class MessageIngestQueue:
+    """
+    Buffers documents and writes them in batches from a background task.
+    
+    A batch is flushed once it holds ``max_batch`` documents or ``flush_interval`` seconds after
+    its first document arrived, whichever comes first, or as soon as ``flush`` is called.
+    At most ``max_buffered`` documents wait in the queue; when it is full, ``put`` waits for the writer to catch up.
+    """
+    
+    def __init__(self, flush_func: FlushFunc, max_batch: int = 100, flush_interval: float = 1.0, max_buffered: int = 5000):
+        self._flush_func: FlushFunc = flush_func
+        self.max_batch: int = max_batch
+        self.flush_interval: float = flush_interval
+        # None stops the writer, a future asks for everything queued before it to be written and is resolved once it is
+        self._queue: asyncio.Queue[dict[str, Any] | asyncio.Future[None] | None] = asyncio.Queue(maxsize=max_buffered)
+        self._worker: asyncio.Task[None] | None = None
+        self._pending: list[dict[str, Any]] = []  # batch taken from the queue but not yet written
+        self._flushes: list[asyncio.Future[None]] = []  # flush requests waiting for the pending batch
+        self._closed: bool = False
+    
+    def __len__(self) -> int:
+        return self._queue.qsize() + len(self._pending)
+    
+    def _ensure_worker(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run(), name="message-ingest-queue")
+    
+    async def put(self, doc: dict[str, Any]) -> None:
+        """Queue a document for insertion. Once the queue has been drained, documents are written immediately"""
+        if self._closed:
+            await self._flush_func([doc])
+            return
+        
+        self._ensure_worker()
+        await self._queue.put(doc)
+    
+    async def flush(self) -> None:
+        """Write everything queued so far now, instead of when its batch fills up or times out"""
+        if self._closed or not len(self):
+            return
+        
+        self._ensure_worker()
+        written: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        await self._queue.put(written)
+        await written
+    
+    def _resolve_flushes(self) -> None:
+        for written in self._flushes:
+            if not written.done():
+                written.set_result(None)
+        self._flushes = []
+    
+    async def _fill_batch(self) -> bool:
+        """
+        Move documents into the pending batch until it is full or times out.
+        The batch is kept on the instance so nothing is lost if the writer is cancelled part way through.
+        Returns whether the stop sentinel was seen.
+        """
+        first = await self._queue.get()
+        if first is None:
+            return True
+        if isinstance(first, asyncio.Future):
+            self._flushes.append(first)
+            return False
+        
+        self._pending.append(first)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(self._pending) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                doc = await asyncio.wait_for(self._queue.get(), timeout)
+            except TimeoutError:
+                break
+            if doc is None:
+                return True
+            if isinstance(doc, asyncio.Future):
+                self._flushes.append(doc)
+                break
+            self._pending.append(doc)
+        
+        return False
+    
+    async def _run(self) -> None:
+        stop: bool = False
+        while not stop:
+            stop = await self._fill_batch()
+            if self._pending:
+                try:
+                    await self._flush_func(self._pending)
+                except Exception as e:
+                    logger.error(f"Error flushing {len(self._pending)} queued messages: {e}")
+                self._pending = []
+            self._resolve_flushes()
+    
+    async def drain(self) -> None:
+        """
+        Stop the background writer and write everything still buffered.
+        Safe to call from a different event loop than the one the writer ran on, e.g. at exit.
+        """
+        self._closed = True
+        worker = self._worker
+        self._worker = None
+        
+        # A writer left over from a closed loop can't be awaited, its batch is picked up from _pending instead
+        if worker is not None and not worker.done() and worker.get_loop() is asyncio.get_running_loop():
+            await self._queue.put(None)
+            await worker
+        
+        remaining: list[dict[str, Any]] = self._pending
+        self._pending = []
+        while not self._queue.empty():
+            doc = self._queue.get_nowait()
+            if isinstance(doc, asyncio.Future):
+                self._flushes.append(doc)
+            elif doc is not None:
+                remaining.append(doc)
+        
+        for i in range(0, len(remaining), self.max_batch):
+            await self._flush_func(remaining[i:i + self.max_batch])
+        self._resolve_flushes()
+        
+        if remaining:
+            logger.info(f"Drained {len(remaining)} queued messages")
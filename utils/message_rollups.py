@@ -0,0 +1,124 @@
+"""
+Daily per-user, per-channel message counters, kept up to date as messages are inserted
+"""
+from collections.abc import Collection, Iterable, Mapping
+from typing import Any, Final
+
+from utils import db_indexes
+from utils.write_spool import SpooledWrite
+
+ROLLUP_COLLECTION: Final[str] = "message_rollups"
+REBUILD_COLLECTION: Final[str] = "message_rollups_rebuild"  # A rebuild is staged here, then renamed over the rollups
+DAY_SECONDS: Final[int] = 86400
+
+db_indexes.register_index(ROLLUP_COLLECTION, [("day", 1), ("author_id", 1), ("channel_id", 1)], unique=True)
+db_indexes.register_index(ROLLUP_COLLECTION, [("author_id", 1), ("day", 1)])
+db_indexes.register_query("Rollups since day", ROLLUP_COLLECTION, {"day": {"$gte": 0}})
+db_indexes.register_query("Rollups of user", ROLLUP_COLLECTION, {"author_id": "0", "day": {"$gte": 0}})
+
+
+def day_start(timestamp: float) -> int:
+    """The UNIX timestamp of the UTC midnight at or before ``timestamp``"""
+    return int(timestamp // DAY_SECONDS) * DAY_SECONDS
+
+
+def _rollup_rows(docs: Iterable[Mapping[str, Any]], required_keys: Collection[str]) -> dict[tuple[int, str, str], dict[str, Any]]:
+    """
+    Sum up messages by the rollup row they count towards.
+    Only messages the raw analysis counts are included, those with every required key and text content.
+    """
+    rows: dict[tuple[int, str, str], dict[str, Any]] = {}
+    for doc in docs:
+        if not all(key in doc for key in required_keys):
+            continue
+        content = doc["content"]
+        timestamp = doc["timestamp"]
+        if not isinstance(content, str) or not isinstance(timestamp, (int, float)):
+            continue
+        
+        key = (day_start(timestamp), doc["author_id"], doc["channel_id"])
+        row = rows.setdefault(key, {"count": 0, "chars": 0, "words": 0, "first": timestamp, "last": timestamp})
+        row["count"] += 1
+        row["chars"] += len(content)
+        row["words"] += len(content.split())
+        row["first"] = min(row["first"], timestamp)
+        row["last"] = max(row["last"], timestamp)
+    
+    return rows
+
+
+def rollup_updates(docs: Iterable[Mapping[str, Any]], required_keys: Collection[str]) -> list[SpooledWrite]:
+    """
+    Build the upserts adding a batch of newly inserted messages to their rollup rows.
+    Messages in the same batch sharing a row are combined into a single update.
+    """
+    return [
+        SpooledWrite(
+                op="update",
+                collection=ROLLUP_COLLECTION,
+                query={"day": day, "author_id": author_id, "channel_id": channel_id},
+                update={
+                    "$inc": {"count": row["count"], "chars": row["chars"], "words": row["words"]},
+                    "$min": {"first": row["first"]},
+                    "$max": {"last": row["last"]},
+                },
+                upsert=True,
+        )
+        for (day, author_id, channel_id), row in _rollup_rows(docs, required_keys).items()
+    ]
+
+
+def removal_updates(docs: Iterable[Mapping[str, Any]], required_keys: Collection[str]) -> list[SpooledWrite]:
+    """
+    Build the writes taking deleted messages back out of their rollup rows, then deleting the rows left without messages.
+    The first and last timestamps of a row aren't narrowed, they stay bounds of its remaining messages.
+    """
+    rows = _rollup_rows(docs, required_keys)
+    keys = [{"day": day, "author_id": author_id, "channel_id": channel_id} for day, author_id, channel_id in rows]
+    decrements = [
+        SpooledWrite(
+                op="update",
+                collection=ROLLUP_COLLECTION,
+                query=key,
+                update={"$inc": {"count": -row["count"], "chars": -row["chars"], "words": -row["words"]}},
+        )
+        for key, row in zip(keys, rows.values(), strict=True)
+    ]
+    emptied = [SpooledWrite(op="delete", collection=ROLLUP_COLLECTION, query={**key, "count": {"$lte": 0}}) for key in keys]
+    return decrements + emptied
+
+
+def rebuild_pipeline(match: Mapping[str, Any], out: str | None = ROLLUP_COLLECTION) -> list[dict[str, Any]]:
+    """
+    Aggregation pipeline that recomputes the rollup rows of the matched messages from the messages collection.
+    The rows replace the collection ``out``, or are returned if it is None.
+    """
+    pipeline: list[dict[str, Any]] = [
+        {"$match": match},
+        {"$group": {
+            "_id":   {
+                "day":        {"$toLong": {"$subtract": ["$timestamp", {"$mod": ["$timestamp", DAY_SECONDS]}]}},
+                "author_id":  "$author_id",
+                "channel_id": "$channel_id",
+            },
+            "count": {"$sum": 1},
+            "chars": {"$sum": {"$strLenCP": "$content"}},
+            "words": {"$sum": {"$size": {"$regexFindAll": {"input": "$content", "regex": r"\S+"}}}},
+            "first": {"$min": "$timestamp"},
+            "last":  {"$max": "$timestamp"},
+        }},
+        {"$project": {
+            "_id":        0,
+            "day":        "$_id.day",
+            "author_id":  "$_id.author_id",
+            "channel_id": "$_id.channel_id",
+            "count":      1,
+            "chars":      1,
+            "words":      1,
+            "first":      1,
+            "last":       1,
+        }},
+    ]
+    if out is not None:
+        pipeline.append({"$out": out})
+    return pipeline
@@ -0,0 +1,167 @@
+"""
+In-process copy of the messages collection, kept in sync incrementally
+"""
+import asyncio
+import logging
+import time
+from collections.abc import Collection, Iterable, Mapping
+from typing import Any
+
+from bson import ObjectId
+
+from utils.word_index import WordIndex
+
+logger = logging.getLogger("discord")
+
+
+def _doc_key(doc: Mapping[str, Any]) -> str:
+    """Documents are keyed by their Discord message ID, falling back to the DB ID for malformed documents"""
+    if "id" in doc:
+        return str(doc["id"])
+    return str(doc.get("_id"))
+
+
+class MessageStore:
+    """
+    Holds every document of the messages collection in memory.
+    
+    The first sync downloads the whole collection, after that only documents with an ``_id``
+    greater than the high-water mark are pulled. Writes made by this process (inserts, edits and
+    deletes) are applied directly, so a refresh costs O(new messages) rather than O(history).
+    A full resync still happens every ``full_resync_interval`` seconds to pick up changes made
+    outside the bot.
+    ``word_index`` follows every document that enters or leaves the store, indexing those with every key
+    in ``required_keys``.
+    """
+    
+    def __init__(self, refresh_interval: float = 60, full_resync_interval: float = 6 * 3600, required_keys: Collection[str] = ()):
+        self.refresh_interval: float = refresh_interval
+        self.full_resync_interval: float = full_resync_interval
+        self.lock: asyncio.Lock = asyncio.Lock()
+        self._docs: dict[str, dict[str, Any]] = {}
+        self._keys_by_object_id: dict[Any, str] = {}
+        self._high_water: ObjectId | None = None
+        self._loaded: bool = False
+        self._last_refresh: float = 0.0
+        self._last_full_sync: float = 0.0
+        self._snapshot: list[Mapping[str, Any]] | None = None
+        self.version: int = 0
+        self.word_index: WordIndex = WordIndex(required_keys)
+    
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+    
+    @property
+    def high_water(self) -> ObjectId | None:
+        return self._high_water
+    
+    def __len__(self) -> int:
+        return len(self._docs)
+    
+    def needs_refresh(self) -> bool:
+        return not self._loaded or time.monotonic() - self._last_refresh >= self.refresh_interval
+    
+    def needs_full_sync(self) -> bool:
+        return not self._loaded or time.monotonic() - self._last_full_sync >= self.full_resync_interval
+    
+    def _changed(self) -> None:
+        self._snapshot = None
+        self.version += 1
+    
+    def _bump_high_water(self, obj_id: Any) -> None:
+        if not isinstance(obj_id, ObjectId):
+            return
+        if self._high_water is None or obj_id > self._high_water:
+            self._high_water = obj_id
+    
+    def _put(self, doc: Mapping[str, Any]) -> None:
+        key = _doc_key(doc)
+        old = self._docs.get(key)
+        if old is not None:
+            self.word_index.remove(old)
+            if "_id" in old:
+                self._keys_by_object_id.pop(old["_id"], None)
+        
+        self._docs[key] = dict(doc)
+        self.word_index.add(doc)
+        if "_id" in doc:
+            self._keys_by_object_id[doc["_id"]] = key
+    
+    def load_all(self, docs: Iterable[Mapping[str, Any]]) -> None:
+        """Replace the store contents with a full download of the collection"""
+        self._docs.clear()
+        self._keys_by_object_id.clear()
+        self.word_index.clear()
+        self._high_water = None
+        for doc in docs:
+            self._put(doc)
+            self._bump_high_water(doc.get("_id"))
+        
+        now = time.monotonic()
+        self._loaded = True
+        self._last_refresh = now
+        self._last_full_sync = now
+        self._changed()
+        logger.info(f"Message store loaded {len(self._docs)} messages")
+    
+    def apply_delta(self, docs: Iterable[Mapping[str, Any]]) -> int:
+        """Merge documents newer than the high-water mark. Returns how many were merged"""
+        count: int = 0
+        for doc in docs:
+            self._put(doc)
+            self._bump_high_water(doc.get("_id"))
+            count += 1
+        
+        self._last_refresh = time.monotonic()
+        if count:
+            self._changed()
+        logger.debug(f"Message store merged {count} new messages")
+        return count
+    
+    def add(self, doc: Mapping[str, Any]) -> None:
+        """
+        Add a document this process just inserted.
+        The high-water mark is not moved, so documents inserted concurrently elsewhere are still picked up.
+        """
+        if not self._loaded:
+            return
+        self._put(doc)
+        self._changed()
+    
+    def get(self, message_id: str) -> dict[str, Any] | None:
+        if not self._loaded:
+            return None
+        return self._docs.get(message_id)
+    
+    def apply_edit(self, message_id: str, edit: Mapping[str, Any], max_edits: int = 0) -> None:
+        doc = self._docs.get(message_id)
+        if doc is None:
+            return
+        edits = [*doc.get("edits", []), dict(edit)]
+        doc["edits"] = edits[-max_edits:] if max_edits > 0 else edits
+        self._changed()
+    
+    def remove(self, message_id: str) -> None:
+        doc = self._docs.pop(message_id, None)
+        if doc is None:
+            return
+        self.word_index.remove(doc)
+        if "_id" in doc:
+            self._keys_by_object_id.pop(doc["_id"], None)
+        self._changed()
+    
+    def remove_object_id(self, obj_id: Any) -> None:
+        key = self._keys_by_object_id.get(obj_id)
+        if key is not None:
+            self.remove(key)
+    
+    def invalidate(self) -> None:
+        """Force the next sync to download the whole collection again"""
+        self._loaded = False
+    
+    def snapshot(self) -> list[Mapping[str, Any]]:
+        """A list of all stored documents. Reused between calls until the store changes"""
+        if self._snapshot is None:
+            self._snapshot = list(self._docs.values())
+        return self._snapshot
@@ -0,0 +1,113 @@
+"""
+Merging of voice sessions split by bot restarts, in the voice_sessions collection itself
+"""
+from collections.abc import Iterable, Mapping
+from typing import Any, Final, NotRequired, TypedDict
+
+from pymongo import DeleteOne, UpdateOne
+
+from utils import db_indexes
+
+COMPACTION_COLLECTION: Final[str] = "voice_compaction"
+COMPACTION_STATE_ID: Final[str] = "voice_sessions"  # The state document, holding the watermark of what has been compacted
+MAX_GAP_SECONDS: Final[int] = 60  # Sessions of a user in a channel at most this far apart are one session
+REQUIRED_KEYS: Final[tuple[str, ...]] = ("_id", "user_id", "channel_id", "duration_seconds", "timestamp")
+
+db_indexes.register_index("voice_sessions", [("user_id", 1), ("channel_id", 1), ("timestamp", 1)])
+db_indexes.register_query(
+        "Voice session before join", "voice_sessions", {"user_id": "0", "channel_id": "0", "timestamp": {"$gte": 0, "$lte": 0}},
+)
+
+
+class CompactionStep(TypedDict):
+    write: UpdateOne | DeleteOne  # Only matches the session if it is still as it was read
+    removed: Mapping[str, Any]  # The session the write stretches or deletes, as it was
+    added: NotRequired[dict[str, Any]]  # The stretched session, as it will be
+
+
+class CompactionPlan(TypedDict):
+    chains: list[list[CompactionStep]]  # The steps merging each chain, the stretch of its first session first
+
+
+def _unchanged_query(session: Mapping[str, Any]) -> dict[str, Any]:
+    """Query matching a session only if it wasn't stretched or replaced since it was read"""
+    return {"_id": session["_id"], "timestamp": session["timestamp"], "duration_seconds": session["duration_seconds"]}
+
+
+def plan_compaction(sessions: Iterable[Mapping[str, Any]]) -> CompactionPlan:
+    """
+    Plan the writes merging every chain of a user's sessions in a channel that follow each other within MAX_GAP_SECONDS.
+    The first session of a chain is stretched to cover the whole chain, gaps included, and the others are deleted.
+    
+    Compacting again finds nothing left to merge. If only some of the writes were applied, the stretched session
+    contains the sessions that weren't deleted yet, and sessions contained in another one of the same user in the
+    same channel are deleted, so compacting again finishes the job.
+    A write only applies to a session still as it was read. If the stretch of a chain doesn't apply, its deletes
+    must be skipped, since the sessions they delete aren't covered.
+    Sessions without a timestamp can't be placed in time and are left alone, like malformed sessions.
+    """
+    chains: dict[tuple[str, str], list[Mapping[str, Any]]] = {}
+    for candidate in sessions:
+        if all(key in candidate for key in REQUIRED_KEYS):
+            chains.setdefault((candidate["user_id"], candidate["channel_id"]), []).append(candidate)
+    
+    plan = CompactionPlan(chains=[])
+    for user_sessions in chains.values():
+        # By start, the longest first, so a session comes before the ones it contains
+        user_sessions.sort(key=lambda s: (s["timestamp"] - s["duration_seconds"], -s["timestamp"]))
+        first = user_sessions[0]
+        start, end = first["timestamp"] - first["duration_seconds"], first["timestamp"]
+        merged: list[Mapping[str, Any]] = []
+        for session in [*user_sessions[1:], None]:
+            if session is not None:
+                session_start = session["timestamp"] - session["duration_seconds"]
+                if session["timestamp"] <= end and session_start >= start:
+                    merged.append(session)
+                    continue
+                if 0 <= session_start - end <= MAX_GAP_SECONDS:
+                    merged.append(session)
+                    end = session["timestamp"]
+                    continue
+            
+            if merged:
+                steps: list[CompactionStep] = []
+                if end != first["timestamp"]:
+                    stretched = {"duration_seconds": end - start, "timestamp": end}
+                    steps.append(CompactionStep(
+                            write=UpdateOne(_unchanged_query(first), {"$set": stretched}), removed=first, added={**first, **stretched},
+                    ))
+                steps.extend(
+                        CompactionStep(write=DeleteOne(_unchanged_query(merged_session)), removed=merged_session)
+                        for merged_session in merged
+                )
+                plan["chains"].append(steps)
+            if session is not None:
+                first, start, end, merged = session, session_start, session["timestamp"], []
+    
+    return plan
+
+
+def adjacent_session_query(session: Mapping[str, Any]) -> dict[str, Any]:
+    """Query for the session of the same user in the same channel that ended at most MAX_GAP_SECONDS before a new one started"""
+    start = session["timestamp"] - session["duration_seconds"]
+    return {
+        "user_id":    session["user_id"],
+        "channel_id": session["channel_id"],
+        "timestamp":  {"$gte": start - MAX_GAP_SECONDS, "$lte": start},
+    }
+
+
+def extend_pipeline(session: Mapping[str, Any]) -> list[dict[str, Any]]:
+    """Update pipeline stretching the session matched by adjacent_session_query to the end of the new one"""
+    return [{"$set": {
+        "duration_seconds": {"$subtract": [session["timestamp"], {"$subtract": ["$timestamp", "$duration_seconds"]}]},
+        "timestamp":        session["timestamp"],
+    }}]
+
+
+def extended_fields(previous: Mapping[str, Any], session: Mapping[str, Any]) -> dict[str, Any]:
+    """The fields extend_pipeline sets on the previous session"""
+    return {
+        "duration_seconds": session["timestamp"] - (previous["timestamp"] - previous["duration_seconds"]),
+        "timestamp":        session["timestamp"],
+    }
@@ -0,0 +1,87 @@
+"""
+Per user voice totals by ISO week and by channel, kept up to date as voice sessions are saved
+"""
+from collections.abc import Iterable, Mapping
+from typing import Any, Final
+
+from utils import db_indexes
+from utils.write_spool import SpooledWrite
+
+TOTALS_COLLECTION: Final[str] = "voice_totals"
+WEEK_SECONDS: Final[int] = 7 * 86400
+MONDAY_OFFSET: Final[int] = 3 * 86400  # The UNIX epoch was a Thursday
+
+# A week row has no channel and a channel row no week, both stored as null
+db_indexes.register_index(TOTALS_COLLECTION, [("user_id", 1), ("week", 1), ("channel_id", 1)], unique=True)
+db_indexes.register_index(TOTALS_COLLECTION, [("week", 1), ("seconds", -1)])
+db_indexes.register_query("Voice totals of week", TOTALS_COLLECTION, {"week": 0}, sort=[("seconds", -1)])
+db_indexes.register_query("Voice total of user in channel", TOTALS_COLLECTION, {"user_id": "0", "week": None, "channel_id": "0"})
+
+TotalsKey = tuple[str, int | None, str | None]  # (user_id, week, channel_id)
+
+
+def week_start(timestamp: float) -> int:
+    """The UNIX timestamp of the UTC Monday midnight starting the ISO week of ``timestamp``"""
+    return int((timestamp + MONDAY_OFFSET) // WEEK_SECONDS) * WEEK_SECONDS - MONDAY_OFFSET
+
+
+def seconds_by_week(start: int, end: int) -> dict[int, int]:
+    """The seconds of [start, end) in each ISO week, a session running over midnight on Sunday counts towards both weeks"""
+    seconds: dict[int, int] = {}
+    week = week_start(start)
+    while week < end or not seconds:
+        seconds[week] = max(min(end, week + WEEK_SECONDS) - max(start, week), 0)
+        week += WEEK_SECONDS
+    return seconds
+
+
+def _add_session(totals: dict[TotalsKey, dict[str, int]], session: Mapping[str, Any], sign: int) -> None:
+    user_id, seconds = session["user_id"], session["duration_seconds"]
+    channel_row = totals.setdefault((user_id, None, str(session["channel_id"])), {"seconds": 0, "sessions": 0})
+    channel_row["seconds"] += sign * seconds
+    channel_row["sessions"] += sign
+    if "timestamp" not in session:
+        return
+    
+    end = session["timestamp"]
+    start = end - seconds
+    for week, week_seconds in seconds_by_week(start, end).items():
+        totals.setdefault((user_id, week, None), {"seconds": 0, "sessions": 0})["seconds"] += sign * week_seconds
+    # A session counts in the week of its last second
+    totals.setdefault((user_id, week_start(max(start, end - 1)), None), {"seconds": 0, "sessions": 0})["sessions"] += sign
+
+
+def session_totals(added: Iterable[Mapping[str, Any]], removed: Iterable[Mapping[str, Any]] = ()) -> dict[TotalsKey, dict[str, int]]:
+    """
+    The change to every totals row from sessions being added, and sessions being removed, e.g. merged into others.
+    Sessions without a timestamp only count towards their channel's row.
+    """
+    totals: dict[TotalsKey, dict[str, int]] = {}
+    for session in added:
+        _add_session(totals, session, 1)
+    for session in removed:
+        _add_session(totals, session, -1)
+    return totals
+
+
+def totals_updates(added: Iterable[Mapping[str, Any]], removed: Iterable[Mapping[str, Any]] = ()) -> list[SpooledWrite]:
+    """Build the upserts applying session_totals, rows the sessions don't change are left out"""
+    return [
+        SpooledWrite(
+                op="update",
+                collection=TOTALS_COLLECTION,
+                query={"user_id": user_id, "week": week, "channel_id": channel_id},
+                update={"$inc": {"seconds": row["seconds"], "sessions": row["sessions"]}},
+                upsert=True,
+        )
+        for (user_id, week, channel_id), row in session_totals(added, removed).items()
+        if row["seconds"] or row["sessions"]
+    ]
+
+
+def totals_documents(sessions: Iterable[Mapping[str, Any]]) -> list[dict[str, Any]]:
+    """Every totals row of the given sessions, for rebuilding the collection from the whole history"""
+    return [
+        {"user_id": user_id, "week": week, "channel_id": channel_id, **row}
+        for (user_id, week, channel_id), row in session_totals(sessions).items()
+    ]
@@ -0,0 +1,190 @@
+"""
+Per-user word statistics, kept up to date as messages enter and leave the message store
+"""
+import collections
+from collections.abc import Collection, Iterable, Mapping
+from typing import Any, Final
+
+from command_utils.analysis.word_stats import WordStats, is_valid_word, split_words
+from utils.message_rollups import day_start
+
+MAX_WINDOWS_PER_USER: Final[int] = 4
+
+
+class WordCounts:
+    """
+    Running word counts of a set of messages.
+    
+    Holds every word with its count for the unique word statistics, and the words passing
+    is_valid_word separately for the top words. Words whose count drops to zero are removed,
+    so the unique word count and length sum stay exact when messages are taken out again.
+    """
+    
+    def __init__(self):
+        self.messages: int = 0
+        self.total_words: int = 0
+        self.unique_length_sum: int = 0
+        self.words: collections.Counter[str] = collections.Counter()
+        self.valid_words: collections.Counter[str] = collections.Counter()
+        self._top: list[tuple[str, int]] | None = None
+    
+    def __len__(self) -> int:
+        return self.messages
+    
+    def _update(self, words: Iterable[str], messages: int, sign: int) -> None:
+        for word in words:
+            count = self.words[word] + sign
+            if count > 0:
+                if sign > 0 and count == 1:
+                    self.unique_length_sum += len(word)
+                self.words[word] = count
+            elif self.words.pop(word, None) is not None:
+                self.unique_length_sum -= len(word)
+            
+            if is_valid_word(word):
+                valid_count = self.valid_words[word] + sign
+                if valid_count > 0:
+                    self.valid_words[word] = valid_count
+                else:
+                    self.valid_words.pop(word, None)
+            self.total_words += sign
+        
+        self.messages += messages
+        self._top = None
+    
+    def add_text(self, content: str, count: int = 1) -> None:
+        """Count ``count`` messages with this content"""
+        self._update(split_words(content) * count, count, 1)
+    
+    def remove_text(self, content: str) -> None:
+        """Take a counted message out again"""
+        self._update(split_words(content), -1, -1)
+    
+    def merge(self, other: WordCounts) -> None:
+        """Add the counts of another set of messages"""
+        for word, count in other.words.items():
+            if word not in self.words:
+                self.unique_length_sum += len(word)
+            self.words[word] += count
+        self.valid_words.update(other.valid_words)
+        self.total_words += other.total_words
+        self.messages += other.messages
+        self._top = None
+    
+    def stats(self) -> WordStats | None:
+        """
+        The word statistics of the counted messages, equal to analyse_word_stats over their contents,
+        except that top words with equal counts may be ordered differently once messages were removed.
+        Everything but the top words is a running total; the top words are cached until the counts change.
+        """
+        if not self.total_words or not self.valid_words:
+            return None
+        
+        if self._top is None:
+            self._top = self.valid_words.most_common(3)
+        
+        unique = len(self.words)
+        most_common_word, most_common_count = self._top[0]
+        return WordStats(
+                most_common_word=most_common_word,
+                most_common_word_count=most_common_count,
+                top_3_words=list(self._top),
+                total_unique_words=unique,
+                average_length=self.unique_length_sum / unique,
+                vocabulary_diversity=(unique / self.total_words) * 100,
+        )
+
+
+class WordIndex:
+    """
+    Word counts per author and per (author, UTC day) of the documents in the message store.
+    
+    Documents are indexed by the ``content`` the analysis reads. Edits are kept as history in ``edits``
+    and leave ``content`` alone, so they don't change the index; a document replaced with a different
+    content, e.g. by a resync, is re-indexed.
+    Only documents with every key in ``required_keys`` are indexed, the same ones the analysis counts.
+    
+    Merging the day buckets of a window costs O(words in the window), so the merged counts of the last
+    MAX_WINDOWS_PER_USER windows asked for per author are kept and updated along with the buckets.
+    A time filter then only merges its window once per author and UTC day, when its first day changes.
+    """
+    
+    def __init__(self, required_keys: Collection[str] = ()):
+        self.required_keys: Collection[str] = required_keys
+        self._users: dict[str, WordCounts] = {}
+        self._days: dict[str, dict[int, WordCounts]] = {}
+        self._windows: dict[str, dict[int, WordCounts]] = {}
+    
+    def _indexed_fields(self, doc: Mapping[str, Any]) -> tuple[str, int, str] | None:
+        if not all(key in doc for key in self.required_keys):
+            return None
+        content = doc.get("content")
+        timestamp = doc.get("timestamp")
+        if not isinstance(content, str) or not isinstance(timestamp, (int, float)) or "author_id" not in doc:
+            return None
+        return str(doc["author_id"]), day_start(timestamp), content
+    
+    def clear(self) -> None:
+        self._users.clear()
+        self._days.clear()
+        self._windows.clear()
+    
+    def add(self, doc: Mapping[str, Any]) -> None:
+        fields = self._indexed_fields(doc)
+        if fields is None:
+            return
+        
+        author_id, day, content = fields
+        self._users.setdefault(author_id, WordCounts()).add_text(content)
+        self._days.setdefault(author_id, {}).setdefault(day, WordCounts()).add_text(content)
+        for since_day, window in self._windows.get(author_id, {}).items():
+            if day >= since_day:
+                window.add_text(content)
+    
+    def remove(self, doc: Mapping[str, Any]) -> None:
+        fields = self._indexed_fields(doc)
+        if fields is None:
+            return
+        
+        author_id, day, content = fields
+        user = self._users.get(author_id)
+        days = self._days.get(author_id, {})
+        bucket = days.get(day)
+        if user is None or bucket is None:
+            return
+        
+        user.remove_text(content)
+        bucket.remove_text(content)
+        for since_day, window in self._windows.get(author_id, {}).items():
+            if day >= since_day:
+                window.remove_text(content)
+        if not bucket:
+            del days[day]
+        if not user:
+            del self._users[author_id]
+            self._days.pop(author_id, None)
+            self._windows.pop(author_id, None)
+    
+    def user_counts(self, author_id: str, since_day: int | None = None) -> WordCounts:
+        """
+        The word counts of an author, over every message or over the whole UTC days starting at ``since_day``.
+        The counts are kept up to date by the index and must not be modified.
+        A window not asked for recently is merged from the day buckets, in O(days of the author + words in the window).
+        """
+        if since_day is None or author_id not in self._users:
+            return self._users.get(author_id) or WordCounts()
+        
+        windows = self._windows.setdefault(author_id, {})
+        window = windows.get(since_day)
+        if window is not None:
+            return window
+        
+        window = WordCounts()
+        for day, bucket in self._days.get(author_id, {}).items():
+            if day >= since_day:
+                window.merge(bucket)
+        if len(windows) >= MAX_WINDOWS_PER_USER:
+            # The oldest window asked for, usually one whose first day has passed
+            del windows[next(iter(windows))]
+        windows[since_day] = window
+        return window
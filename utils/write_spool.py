@@ -0,0 +1,174 @@
+"""
+Local append-only spool for DB writes made while MongoDB is unreachable
+"""
+import asyncio
+import concurrent.futures
+import logging
+import os
+import time
+from collections.abc import Awaitable, Callable, Iterator
+from pathlib import Path
+from typing import Any, BinaryIO, Literal, NotRequired, TypedDict
+
+from bson import json_util
+
+logger = logging.getLogger("discord")
+
+SpoolOp = Literal["insert", "update", "delete"]
+
+
+class SpooledWrite(TypedDict):
+    op: SpoolOp
+    collection: str
+    docs: NotRequired[list[dict[str, Any]]]  # insert
+    query: NotRequired[dict[str, Any]]  # update, delete
+    update: NotRequired[dict[str, Any]]  # update
+    upsert: NotRequired[bool]  # update
+
+
+# Called with runs of consecutive writes of the same op on the same collection, in spool order.
+# Should raise if the DB became unreachable, so the segment is kept and replayed again later.
+ApplyFunc = Callable[[str, SpoolOp, list[SpooledWrite]], Awaitable[None]]
+
+
+def _group_runs(writes: list[SpooledWrite]) -> Iterator[tuple[str, SpoolOp, list[SpooledWrite]]]:
+    run: list[SpooledWrite] = []
+    for write in writes:
+        if run and (write["collection"], write["op"]) != (run[0]["collection"], run[0]["op"]):
+            yield run[0]["collection"], run[0]["op"], run
+            run = []
+        run.append(write)
+    if run:
+        yield run[0]["collection"], run[0]["op"], run
+
+
+def _fsync_segment(segment: BinaryIO, close: bool = False) -> None:
+    try:
+        os.fsync(segment.fileno())
+    except OSError as e:
+        logger.error(f"Failed to fsync spool segment {segment.name}: {e}")
+    if close:
+        segment.close()
+
+
+class WriteSpool:
+    """
+    Appends writes as JSON lines to segment files, and replays them into the DB in bulk later.
+    
+    ``append`` only writes to the OS page cache, so it returns in microseconds. The segment is fsynced
+    at most ``fsync_interval`` seconds later, batching the fsync cost across every write in between.
+    fsyncs and closes run in order on a single thread, so a slow disk doesn't stall the event loop.
+    Segments are rotated once they reach ``segment_max_bytes`` and deleted once fully replayed.
+    Segments left over from a previous run are picked up by the next replay.
+    """
+    
+    def __init__(self, directory: Path = Path("db_spool"), segment_max_bytes: int = 4 * 1024 * 1024, fsync_interval: float = 0.2):
+        self.directory: Path = directory
+        self.segment_max_bytes: int = segment_max_bytes
+        self.fsync_interval: float = fsync_interval
+        self.replay_lock: asyncio.Lock = asyncio.Lock()
+        self._file: BinaryIO | None = None
+        self._segment_bytes: int = 0
+        self._fsync_handle: asyncio.TimerHandle | None = None
+        self._fsync_thread: concurrent.futures.ThreadPoolExecutor | None = None
+        self._pending: bool = self.directory.is_dir() and any(self.directory.glob("*.jsonl"))
+    
+    @property
+    def pending(self) -> bool:
+        """If there are spooled writes that haven't been replayed yet"""
+        return self._pending
+    
+    def append(self, write: SpooledWrite) -> None:
+        line = json_util.dumps(write).encode() + b"\n"
+        if self._file is None or self._segment_bytes + len(line) > self.segment_max_bytes:
+            self._seal()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Nanosecond timestamps keep segments in write order when sorted by name
+            self._file = open(self.directory / f"{time.time_ns():020d}.jsonl", "ab")  # noqa: SIM115 - kept open until sealed
+            self._segment_bytes = 0
+        
+        self._file.write(line)
+        self._file.flush()
+        self._segment_bytes += len(line)
+        self._pending = True
+        self._schedule_fsync()
+    
+    def _schedule_fsync(self) -> None:
+        if self._fsync_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            if self._file is not None:
+                _fsync_segment(self._file)
+            return
+        self._fsync_handle = loop.call_later(self.fsync_interval, self._fsync)
+    
+    def _submit_fsync(self, segment: BinaryIO, close: bool = False) -> concurrent.futures.Future[None]:
+        if self._fsync_thread is None:
+            self._fsync_thread = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="spool-fsync")
+        return self._fsync_thread.submit(_fsync_segment, segment, close)
+    
+    def _fsync(self) -> None:
+        self._fsync_handle = None
+        if self._file is not None:
+            self._submit_fsync(self._file)
+    
+    def _seal(self) -> concurrent.futures.Future[None] | None:
+        """fsync and close the active segment in the background, the next append starts a new one"""
+        if self._fsync_handle is not None:
+            self._fsync_handle.cancel()
+            self._fsync_handle = None
+        if self._file is None:
+            return None
+        
+        # Queued behind the segment's earlier fsyncs, so it is only closed once they are done
+        sealed = self._submit_fsync(self._file, close=True)
+        self._file = None
+        return sealed
+    
+    def close(self) -> None:
+        """Seal the active segment and wait for it to reach the disk"""
+        sealed = self._seal()
+        if sealed is not None:
+            sealed.result()
+        if self._fsync_thread is not None:
+            self._fsync_thread.shutdown()
+            self._fsync_thread = None
+    
+    def _read_segment(self, path: Path) -> list[SpooledWrite]:
+        writes: list[SpooledWrite] = []
+        with open(path, "rb") as segment:
+            for line_no, line in enumerate(segment, start=1):
+                try:
+                    writes.append(json_util.loads(line))
+                except ValueError:
+                    # Most likely the last line, torn by a crash mid-write
+                    logger.error(f"Skipping unreadable line {line_no} in spool segment {path.name}")
+        return writes
+    
+    async def replay(self, apply: ApplyFunc) -> int:
+        """
+        Replay every spooled write in order, deleting each segment once it has been applied.
+        If ``apply`` raises, replay stops and the current segment is kept for the next attempt, so
+        ``apply`` must be idempotent for writes it already applied.
+        :return: The number of writes replayed.
+        """
+        async with self.replay_lock:
+            replayed: int = 0
+            while True:
+                # Writes spooled during the replay go to a new segment, picked up by the next pass
+                self._seal()
+                segments = sorted(self.directory.glob("*.jsonl")) if self.directory.is_dir() else []
+                if not segments:
+                    break
+                
+                for path in segments:
+                    writes = self._read_segment(path)
+                    for collection, op, run in _group_runs(writes):
+                        await apply(collection, op, run)
+                    path.unlink()
+                    replayed += len(writes)
+            
+            self._pending = False
+            return replayed